@@ -2,16 +2,41 @@ import aiohttp
 import random
 import asyncio
 import logging
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, deque
 from typing import List, Dict, Any
+from rate_limiter import RateLimiter, parse_retry_after
+from usage_tracker import UsageTracker
 
 logger = logging.getLogger(__name__)
 
+# Used when the models endpoint is unavailable and nothing is cached.
+DEFAULT_MODELS = [{"name": "gpt-5-nano", "description": "Default gpt-5 nano model"}]
+
 class APIClient:
     def __init__(self, config):
         self.config = config
         self.session: aiohttp.ClientSession | None = None
         self.retry_attempts = 6
         self.retry_delay = 2
+        self.rate_limiter = RateLimiter(config.llm_rate_per_second, config.llm_burst)
+        # Single-flight table: payload hash -> [shared upstream task, waiter count]
+        self._inflight: Dict[str, list] = {}
+        self.coalesce_stats = {"leaders": 0, "coalesced": 0, "fanout": 0}
+        # Model names from fetch_models; empty means "unknown, allow any".
+        self.model_catalog: set = set()
+        # route -> calls, fallbacks, errors and recent latencies in ms
+        self.route_stats: Dict[str, Dict[str, Any]] = {}
+        # Chained hashes of recently sent message prefixes (model + messages[:i])
+        self._seen_prefixes: OrderedDict = OrderedDict()
+        self.max_seen_prefixes = 4096
+        # route -> [requests, prompt chars, chars in a previously seen prefix]
+        self.prefix_stats: Dict[str, List[int]] = {}
+        self.usage = UsageTracker(config.usage_path, prices=config.token_prices, interval=config.usage_save_s,
+                                  peers=config.usage_peers)
 
     async def initialize(self) -> None:
         if self.session is None or self.session.closed:
@@ -22,17 +47,41 @@ class APIClient:
             await self.session.close()
             self.session = None
 
-    async def _request_json(self, method: str, url: str, **kwargs) -> Dict[str, Any] | str:
+    async def _request_json(self, method: str, url: str, rate_key: tuple | None = None,
+                            attempts: int | None = None, budget_s: float | None = None, **kwargs) -> Dict[str, Any] | str:
+        """Request with retries. ``budget_s`` caps the time spent on requests and
+        retry backoff, but not time queued in the rate limiter."""
         if self.session is None or self.session.closed:
             await self.initialize()
-        for attempt in range(self.retry_attempts):
+        attempts = attempts or self.retry_attempts
+        budget = budget_s
+        for attempt in range(attempts):
+            if rate_key is not None:
+                await self.rate_limiter.acquire(*rate_key)
+            if budget is not None:
+                if budget <= 0:
+                    return f"Error: Request took longer than {budget_s}s"
+                kwargs["timeout"] = aiohttp.ClientTimeout(total=budget)
+            started = time.monotonic()
             try:
                 async with self.session.request(method, url, **kwargs) as resp:
+                    if rate_key is not None:
+                        self.rate_limiter.update_from_headers(resp.headers)
                     if resp.status == 200:
+                        if rate_key is not None:
+                            self.rate_limiter.on_success()
                         return await resp.json()
+                    if resp.status == 429 and rate_key is not None:
+                        # Let the shared bucket pause every caller instead of
+                        # each request sleeping and retrying on its own.
+                        self.rate_limiter.on_throttled(parse_retry_after(resp.headers))
+                        logger.warning(f"Retry {attempt + 1}/{attempts} status 429, waiting on rate limiter")
+                        continue
                     if resp.status in {429, 500, 502, 503, 504}:
                         delay = self.retry_delay * (2 ** attempt) + random.uniform(0, 0.1)
-                        logger.warning(f"Retry {attempt + 1}/{self.retry_attempts} status {resp.status} wait {delay:.2f}s")
+                        if budget is not None and budget - (time.monotonic() - started) <= delay:
+                            return f"Error: API returned status {resp.status} with no time left to retry"
+                        logger.warning(f"Retry {attempt + 1}/{attempts} status {resp.status} wait {delay:.2f}s")
                         await asyncio.sleep(delay)
                         continue
                     try:
@@ -42,35 +91,180 @@ class APIClient:
                     return f"Error: API returned status {resp.status} {error_text}"
             except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
                 delay = self.retry_delay * (2 ** attempt) + random.uniform(0, 0.1)
-                logger.warning(f"Retry {attempt + 1}/{self.retry_attempts} due to {e} wait {delay:.2f}s")
+                if budget is not None and budget - (time.monotonic() - started) <= delay:
+                    return f"Error: Request failed ({str(e) or 'timed out'}) with no time left to retry"
+                logger.warning(f"Retry {attempt + 1}/{attempts} due to {e} wait {delay:.2f}s")
                 await asyncio.sleep(delay)
                 continue
             except Exception as e:
                 logger.error(f"Unexpected exception {e}")
                 return f"Error: Unexpected exception {e}"
+            finally:
+                if budget is not None:
+                    budget -= time.monotonic() - started
         logger.error("API unreachable after retries")
         return "Error: Upstream API unreachable after retries"
 
-    async def fetch_models(self) -> List[Dict[str, str]]:
-        result = await self._request_json("GET", self.config.models_url, timeout=15)
-        if isinstance(result, list):
+    @staticmethod
+    def _parse_models(result) -> List[Dict[str, str]] | None:
+        if isinstance(result, list) and result:
             if all(isinstance(m, str) for m in result):
                 return [{"name": m.strip()} for m in result]
             if all(isinstance(m, dict) and "name" in m for m in result):
                 return [{"name": m["name"].strip(), "description": m.get("description", "")} for m in result]
+        return None
+
+    async def fetch_models(self) -> List[Dict[str, str]]:
+        result = await self._request_json("GET", self.config.models_url, timeout=15)
         # Fallback to the gpt-5-nano model if the models endpoint is unavailable
-        return [{"name": "gpt-5-nano", "description": "Default gpt-5 nano model"}]
+        return self._parse_models(result) or DEFAULT_MODELS
+
+    def load_cached_models(self) -> List[Dict[str, str]] | None:
+        """Model list saved by the last successful refresh, if any."""
+        path = self.config.models_cache_path
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return self._parse_models(json.load(f))
+        except Exception as e:
+            logger.warning(f"Failed to read cached model list: {e}")
+            return None
+
+    async def refresh_models(self) -> List[Dict[str, str]] | None:
+        """Fetch the model list and cache it on disk; None when the endpoint fails."""
+        # Two attempts: the cached list is good enough while the endpoint is flaky.
+        models = self._parse_models(await self._request_json("GET", self.config.models_url, attempts=2, timeout=15))
+        if models is None:
+            return None
+        try:
+            with open(self.config.models_cache_path, "w", encoding="utf-8") as f:
+                json.dump(models, f)
+        except Exception as e:
+            logger.warning(f"Failed to cache model list: {e}")
+        return models
+
+    def set_catalog(self, models: List[Dict[str, str]]) -> None:
+        self.model_catalog = {m["name"].lower() for m in models if m.get("name")}
+
+    def route_candidates(self, route: str, model: str | None) -> List[str]:
+        """Models to try for a route, in order, limited to the known catalog."""
+
+        preferred = self.config.route_models.get(route)
+        chain = [preferred, model, self.config.default_model] if preferred else [model, self.config.default_model]
+        out: List[str] = []
+        for name in chain:
+            if not name or not isinstance(name, str) or not name.strip():
+                continue
+            if self.model_catalog and name.lower() not in self.model_catalog:
+                continue
+            if name not in out:
+                out.append(name)
+        return out or [self.config.default_model]
+
+    def _record(self, route: str, ms: float | None, fallback: bool = False, error: bool = False) -> None:
+        stats = self.route_stats.setdefault(route, {"calls": 0, "fallbacks": 0, "errors": 0, "latency_ms": deque(maxlen=200)})
+        stats["calls"] += 1
+        stats["fallbacks"] += fallback
+        stats["errors"] += error
+        if ms is not None:
+            stats["latency_ms"].append(ms)
+
+    def track_prefix(self, route: str, model: str, messages: list) -> float:
+        """Record how much of this prompt repeats an earlier one, message by message.
+
+        Returns the share of prompt characters covered by the longest prefix
+        of whole messages already sent to the same model recently, which is
+        what a provider-side prompt cache can reuse.
+        """
+
+        digest = hashlib.sha1(model.encode("utf-8"))
+        total = reused = 0
+        matching = True
+        for msg in messages:
+            content = msg.get("content", "")
+            if not isinstance(content, str):
+                content = json.dumps(content, sort_keys=True)
+            text = f"{msg.get('role', '')}\0{content}\0"
+            digest.update(text.encode("utf-8"))
+            key = digest.digest()
+            total += len(text)
+            if matching and key in self._seen_prefixes:
+                reused += len(text)
+                self._seen_prefixes.move_to_end(key)
+            else:
+                matching = False
+                self._seen_prefixes[key] = None
+        while len(self._seen_prefixes) > self.max_seen_prefixes:
+            self._seen_prefixes.popitem(last=False)
+        stats = self.prefix_stats.setdefault(route, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += total
+        stats[2] += reused
+        return reused / total if total else 0.0
+
+    def latency_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per-route call counts and p50/p95 latency over the recent window."""
+
+        out = {}
+        for route, stats in self.route_stats.items():
+            samples = sorted(stats["latency_ms"])
+            pick = lambda q: round(samples[min(int(q * len(samples)), len(samples) - 1)]) if samples else None
+            out[route] = {
+                "model": self.config.route_models.get(route, "user model"),
+                "calls": stats["calls"],
+                "fallbacks": stats["fallbacks"],
+                "errors": stats["errors"],
+                "p50_ms": pick(0.5),
+                "p95_ms": pick(0.95),
+            }
+            prefix = self.prefix_stats.get(route)
+            if prefix and prefix[1]:
+                out[route]["prefix_reuse"] = round(prefix[2] / prefix[1], 3)
+        return out
+
+    async def send_message(self, messages: list, model: str | None, guild_id: str = "global", user_id: str = "",
+                           coalesce: bool = False, route: str = "answer", sources: Dict[str, int] | None = None,
+                           max_tokens: int | None = None, timeout_s: float | None = None, fallback: bool = True):
+        """Complete ``messages`` on the model chosen for ``route``.
+
+        ``model`` is the user's model: used directly for ``answer`` and as a
+        fallback for the fast routes. ``sources`` maps context sources (e.g.
+        information files) to the characters they add, for usage accounting.
+        ``max_tokens`` and ``timeout_s`` override the route's limits (e.g. for
+        batched plans); ``fallback=False`` tries only the route's first model.
+        """
 
-    async def send_message(self, messages: list, model: str | None):
         if self.session is None or self.session.closed:
             await self.initialize()
-        if not model or not isinstance(model, str) or model.strip() == "":
-            model = self.config.default_model
-        logger.info(f"Using model: {model}")
+        candidates = self.route_candidates(route, model)
+        # Only the fast routes are cut short; answers keep the request timeout.
+        # The limit covers the upstream request, not the rate-limiter queue.
+        timeout = timeout_s or (self.config.route_timeout_s if route != "answer" else None)
+        if not fallback:
+            candidates = candidates[:1]
+        result = ""
+        for i, name in enumerate(candidates):
+            started = time.perf_counter()
+            result = await self._send_to_model(messages, name, route, guild_id, user_id, coalesce, sources, max_tokens, timeout)
+            ms = (time.perf_counter() - started) * 1000
+            failed = not isinstance(result, str) or result.startswith("Error:")
+            self._record(route, None if failed else ms, fallback=i > 0, error=failed)
+            if not failed:
+                return result
+            if i + 1 < len(candidates):
+                logger.warning(f"Route {route}: {name} failed ({result[:80]}), falling back to {candidates[i + 1]}")
+        return result
+
+    async def _send_to_model(self, messages: list, model: str, route: str, guild_id: str, user_id: str, coalesce: bool,
+                             sources: Dict[str, int] | None = None, max_tokens: int | None = None,
+                             timeout: float | None = None) -> str:
+        reuse = self.track_prefix(route, model, messages)
+        logger.info(f"Using model: {model} (route {route}, prefix reuse {reuse:.0%})")
         payload = {
             "messages": messages,
             "model": model,
-            "max_tokens": 1024,
+            "max_tokens": max_tokens or self.config.route_max_tokens.get(route, 1024),
             "stream": False
         }
         # The gpt-5-nano model only supports the default temperature of 0.
@@ -80,13 +274,57 @@ class APIClient:
         # selected model is not gpt-5-nano.
         if model.lower() != "gpt-5-nano":
             payload["temperature"] = 0.7
+        meta = {"route": route, "sources": sources, "budget_s": timeout}
+        if coalesce:
+            return await self._coalesced(payload, guild_id, user_id, meta)
+        return await self._complete(payload, guild_id, user_id, meta)
+
+    async def _coalesced(self, payload: Dict[str, Any], guild_id: str, user_id: str, meta: Dict[str, Any]) -> str:
+        """Share one upstream call between identical payloads that are in flight.
+
+        The upstream request runs as its own task and every caller awaits it
+        through ``asyncio.shield`` so a cancelled waiter never cancels the
+        call for the others.
+        """
+
+        key = hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        entry = self._inflight.get(key)
+        if entry is not None:
+            entry[1] += 1
+            self.coalesce_stats["coalesced"] += 1
+            logger.debug(f"Coalesced request onto in-flight call {key[:12]}")
+        else:
+            task = asyncio.ensure_future(self._complete(payload, guild_id, user_id, meta))
+            entry = self._inflight[key] = [task, 1]
+            self.coalesce_stats["leaders"] += 1
+
+            def _done(_task, key=key, entry=entry):
+                self._inflight.pop(key, None)
+                self.coalesce_stats["fanout"] += entry[1]
+                if entry[1] > 1:
+                    logger.info(f"Fanned out one upstream response to {entry[1]} waiters")
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(entry[0])
+
+    async def _complete(self, payload: Dict[str, Any], guild_id: str, user_id: str, meta: Dict[str, Any] | None = None) -> str:
+        meta = meta or {}
         try:
-            result = await self._request_json("POST", self.config.api_url, json=payload, timeout=aiohttp.ClientTimeout(total=30))
+            result = await self._request_json("POST", self.config.api_url, rate_key=(guild_id, user_id), budget_s=meta.get("budget_s"),
+                                              json=payload, timeout=aiohttp.ClientTimeout(total=30))
         except asyncio.TimeoutError:
             return "Error: Request timed out"
         if isinstance(result, str):
             return result
         try:
-            return result["choices"][0]["message"]["content"]
+            content = result["choices"][0]["message"]["content"]
         except (KeyError, IndexError, TypeError) as e:
             return f"Error: Invalid response format {e}"
+        # Coalesced callers share this call, so its usage is counted once, here.
+        self.usage.record(
+            meta.get("route", "answer"), payload["model"], guild_id, user_id, result.get("usage"),
+            sum(len(m.get("content") or "") for m in payload["messages"]), len(content or ""), meta.get("sources"),
+        )
+        return content
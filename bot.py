@@ -3,17 +3,30 @@ from discord.ext import commands
 import asyncio
 import os
 import logging
+import signal
 import aiofiles
 from config import Config
-from api_client import APIClient
+from api_client import APIClient, DEFAULT_MODELS
 from message_handler import MessageHandler
 from memory_manager import MemoryManager
 from commands import setup_commands
-from data_manager import DataManager
+from data_manager import DataManager, SqliteDataManager
+from dune_logic import prefetcher
+from dune_logic.api import api as dune_api
+from loop_monitor import loop_monitor
+from offload import offload
+from image_pipeline import image_pipeline
+from profiler import profiler
+from coriolis_scheduler import CoriolisScheduler
+from message_gate import MessageGate
+from message_debouncer import MessageDebouncer
 
 if not os.path.exists("logs"):
     os.makedirs("logs")
-logging.basicConfig(filename="logs/application.log", level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+# Each process of a multi-process shard deployment gets its own log file.
+_shard_ids_env = os.getenv("SHARD_IDS", "").strip()
+log_file = f"logs/application-shard{_shard_ids_env.replace(',', '-').replace(' ', '')}.log" if _shard_ids_env else "logs/application.log"
+logging.basicConfig(filename=log_file, level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 console = logging.StreamHandler()
 console.setLevel(logging.INFO)
 console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
@@ -21,12 +34,23 @@ logging.getLogger("").addHandler(console)
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
 
 config = Config()
+if config.sharded:
+    bot = commands.AutoShardedBot(
+        command_prefix="!", intents=intents,
+        shard_count=config.shard_count, shard_ids=config.shard_ids,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
+# Messages handled per shard, shown by !shards
+bot.shard_stats = {}
 api_client = APIClient(config)
-memory_manager = MemoryManager()
-data_manager = DataManager("logs/chat_data.json")
+memory_manager = MemoryManager()
+if config.data_backend == "sqlite":
+    data_manager = SqliteDataManager("logs/chat_data.db", config.owns_guild)
+else:
+    data_manager = DataManager("logs/chat_data.json")
 bot.data_manager = data_manager
 message_handler = MessageHandler(api_client, memory_manager, config, data_manager, bot)
 memory_manager.api_client = api_client
@@ -34,45 +58,133 @@ bot.memory_manager = memory_manager
 bot.api_client = api_client
 bot.config = config
 bot.message_handler = message_handler
+bot.coriolis = CoriolisScheduler(bot)
+message_gate = MessageGate(config)
+bot.message_gate = message_gate
+# Set once the first on_ready has run; later on_ready events are reconnects.
+bot.initialized = False
+models_task = None
+
+def apply_models(models):
+    memory_manager.set_models(models)
+    api_client.set_catalog(models)
+    # Keep the configured default model (gpt-5-nano) when available
+    if models and not any(m["name"].lower() == config.default_model.lower() for m in models):
+        config.default_model = models[0]["name"]
+
+def prepare_bot():
+    """One-time startup work that does not need a gateway connection."""
+    # Start from the model list cached by the last refresh instead of waiting on the endpoint
+    models = api_client.load_cached_models()
+    if models:
+        apply_models(models)
+    data_manager.load_data(memory_manager)
+    api_client.usage.load()
+    setup_commands(bot)
+
+async def refresh_models_periodically():
+    while True:
+        try:
+            models = await api_client.refresh_models()
+            if models:
+                apply_models(models)
+                logging.info(f"Refreshed model list ({len(models)} models)")
+            elif not memory_manager.models:
+                apply_models(DEFAULT_MODELS)
+            await asyncio.sleep(config.models_refresh_s)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logging.error(f"Error refreshing model list: {e}")
+            await asyncio.sleep(config.models_refresh_s)
+
+def start_profile(seconds):
+    """Run a sampling profile in the background (SIGUSR1 / PROFILE_ON_START)."""
+    if profiler.running:
+        logging.warning("A profile is already running")
+        return
+
+    async def run():
+        try:
+            await profiler.run(seconds)
+        except Exception as e:
+            logging.error(f"Profiling failed: {e}")
 
-async def setup_bot():
-    await bot.wait_until_ready()
-    # Fetch available models from the Pollinations API
-    models = await api_client.fetch_models()
-    memory_manager.set_models(models)
-    # Keep the configured default model (gpt-5-nano) when available
-    if models and not any(m["name"].lower() == config.default_model.lower() for m in models):
-        config.default_model = models[0]["name"]
-    data_manager.load_data(memory_manager)
-    setup_commands(bot)
-    print(f"Loaded {config.default_model} model")
+    asyncio.create_task(run())
 
-@bot.event
-async def on_ready():
-    print(f"{bot.user} has connected to Discord!")
-    logging.info("Bot is ready and connected.")
-    await setup_bot()
+async def setup_bot():
+    """One-time startup work that needs the first ready connection."""
+    global models_task
+    models_task = asyncio.create_task(refresh_models_periodically())
+    # Warm the Dune Logic search index and popular cards in the background
+    prefetcher.start()
+    # Persist token usage totals periodically
+    api_client.usage.start()
+    # Pre-render Deep Desert uniques and refresh them after each Coriolis reset
+    bot.coriolis.start()
+    if config.profile_on_start:
+        start_profile(config.profile_seconds)
+    try:
+        synced = await bot.tree.sync()
+        logging.info(f"Synced {len(synced)} slash commands")
+    except Exception as e:
+        logging.error(f"Failed to sync slash commands: {e}")
+    print(f"Loaded {config.default_model} model")
+
+@bot.event
+async def on_ready():
+    if bot.initialized:
+        # Reconnect: histories, commands, the model list and the API session are all still live.
+        logging.info("Reconnected to Discord; resuming without re-initializing.")
+        return
+    bot.initialized = True
+    print(f"{bot.user} has connected to Discord!")
+    logging.info("Bot is ready and connected.")
+    await setup_bot()
+
+@bot.event
+async def on_resumed():
+    logging.info("Gateway session resumed.")
 
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
 
-    if message.guild and config.allowed_channels and str(message.channel.id) not in config.allowed_channels:
+    # Drop traffic that is not for the bot before touching memory or disk.
+    trigger = message_gate.check(message, bot.user)
+    if trigger is None:
         return
 
     channel_id = str(message.channel.id)
     guild_id = str(message.guild.id) if message.guild else "DM"
     user_id = str(message.author.id)
-    logging.info(f"Received message from {user_id} in channel {channel_id} (guild: {guild_id}): {message.content}")
-
-    memory_manager.initialize_channel(channel_id)
-    user_model = memory_manager.get_user_model(guild_id, user_id)
-    logging.info(f"User {user_id} using model: {user_model} in guild {guild_id}")
-
-    try:
-        await bot.process_commands(message)
-        await message_handler.handle_message(message)
+    shard_id = message.guild.shard_id if message.guild else 0
+    bot.shard_stats[shard_id] = bot.shard_stats.get(shard_id, 0) + 1
+    logging.info(f"Received message from {user_id} in channel {channel_id} (guild: {guild_id}, trigger: {trigger})")
+    logging.debug(f"Message content from {user_id}: {message.content}")
+
+    if trigger != "command" and message_debouncer is not None:
+        # Rapid follow-ups from the same user are merged into one turn.
+        message_debouncer.submit(message)
+        return
+    await dispatch(message, trigger)
+
+async def dispatch(message, trigger, content=None, committed=None):
+    """Run a command or answer a turn, then save state."""
+    channel_id = str(message.channel.id)
+    user_id = str(message.author.id)
+    try:
+        if trigger == "command":
+            await bot.process_commands(message)
+        else:
+            if profiler.trace_next:
+                # !profile next: deterministic profile of this one turn.
+                profiler.trace_next = False
+                with profiler.trace("handle_message"):
+                    await message_handler.handle_message(message, content, committed)
+            else:
+                await message_handler.handle_message(message, content, committed)
         await data_manager.save_data_async(memory_manager)
     except Exception as e:
         logging.error(f"Error handling message for user {user_id}: {e}")
@@ -84,6 +196,12 @@ async def on_message(message):
     if len(memory_manager.channel_histories.get(channel_id, [])) > config.max_history:
         memory_manager.channel_histories[channel_id] = memory_manager.channel_histories[channel_id][-config.max_history:]
 
+async def dispatch_turn(message, content, committed):
+    await dispatch(message, "turn", content, committed)
+
+message_debouncer = MessageDebouncer(dispatch_turn, config.debounce_ms) if config.debounce_ms > 0 else None
+bot.message_debouncer = message_debouncer
+
 @bot.command(name="wipe")
 async def wipe(ctx):
     try:
@@ -100,6 +218,7 @@ async def wipe(ctx):
             if user_id in bot.memory_manager.user_model_histories[guild_id]:
                 for model in bot.memory_manager.user_model_histories[guild_id][user_id]:
                     bot.memory_manager.user_model_histories[guild_id][user_id][model] = []
+        bot.memory_manager.clear_user_summaries(guild_id, user_id)
 
         await bot.data_manager.save_data_async(bot.memory_manager)
         await ctx.send(f"<@{user_id}> Chat history wiped for this server.")
@@ -135,10 +254,25 @@ async def on_connect():
 
 @bot.event
 async def on_disconnect():
-    await api_client.close()
-    print("Bot disconnected from Discord")
+    # Keep the API session open: in-flight requests finish while the gateway reconnects.
+    logging.info("Bot disconnected from Discord")
 
 async def main():
+    # Move CPU-heavy work off the loop and watch for stalls before connecting.
+    offload.configure(config.offload_mode, config.offload_workers)
+    offload.install(asyncio.get_running_loop())
+    dune_api.cpu_executor = offload.cpu_executor
+    image_pipeline.configure(config.image_max_side, config.image_max_kb * 1024, config.image_format,
+                             config.image_cache_mb * 1024 * 1024)
+    loop_monitor.threshold = config.loop_lag_threshold_ms / 1000
+    loop_monitor.start()
+    profiler.attach(asyncio.get_running_loop())
+    try:
+        # `kill -USR1 <pid>` profiles a running bot for PROFILE_SECONDS.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, start_profile, config.profile_seconds)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass  # No SIGUSR1 on Windows; use !profile there.
+    prepare_bot()
     try:
         await bot.start(config.discord_token)
     except discord.errors.LoginFailure as e:
@@ -148,7 +282,15 @@ async def main():
         logging.error(f"Unexpected error: {e}")
         print(f"Unexpected error: {e}")
     finally:
+        prefetcher.save_stats()
+        api_client.usage.save()
+        if models_task is not None:
+            models_task.cancel()
+        bot.coriolis.shutdown()
+        loop_monitor.stop()
+        offload.shutdown()
         await api_client.close()
+        await image_pipeline.close()
         if not bot.is_closed():
             await bot.close()
 
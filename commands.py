@@ -1,16 +1,75 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
+import asyncio
 import json
 import logging
-from io import BytesIO
-import aiohttp
-import re
+import os
+from datetime import datetime, timezone
+from cachetools import TTLCache
+
+from crafting_graph import parse_quantity_flags
+from send_queue import send_queue
+from image_pipeline import image_pipeline
 
 from dune_logic import search as dune_search
+from dune_logic import get_weekly_uniques_message
+from dune_logic.autocomplete import autocomplete_index
+from loop_monitor import loop_monitor
+from profiler import profiler
 
 
 logger = logging.getLogger(__name__)
 
+# Rendered Dune Logic cards per (locale, path); same lifetime as the API cache.
+_embed_cache: TTLCache = TTLCache(maxsize=512, ttl=900)
+
+
+def card_to_embed(card: dict) -> discord.Embed:
+    """Render a dune_logic card dict as an embed, within Discord's limits."""
+    embed = discord.Embed(
+        title=(card.get("title") or "")[:256] or None,
+        url=card.get("url"),
+        description=(card.get("description") or "")[:4096] or None,
+        color=0xd4a017
+    )
+    if card.get("thumbnail"):
+        embed.set_thumbnail(url=card["thumbnail"])
+    for field in (card.get("fields") or [])[:25]:
+        embed.add_field(
+            name=str(field.get("name") or "-")[:256],
+            value=str(field.get("value") or "-")[:1024],
+            inline=bool(field.get("inline"))
+        )
+    embed.set_footer(text="Dune Awakening Database")
+    return embed
+
+
+class ExplainView(discord.ui.View):
+    """Adds an "Explain" button that asks the LLM about an already rendered card.
+
+    Only the user who asked for the card may press it; the call is rate
+    limited and billed as theirs.
+    """
+
+    def __init__(self, explain, owner_id: int, timeout: float = 300):
+        super().__init__(timeout=timeout)
+        self._explain = explain
+        self.owner_id = owner_id
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id == self.owner_id:
+            return True
+        await interaction.response.send_message("Only the person who looked this up can ask for an explanation.",
+                                                ephemeral=True)
+        return False
+
+    @discord.ui.button(label="Explain", style=discord.ButtonStyle.secondary)
+    async def explain(self, interaction: discord.Interaction, button: discord.ui.Button):
+        button.disabled = True
+        await interaction.response.edit_message(view=self)
+        await self._explain()
+
 
 def setup_commands(bot):
     @bot.command(name="bothelp")
@@ -28,10 +87,20 @@ def setup_commands(bot):
                 "`!savememory <text>` - Save a memory\n"
                 "`!wipe` - Clear chat history\n"
                 "`!search <query>` - Search Dune data\n"
+                "`!top <stat> [filters]` - Rank weapons/armor/vehicles\n"
+                "`!craft <name> [xN] [dd]` - Total materials\n"
+                "`!unlock <name>` - Research and intel needed\n"
                 "`!item <name>` - Lookup item\n"
                 "`!skill <name>` - Lookup skill\n"
                 "`!contract <name>` - Lookup contract\n"
-                "`!npc <name>` - Lookup NPC"
+                "`!npc <name>` - Lookup NPC\n"
+                "`!uniques` - This week's Deep Desert uniques\n"
+                "`!ddsubscribe` / `!ddunsubscribe` - Post uniques here after each Coriolis\n"
+                "`!shards` - Shard latency and load\n"
+                "`!routes` - Model routes and latency\n"
+                "`!loop` - Event loop lag and stalls\n"
+                "`!usage [stage|model|source|user|guild]` - Token usage and cost\n"
+                "`!profile [seconds|next]` - Sample the bot's CPU (owner only)"
             ),
             inline=False
         )
@@ -43,6 +112,155 @@ def setup_commands(bot):
         embed.set_footer(text="Pollinations.ai")
         await ctx.send(embed=embed)
 
+    @bot.command(name="shards")
+    async def shards(ctx):
+        embed = discord.Embed(
+            title="Shard Status",
+            color=0x00ff00,
+            timestamp=discord.utils.utcnow()
+        )
+        shard_info = getattr(bot, "shards", None) or {}
+        shard_ids = sorted(shard_info) if shard_info else [0]
+        for shard_id in shard_ids:
+            shard = shard_info.get(shard_id)
+            latency = shard.latency if shard else bot.latency
+            guilds = sum(1 for g in bot.guilds if g.shard_id == shard_id)
+            handled = getattr(bot, "shard_stats", {}).get(shard_id, 0)
+            embed.add_field(
+                name=f"Shard {shard_id}",
+                value=f"Latency: {latency * 1000:.0f} ms\nGuilds: {guilds}\nMessages: {handled}",
+                inline=True
+            )
+        gate = getattr(bot, "message_gate", None)
+        if gate is not None and gate.stats:
+            embed.add_field(
+                name="Message gate",
+                value=", ".join(f"{trigger}: {count}" for trigger, count in gate.stats.most_common()),
+                inline=False
+            )
+        embed.set_footer(text=f"Process PID {os.getpid()}")
+        await ctx.send(embed=embed)
+
+    @bot.command(name="routes")
+    async def routes(ctx):
+        embed = discord.Embed(
+            title="Model Routes",
+            color=0x00ff00,
+            timestamp=discord.utils.utcnow()
+        )
+        summary = bot.api_client.latency_summary()
+        for route in ("planner", "small_talk", "summary", "answer"):
+            stats = summary.get(route)
+            model = bot.config.route_models.get(route, "user model")
+            if stats is None:
+                embed.add_field(name=route, value=f"Model: {model}\nNo calls yet", inline=True)
+                continue
+            embed.add_field(
+                name=route,
+                value=(
+                    f"Model: {model}\nCalls: {stats['calls']} ({stats['fallbacks']} fallbacks, {stats['errors']} errors)\n"
+                    f"p50 {stats['p50_ms']} ms / p95 {stats['p95_ms']} ms"
+                    + (f"\nPrefix reuse: {stats['prefix_reuse']:.0%}" if "prefix_reuse" in stats else "")
+                ),
+                inline=True
+            )
+        batcher = bot.message_handler.planner_batcher
+        if batcher is not None:
+            bs = batcher.stats
+            embed.set_footer(text=(
+                f"Planner batches {bs['batches']} ({bs['batched']} questions; {bs['failed']} failed, "
+                f"{bs['omitted']} questions omitted), "
+                f"{bs['singles']} planned alone"
+            ))
+        await ctx.send(embed=embed)
+
+    @bot.command(name="loop")
+    async def loop_cmd(ctx):
+        summary = loop_monitor.summary()
+        embed = discord.Embed(
+            title="Event Loop",
+            description=(
+                f"Lag p50 {summary['p50_ms']} ms / p99 {summary['p99_ms']} ms / max {summary['max_ms']} ms\n"
+                f"Stalls over {loop_monitor.threshold * 1000:.0f} ms: {summary['stalls']}"
+            ),
+            color=0x00ff00,
+            timestamp=discord.utils.utcnow()
+        )
+        for stage, count, worst in summary["stages"][:10]:
+            embed.add_field(name=stage[:256], value=f"{count} stalls, worst {worst} ms", inline=False)
+        sq = send_queue.stats
+        embed.set_footer(text=(
+            f"Sends {sq['sent']} ({sq['split']} split replies), edits {sq['edits']} "
+            f"(+{sq['merged_edits']} merged), paced {sq['paced_ms']} ms"
+        ))
+        await ctx.send(embed=embed)
+
+    @bot.command(name="usage")
+    async def usage(ctx, dimension: str = ""):
+        tracker = bot.api_client.usage
+        guild_id = str(ctx.guild.id) if ctx.guild else "DM"
+        dimension = dimension.lower()
+        if dimension not in {"", "stage", "model", "source", "user", "guild"}:
+            await ctx.send("Usage: `!usage [stage|model|source|user|guild]`")
+            return
+        since = discord.utils.format_dt(datetime.fromtimestamp(tracker.since, tz=timezone.utc), "R")
+        embed = discord.Embed(
+            title="Token Usage",
+            description=f"Since {since}" + ("" if tracker.prices else " (set TOKEN_PRICES for cost estimates)"),
+            color=0x00ff00,
+            timestamp=discord.utils.utcnow()
+        )
+
+        def fmt(rows, users=False):
+            lines = []
+            for key, row in rows:
+                label = f"<@{key.split('/', 1)[1]}>" if users else key
+                line = f"{label}: {int(row['calls'])} calls, {int(row['prompt']):,} in / {int(row['completion']):,} out"
+                if row["cost"]:
+                    line += f", ${row['cost']:.4f}"
+                if row["estimated"]:
+                    line += " (est.)"
+                lines.append(line)
+            return "\n".join(lines)[:1024] or "No calls yet"
+
+        # Includes what the other shard processes last saved.
+        totals = tracker.combined()
+        # Users are only listed for the server the command runs in.
+        sections = {
+            "stage": ("By stage", lambda: fmt(tracker.report("stage", totals=totals))),
+            "model": ("By model", lambda: fmt(tracker.report("model", totals=totals))),
+            "source": ("By context source (prompt tokens)", lambda: fmt(tracker.report("source", totals=totals))),
+            "user": ("Top users here", lambda: fmt(tracker.report("user", prefix=f"{guild_id}/", totals=totals), users=True)),
+            "guild": ("This server", lambda: fmt([(guild_id, totals["guild"][guild_id])] if guild_id in totals["guild"] else [])),
+        }
+        for key in ([dimension] if dimension else ["stage", "model", "source", "user"]):
+            name, render = sections[key]
+            embed.add_field(name=name, value=render(), inline=False)
+        await ctx.send(embed=embed)
+
+    @bot.command(name="profile")
+    @commands.is_owner()
+    async def profile(ctx, arg: str = ""):
+        if arg.lower() == "next":
+            profiler.trace_next = True
+            await ctx.send("The next answered message will be profiled with cProfile; the report goes to `logs/`.")
+            return
+        if profiler.running:
+            await ctx.send("A profile is already running.")
+            return
+        try:
+            seconds = min(max(float(arg), 1.0), 300.0) if arg else bot.config.profile_seconds
+        except ValueError:
+            await ctx.send("Usage: `!profile [seconds|next]`")
+            return
+        await ctx.send(f"Sampling all threads for {seconds:.0f}s...")
+        result = await profiler.run(seconds)
+        top = "\n".join(f"`{name}`" for name in result["top_lines"]) or "No samples"
+        await ctx.send(
+            f"Collapsed stacks: `{result['collapsed']}`\nTop functions: `{result['top']}`\n"
+            f"Hottest (self time):\n{top}"
+        )
+
     @bot.command(name="savememory")
     async def savememory(ctx, *, memory_text):
         channel_id = str(ctx.channel.id)
@@ -59,36 +277,16 @@ def setup_commands(bot):
         await ctx.send(f"<@{user_id}>", embed=embed)
 
     async def _send_response(ctx, final_message, user_id):
-        files = []
-        for url in final_message.get("images", []):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as resp:
-                        if resp.status == 200:
-                            data = await resp.read()
-                            filename = url.split("/")[-1].split("?")[0] or "image.png"
-                            if not re.search(r"\.(png|jpg|jpeg|gif|webp)$", filename, re.IGNORECASE):
-                                filename += ".png"
-                            files.append(discord.File(BytesIO(data), filename=filename))
-            except Exception as e:
-                logger.warning(f"Failed to fetch image {url}: {e}")
+        # Downscaled, re-encoded and cached per URL before upload.
+        files = await image_pipeline.fetch_all(final_message.get("images", []))
 
         content = final_message.get("content", "")
         if not content and not files:
-            await ctx.send(f"<@{user_id}> (No content)")
+            await send_queue.send(ctx, f"<@{user_id}> (No content)")
             return
 
-        if content and len(content) <= 2000:
-            await ctx.send(content, files=files if files else None)
-        elif content and len(content) <= 4096:
-            embed = discord.Embed(description=content[:4096])
-            await ctx.send(embed=embed, files=files if files else None)
-        else:
-            if content:
-                buffer = BytesIO(content.encode("utf-8"))
-                text_file = discord.File(buffer, filename="response.txt")
-                files = files + [text_file]
-            await ctx.send(f"<@{user_id}> Response too long, attached as file and images:", files=files)
+        # Long answers go out as several messages, split on markdown and code-block boundaries.
+        await send_queue.send_text(ctx, content, files=files or None)
 
     async def _dune_query(ctx, query: str, data: dict):
         user_id = str(ctx.author.id)
@@ -103,14 +301,96 @@ def setup_commands(bot):
             {"role": "user", "content": query},
         ]
         try:
-            ai_response = await bot.api_client.send_message(messages, model)
+            ai_response = await bot.api_client.send_message(messages, model, guild_id, user_id)
         except Exception as e:
-            await ctx.send(f"<@{user_id}> Error: Failed to fetch response - {e}")
+            await send_queue.send(ctx, f"<@{user_id}> Error: Failed to fetch response - {e}")
             return
         ai_response_clean = bot.message_handler.clean_response(ai_response) or "Got it."
         final_message = bot.message_handler.build_message(ai_response_clean)
         await _send_response(ctx, final_message, user_id)
 
+    @bot.command(name="top")
+    async def top_cmd(ctx, *, query: str):
+        handler = bot.message_handler
+        found = handler.stats_engine.rank_any(handler.normalize_text(query), k=10)
+        if found is None:
+            await ctx.send(f'No stat found in "{query}". Try e.g. `!top dps sidearm` or `!top armor boots`.')
+            return
+        domain, result = found
+        metric = result["metric"]
+        lines = [f"**Top {domain} by {metric.replace('_', ' ')}**"]
+        for i, row in enumerate(result["rows"], 1):
+            tags = ", ".join(str(row[f]) for f in handler.stats_engine.tables[domain].labels if row.get(f))
+            lines.append(f"{i}. {row['name']} - {row[metric]:g}" + (f" ({tags})" if tags else ""))
+        if not result["rows"]:
+            lines.append("No matching entries.")
+        await _send_response(ctx, {"content": "\n".join(lines), "images": []}, str(ctx.author.id))
+
+    @bot.command(name="craft")
+    async def craft_cmd(ctx, *, query: str):
+        graph = bot.message_handler.crafting_graph
+        name, quantity, deep_desert = parse_quantity_flags(query)
+        result = graph.raw_materials(name, quantity, deep_desert)
+        if result is None:
+            # Misspelled names: retry with the catalog's canonical name.
+            entity = bot.message_handler.resolve_entity(name)
+            if entity is not None:
+                result = graph.raw_materials(entity.name, quantity, deep_desert)
+        if result is None:
+            await ctx.send(f'No recipe found for "{name}".')
+            return
+        lines = [f"**{result['item']} x{quantity}**" + (" (Deep Desert)" if deep_desert else "")]
+        if result["station"]:
+            lines.append(f"Station: {result['station']}")
+        lines.append("Ingredients:")
+        lines += [f"- x{qty} {ing}" for ing, qty in result["direct"].items()]
+        if result["raw"] != result["direct"]:
+            lines.append("Raw materials:")
+            lines += [f"- x{qty} {mat}" for mat, qty in result["raw"].items()]
+        await _send_response(ctx, {"content": "\n".join(lines), "images": []}, str(ctx.author.id))
+
+    @bot.command(name="unlock")
+    async def unlock_cmd(ctx, *, query: str):
+        graph = bot.message_handler.crafting_graph
+        entity = bot.message_handler.resolve_entity(query)
+        if graph.resolve(query) is None and entity is not None:
+            query = entity.name
+        intel = graph.intel_to_unlock(query)
+        links = graph.what_unlocks(query)
+        if intel is None and not (links and links["used_in"]):
+            await ctx.send(f'Nothing known about unlocking "{query}".')
+            return
+        lines = [f"**{(intel or links)['item']}**"]
+        for opt in (intel or {}).get("research", []):
+            cost = f"{opt['intel_cost']} intel" if opt["intel_cost"] is not None else "intel cost unknown"
+            tier = f", {opt['tier']} tier needs {opt['tier_intel_spent_required']} intel spent" if opt["tier"] else ""
+            lines.append(f"- Research **{opt['research']}**: {cost}{tier}")
+        if links and links["used_in"]:
+            lines.append("Used in: " + ", ".join(links["used_in"][:15]) + (" ..." if len(links["used_in"]) > 15 else ""))
+        await _send_response(ctx, {"content": "\n".join(lines), "images": []}, str(ctx.author.id))
+
+    @bot.command(name="uniques")
+    async def uniques_cmd(ctx):
+        msg = await get_weekly_uniques_message()
+        await ctx.send(msg["content"])
+
+    @bot.command(name="ddsubscribe")
+    @commands.has_permissions(manage_channels=True)
+    async def ddsubscribe(ctx):
+        guild_id = str(ctx.guild.id) if ctx.guild else "DM"
+        if bot.coriolis.subscribe(str(ctx.channel.id), guild_id):
+            await ctx.send("This channel will get the Deep Desert uniques after each Coriolis storm.")
+        else:
+            await ctx.send("This channel is already subscribed.")
+
+    @bot.command(name="ddunsubscribe")
+    @commands.has_permissions(manage_channels=True)
+    async def ddunsubscribe(ctx):
+        if bot.coriolis.unsubscribe(str(ctx.channel.id)):
+            await ctx.send("Unsubscribed from Deep Desert uniques.")
+        else:
+            await ctx.send("This channel is not subscribed.")
+
     @bot.command(name="search")
     async def search_cmd(ctx, *, query: str):
         locale = "en"
@@ -120,17 +400,43 @@ def setup_commands(bot):
 
     async def _lookup_and_query(ctx, query: str, types: list):
         locale = "en"
-        results = await dune_search.search_autocomplete(locale, query, types)
-        if not results:
-            await ctx.send(f'No results found for "{query}".')
-            return
-        path = results[0].get("path")
-        try:
-            _, card = await dune_search.route_path(locale, path)
-        except Exception:
-            await ctx.send(f'Could not retrieve data for "{query}".')
-            return
-        await _dune_query(ctx, query, card)
+        if "/" in query and (not types or query.split("/", 1)[0] in types):
+            # A path picked from slash-command autocomplete.
+            path = query
+        else:
+            results = await dune_search.search_autocomplete(locale, query, types)
+            entity = None if results else bot.message_handler.resolve_entity(query)
+            if entity is not None:
+                if entity.logic_path and (not types or entity.logic_path.split("/", 1)[0] in types):
+                    results = [{"name": entity.name, "path": entity.logic_path}]
+                else:
+                    results = await dune_search.search_autocomplete(locale, entity.name, types)
+            if not results:
+                await ctx.send(f'No results found for "{query}".')
+                return
+            path = results[0].get("path")
+        cache_key = (locale, path)
+        cached = _embed_cache.get(cache_key) if bot.config.card_render_mode == "embed" else None
+        if cached is not None:
+            embed, card = cached
+        else:
+            try:
+                _, card = await dune_search.route_path(locale, path)
+            except Exception:
+                await ctx.send(f'Could not retrieve data for "{query}".')
+                return
+            if bot.config.card_render_mode != "embed":
+                await _dune_query(ctx, query, card)
+                return
+            embed = card_to_embed(card)
+            if card.get("title"):
+                # Cards for missing entities only carry a description; don't keep those.
+                _embed_cache[cache_key] = (embed, card)
+
+        async def explain():
+            await _dune_query(ctx, query if path != query else (card.get("title") or query), card)
+
+        await ctx.send(embed=embed.copy(), view=ExplainView(explain, ctx.author.id))
 
     @bot.command(name="item")
     async def item_cmd(ctx, *, query: str):
@@ -147,3 +453,63 @@ def setup_commands(bot):
     @bot.command(name="npc")
     async def npc_cmd(ctx, *, query: str):
         await _lookup_and_query(ctx, query, ["npcs"])
+
+    # Slash commands. Autocomplete is served from the in-memory index the
+    # prefetcher builds, so keystrokes never wait on the network.
+    autocomplete_seq: dict = {}
+
+    def _autocomplete_for(types):
+        async def complete(interaction: discord.Interaction, current: str):
+            user_id = interaction.user.id
+            seq = autocomplete_seq.get(user_id, 0) + 1
+            autocomplete_seq[user_id] = seq
+            await asyncio.sleep(bot.config.autocomplete_debounce_ms / 1000)
+            if autocomplete_seq.get(user_id) != seq:
+                # Superseded by a newer keystroke from the same user.
+                return []
+            del autocomplete_seq[user_id]
+            suggestions = autocomplete_index.suggest(
+                "en", current, types, limit=25, budget_ms=bot.config.autocomplete_budget_ms
+            )
+            return [app_commands.Choice(name=s["name"][:100], value=s["path"][:100]) for s in suggestions]
+        return complete
+
+    async def _slash_lookup(interaction: discord.Interaction, query: str, types: list):
+        await interaction.response.defer(thinking=True)
+        ctx = await commands.Context.from_interaction(interaction)
+        await _lookup_and_query(ctx, query, types)
+
+    @bot.tree.command(name="item", description="Look up an item")
+    @app_commands.describe(query="Item name")
+    @app_commands.autocomplete(query=_autocomplete_for(["items"]))
+    async def item_slash(interaction: discord.Interaction, query: str):
+        await _slash_lookup(interaction, query, ["items"])
+
+    @bot.tree.command(name="skill", description="Look up a skill")
+    @app_commands.describe(query="Skill name")
+    @app_commands.autocomplete(query=_autocomplete_for(["skills"]))
+    async def skill_slash(interaction: discord.Interaction, query: str):
+        await _slash_lookup(interaction, query, ["skills"])
+
+    @bot.tree.command(name="npc", description="Look up an NPC")
+    @app_commands.describe(query="NPC name")
+    @app_commands.autocomplete(query=_autocomplete_for(["npcs"]))
+    async def npc_slash(interaction: discord.Interaction, query: str):
+        await _slash_lookup(interaction, query, ["npcs"])
+
+    @bot.tree.command(name="contract", description="Look up a contract")
+    @app_commands.describe(query="Contract name")
+    @app_commands.autocomplete(query=_autocomplete_for(["contracts"]))
+    async def contract_slash(interaction: discord.Interaction, query: str):
+        await _slash_lookup(interaction, query, ["contracts"])
+
+    @bot.tree.command(name="search", description="Search the Dune database")
+    @app_commands.describe(query="Anything: items, skills, NPCs, contracts, buildings")
+    @app_commands.autocomplete(query=_autocomplete_for(None))
+    async def search_slash(interaction: discord.Interaction, query: str):
+        if "/" in query:
+            await _slash_lookup(interaction, query, [])
+            return
+        await interaction.response.defer(thinking=True)
+        ctx = await commands.Context.from_interaction(interaction)
+        await search_cmd(ctx, query=query)
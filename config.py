@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 import re
 import logging
+from usage_tracker import parse_prices
 
 logger = logging.getLogger(__name__)
 
@@ -59,21 +60,148 @@ class Config:
             raise FileNotFoundError("info_request_instructions.txt not found")
         self.api_url = f"https://text.pollinations.ai/openai?token={self.pollinations_token}"
         self.models_url = "https://text.pollinations.ai/models"
+        # The model list is cached here so startup never waits on the endpoint;
+        # it is refreshed in the background every MODELS_REFRESH_S seconds.
+        self.models_cache_path = os.getenv("MODELS_CACHE_PATH", "logs/models_cache.json")
+        self.models_refresh_s = int(os.getenv("MODELS_REFRESH_S", "21600"))
         allowed_channels_env = os.getenv("ALLOWED_CHANNELS", "").strip()
         if allowed_channels_env:
             # Support comma or whitespace separated lists and remove empty entries
-            self.allowed_channels = [
+            self.allowed_channels = {
                 c.strip() for c in re.split(r"[\s,]+", allowed_channels_env) if c.strip()
-            ]
+            }
         else:
-            # Empty list means all channels are allowed
-            self.allowed_channels = []
+            # Empty set means all channels are allowed
+            self.allowed_channels = set()
         logger.info(
             "Allowed channels: %s",
-            self.allowed_channels if self.allowed_channels else "all",
+            sorted(self.allowed_channels) if self.allowed_channels else "all",
         )
+        # What makes the bot answer a message: "mention", "reply" (to the bot),
+        # "keyword", "dm", "channel" (any message in BOT_CHANNELS) or "all".
+        # Other messages are dropped before touching memory or disk; "!"
+        # commands always run.
+        self.response_triggers = {
+            t.strip().lower() for t in re.split(r"[\s,]+", os.getenv("RESPONSE_TRIGGERS", "mention,reply,keyword,dm,channel")) if t.strip()
+        }
+        # Dedicated bot channels; defaults to ALLOWED_CHANNELS so a restricted
+        # bot keeps answering everything in its channels.
+        bot_channels_env = os.getenv("BOT_CHANNELS", "").strip()
+        self.bot_channels = (
+            {c.strip() for c in re.split(r"[\s,]+", bot_channels_env) if c.strip()}
+            if bot_channels_env else set(self.allowed_channels)
+        )
+        self.trigger_keywords = [
+            k.strip().lower() for k in os.getenv("TRIGGER_KEYWORDS", "dune bot,dunebot").split(",") if k.strip()
+        ]
+        # Messages from one user in one channel arriving within DEBOUNCE_MS of
+        # each other are answered as one turn; a newer message cancels the
+        # unanswered earlier one. 0 answers every message on its own.
+        self.debounce_ms = float(os.getenv("DEBOUNCE_MS", "0"))
+        # Sharding: SHARD_COUNT is the total across every process and
+        # SHARD_IDS the subset this process runs. Leave both unset to run
+        # a single unsharded bot.
+        shard_count_env = os.getenv("SHARD_COUNT", "").strip()
+        self.shard_count = int(shard_count_env) if shard_count_env else None
+        shard_ids_env = os.getenv("SHARD_IDS", "").strip()
+        self.shard_ids = (
+            [int(s) for s in re.split(r"[\s,]+", shard_ids_env) if s.strip()]
+            if shard_ids_env else None
+        )
+        if self.shard_ids and not self.shard_count:
+            logger.error("SHARD_IDS is set without SHARD_COUNT")
+            raise ValueError("SHARD_IDS requires SHARD_COUNT to be set")
+        self.sharded = self.shard_count is not None
+        # Several processes can only share state through the SQLite store.
+        default_backend = "sqlite" if self.sharded else "json"
+        self.data_backend = os.getenv("DATA_BACKEND", default_backend).strip().lower()
+        if self.sharded and self.data_backend != "sqlite":
+            logger.warning("Sharded mode needs the shared SQLite store; ignoring DATA_BACKEND=%s", self.data_backend)
+            self.data_backend = "sqlite"
         self.max_history = 20
         self.max_memories = 5
+        # Client-side token bucket for Pollinations calls: sustained requests
+        # per second and how many may burst at once.
+        self.llm_rate_per_second = float(os.getenv("LLM_RATE_PER_SECOND", "1.0"))
+        self.llm_burst = int(os.getenv("LLM_BURST", "3"))
+        # "embed" renders !item/!skill/!npc/!contract cards directly with an
+        # Explain button; "llm" restates every card through the model.
+        self.card_render_mode = os.getenv("CARD_RENDER_MODE", "embed").strip().lower()
+        # Slash-command autocomplete: per-user debounce window and the time
+        # budget for one index lookup, both in milliseconds.
+        self.autocomplete_debounce_ms = int(os.getenv("AUTOCOMPLETE_DEBOUNCE_MS", "60"))
+        self.autocomplete_budget_ms = float(os.getenv("AUTOCOMPLETE_BUDGET_MS", "30"))
+        # Start heuristic file and Dune Logic retrieval alongside the planner
+        # call and reconcile with the plan once it arrives.
+        self.pipeline_retrieval = os.getenv("PIPELINE_RETRIEVAL", "1").strip().lower() not in {"0", "false", "no"}
+        # Rolling history summaries: once a user's model history reaches
+        # SUMMARY_THRESHOLD turns (0 disables), older turns are folded into a
+        # summary in the background, keeping the last SUMMARY_KEEP_TURNS raw.
+        self.summary_threshold = int(os.getenv("SUMMARY_THRESHOLD", "12"))
+        self.summary_keep_turns = int(os.getenv("SUMMARY_KEEP_TURNS", "6"))
+        # Model used for summaries; empty means the fast model.
+        self.summary_model = os.getenv("SUMMARY_MODEL", "").strip()
+        # Query-class routing: planner calls, small talk and summaries go to a
+        # low-latency model with their own max_tokens; only the grounded
+        # answer uses the user's model. A fast route that errors or takes
+        # longer than ROUTE_TIMEOUT_S falls back to the next model.
+        self.fast_model = os.getenv("FAST_MODEL", "gpt-5-nano").strip()
+        self.route_models = {
+            "planner": os.getenv("PLANNER_MODEL", "").strip() or self.fast_model,
+            "small_talk": os.getenv("SMALL_TALK_MODEL", "").strip() or self.fast_model,
+            "summary": self.summary_model or self.fast_model,
+        }
+        self.route_max_tokens = {
+            "planner": int(os.getenv("PLANNER_MAX_TOKENS", "300")),
+            "small_talk": int(os.getenv("SMALL_TALK_MAX_TOKENS", "256")),
+            "summary": int(os.getenv("SUMMARY_MAX_TOKENS", "400")),
+            "answer": int(os.getenv("ANSWER_MAX_TOKENS", "1024")),
+        }
+        self.route_timeout_s = float(os.getenv("ROUTE_TIMEOUT_S", "8"))
+        # Planner calls arriving within PLANNER_BATCH_MS of each other (up to
+        # PLANNER_BATCH_MAX) are planned in one request; 0 plans each alone.
+        self.planner_batch_ms = float(os.getenv("PLANNER_BATCH_MS", "0"))
+        self.planner_batch_max = int(os.getenv("PLANNER_BATCH_MAX", "8"))
+        # "stable" puts instructions and information files first, serialized
+        # canonically, so requests share a long cacheable prefix; "classic"
+        # keeps the original order (history before the data).
+        self.prompt_layout = os.getenv("PROMPT_LAYOUT", "stable").strip().lower()
+        # Memory-mapped snapshot of the compiled information files, shared by
+        # every bot process on the host; "off" parses the files per process.
+        snapshot_env = os.getenv("KNOWLEDGE_SNAPSHOT", "logs/knowledge.snap").strip()
+        self.knowledge_snapshot = "" if snapshot_env.lower() in {"", "off", "0", "false"} else snapshot_env
+        # Event-loop stalls longer than this are logged with a stack sample.
+        self.loop_lag_threshold_ms = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+        # Sampling profiler: !profile (owner only) or SIGUSR1 samples every
+        # thread for PROFILE_SECONDS; PROFILE_ON_START=1 also profiles the
+        # first PROFILE_SECONDS after startup. Reports go to logs/.
+        self.profile_seconds = float(os.getenv("PROFILE_SECONDS", "30"))
+        self.profile_on_start = os.getenv("PROFILE_ON_START", "0").strip().lower() in {"1", "true", "yes", "on"}
+        # Where CPU-heavy steps (JSON encode/decode, saves, search scans) run:
+        # "thread", "process" (pure functions in a process pool) or "inline".
+        self.offload_mode = os.getenv("OFFLOAD_MODE", "thread").strip().lower()
+        self.offload_workers = int(os.getenv("OFFLOAD_WORKERS", "4"))
+        # Token usage is kept per stage, model, user and information file and
+        # saved to logs/usage_stats.json every USAGE_SAVE_S seconds.
+        # TOKEN_PRICES ("model=prompt/completion,...", USD per million tokens)
+        # turns it into an estimated cost; unpriced models cost 0.
+        self.token_prices = parse_prices(os.getenv("TOKEN_PRICES", ""))
+        self.usage_save_s = int(os.getenv("USAGE_SAVE_S", "300"))
+        # Sharded processes each keep their own file (named after their shard
+        # ids) and !usage adds up all of them.
+        if self.sharded:
+            self.usage_path = f"logs/usage_stats-shards-{'-'.join(map(str, self.shard_ids or [0]))}.json"
+            self.usage_peers = "logs/usage_stats-shards-*.json"
+        else:
+            self.usage_path = "logs/usage_stats.json"
+            self.usage_peers = ""
+        # Reply images are downscaled to IMAGE_MAX_SIDE pixels and re-encoded
+        # (IMAGE_FORMAT webp or jpeg) under IMAGE_MAX_KB without metadata;
+        # results are cached per URL up to IMAGE_CACHE_MB.
+        self.image_max_side = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+        self.image_max_kb = int(os.getenv("IMAGE_MAX_KB", "1024"))
+        self.image_format = os.getenv("IMAGE_FORMAT", "webp").strip().lower()
+        self.image_cache_mb = int(os.getenv("IMAGE_CACHE_MB", "32"))
         self.code_keywords = [
             "code", "script", "program", "function", "class",
             "method", "javascript", "python", "java", "html", "css"
@@ -85,6 +213,15 @@ class Config:
         self.code_block_regex = r"```(\w*)\n([\s\S]*?)\n```"
         self.url_regex = r"https?://[^\s>]+"
 
+    def owns_guild(self, guild_id: str) -> bool:
+        """Whether this process runs the shard that receives ``guild_id``."""
+        if not self.shard_ids:
+            return True
+        if guild_id == "DM":
+            # Discord delivers direct messages to shard 0.
+            return 0 in self.shard_ids
+        return (int(guild_id) >> 22) % self.shard_count in self.shard_ids
+
     def is_image_request(self, message: str) -> bool:
         return any(keyword in message.lower() for keyword in self.image_keywords)
 
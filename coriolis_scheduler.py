@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from dune_logic import refresh_weekly_uniques
+
+logger = logging.getLogger(__name__)
+
+class CoriolisScheduler:
+    """Re-render the Deep Desert weekly uniques right after each Coriolis reset.
+
+    A one-shot job is scheduled for ``nextCoriolisTime`` plus a short grace
+    period. If the live data has not rolled over yet, the job retries a few
+    minutes later. Each new week is posted to the subscribed channels.
+    """
+
+    def __init__(self, bot, subscriptions_path: str = "logs/dd_subscriptions.json",
+                 grace_seconds: int = 60, retry_seconds: int = 300):
+        self.bot = bot
+        self.subscriptions_path = subscriptions_path
+        self.grace_seconds = grace_seconds
+        self.retry_seconds = retry_seconds
+        # channel id -> guild id ("DM" for direct messages)
+        self.subscriptions: Dict[str, str] = {}
+        self.scheduler = AsyncIOScheduler(timezone=timezone.utc)
+        self._announced: Optional[int] = None
+        self.load_subscriptions()
+
+    def load_subscriptions(self) -> None:
+        if not os.path.exists(self.subscriptions_path):
+            return
+        try:
+            with open(self.subscriptions_path, "r", encoding="utf-8") as f:
+                self.subscriptions = {str(k): str(v) for k, v in json.load(f).items()}
+        except Exception as e:
+            logger.warning(f"Failed to load Deep Desert subscriptions: {e}")
+
+    def _update(self, change: Callable[[Dict[str, str]], bool]) -> bool:
+        """Apply ``change`` to the latest saved subscriptions and write them back.
+
+        Sharded processes share the file, so it is re-read and replaced
+        atomically under a lock instead of overwritten with this process's
+        copy. Returns what ``change`` returned (whether anything changed).
+        """
+        lock = open(f"{self.subscriptions_path}.lock", "a+") if fcntl is not None else None
+        try:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load_subscriptions()
+            changed = change(self.subscriptions)
+            if changed:
+                tmp = f"{self.subscriptions_path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self.subscriptions, f)
+                os.replace(tmp, self.subscriptions_path)
+            return changed
+        except Exception as e:
+            logger.warning(f"Failed to save Deep Desert subscriptions: {e}")
+            return False
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+
+    def subscribe(self, channel_id: str, guild_id: str) -> bool:
+        def add(subs: Dict[str, str]) -> bool:
+            if channel_id in subs:
+                return False
+            subs[channel_id] = guild_id
+            return True
+
+        return self._update(add)
+
+    def unsubscribe(self, channel_id: str) -> bool:
+        return self._update(lambda subs: subs.pop(channel_id, None) is not None)
+
+    def _schedule(self, when: datetime) -> None:
+        self.scheduler.add_job(self.refresh, "date", run_date=when, id="coriolis_refresh",
+                               replace_existing=True, misfire_grace_time=3600)
+        logger.info(f"Next Deep Desert uniques refresh at {when.isoformat()}")
+
+    async def refresh(self, announce: bool = True) -> None:
+        try:
+            msg = await refresh_weekly_uniques()
+        except Exception as e:
+            logger.error(f"Deep Desert uniques refresh failed: {e}")
+            msg = {}
+        next_time = msg.get("next_coriolis_time")
+        now = time.time()
+        if not next_time or next_time <= now:
+            if self._announced is None and next_time:
+                # Started during the rollover gap: treat the stale week as
+                # announced so the retry that sees the new one posts it.
+                self._announced = next_time
+            # Live data not rolled over (or unavailable) yet; try again shortly.
+            self._schedule(datetime.now(timezone.utc) + timedelta(seconds=self.retry_seconds))
+            return
+        if announce and self._announced is not None and next_time != self._announced:
+            await self.announce(msg)
+        self._announced = next_time
+        self._schedule(datetime.fromtimestamp(next_time + self.grace_seconds, timezone.utc))
+
+    async def announce(self, msg: Dict) -> None:
+        owns_guild = getattr(self.bot.config, "owns_guild", None)
+        # Pick up channels subscribed through other shard processes.
+        self.load_subscriptions()
+        sent = 0
+        for channel_id, guild_id in list(self.subscriptions.items()):
+            if owns_guild is not None and not owns_guild(guild_id):
+                continue
+            channel = self.bot.get_channel(int(channel_id))
+            if channel is None:
+                continue
+            try:
+                await channel.send(msg["content"])
+                sent += 1
+            except Exception as e:
+                logger.warning(f"Failed to post Deep Desert uniques to {channel_id}: {e}")
+        logger.info(f"Posted new Deep Desert uniques to {sent} channels")
+
+    def start(self) -> None:
+        """Render the current week now and schedule the next refresh (once)."""
+        if self.scheduler.running:
+            return
+        self.scheduler.start()
+        self.scheduler.add_job(self.refresh, "date", run_date=datetime.now(timezone.utc),
+                               id="coriolis_refresh", replace_existing=True, kwargs={"announce": False})
+
+    def shutdown(self) -> None:
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
@@ -0,0 +1,274 @@
+import math
+import re
+import logging
+from typing import Any, Dict, List, Tuple
+
+from entity_catalog import TIER_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+CRAFT_TERMS = {
+    "craft", "crafting", "materials", "mats", "cost", "costs", "recipe", "ingredients",
+    "unlock", "unlocks", "intel", "research", "build", "need", "needed", "resources",
+}
+
+def node_key(name: str) -> str:
+    """Normalize an entity name: lowercase, no "(Placeable)"-style suffix."""
+    name = re.sub(r"\([^)]*\)", " ", str(name).lower())
+    name = re.sub(r"[^a-z0-9]+", " ", name)
+    return name.strip()
+
+class Recipe:
+    __slots__ = ("name", "station", "ingredients", "output_qty", "source")
+
+    def __init__(self, name: str, station: str, ingredients: Dict[str, Any], output_qty: int, source: str):
+        self.name = name
+        self.station = station
+        self.ingredients: Tuple[Tuple[str, int], ...] = tuple(
+            (ing, int(qty)) for ing, qty in ingredients.items() if isinstance(qty, (int, float))
+        )
+        self.output_qty = max(int(output_qty or 1), 1)
+        self.source = source
+
+class CraftingGraph:
+    """Crafting and research dependency graph over the information files.
+
+    Built once at load time from weapon/armor/vehicle recipes, building and
+    station build costs, and research unlocks. Per-unit raw material
+    expansions are memoized, so repeated questions only scale a cached
+    vector.
+    """
+
+    def __init__(self, game_data: Dict[str, Any]):
+        self.names: Dict[str, str] = {}
+        self.recipes: Dict[str, Recipe] = {}
+        self.used_in: Dict[str, List[str]] = {}
+        self.research_by_unlock: Dict[str, List[Dict[str, Any]]] = {}
+        self.intel_tiers: Dict[str, int] = {}
+        self._raw_memo: Dict[str, Dict[str, float]] = {}
+
+        self._load_weapons(game_data.get("weapons"))
+        self._load_armor(game_data.get("armor"))
+        self._load_vehicles(game_data.get("vehicles"))
+        self._load_buildings(game_data.get("buildings"))
+        self._load_research(game_data.get("research"))
+        for key, recipe in self.recipes.items():
+            for ing, _ in recipe.ingredients:
+                self.used_in.setdefault(node_key(ing), []).append(key)
+        logger.info(f"Crafting graph: {len(self.recipes)} recipes, {len(self.research_by_unlock)} research unlocks")
+
+    def _add(self, name: str, station: str, ingredients: Any, source: str, output_qty: int = 1) -> None:
+        if not name or not isinstance(ingredients, dict) or not ingredients:
+            return
+        key = node_key(name)
+        self.names.setdefault(key, name)
+        for ing in ingredients:
+            self.names.setdefault(node_key(ing), ing)
+        # Keep the first recipe seen when a file lists alternatives.
+        self.recipes.setdefault(key, Recipe(name, station, ingredients, output_qty, source))
+
+    def _load_weapons(self, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+        for entries in (data.get("weapons") or {}).values():
+            if not isinstance(entries, dict):
+                continue
+            for key, entry in entries.items():
+                if isinstance(entry, dict):
+                    self._add(entry.get("name") or key, entry.get("crafting_station", ""), entry.get("ingredients"), "weapons")
+
+    def _load_armor(self, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+        for entry in data.get("armor_items") or []:
+            crafting = (entry or {}).get("crafting") or {}
+            ingredients = dict(crafting.get("ingredients") or {})
+            if crafting.get("water_cost"):
+                ingredients.setdefault("Water", crafting["water_cost"])
+            self._add(entry.get("name"), crafting.get("station", ""), ingredients, "armor")
+
+    def _load_vehicles(self, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+
+        def add_crafted(name, crafted_at):
+            options = crafted_at if isinstance(crafted_at, list) else [crafted_at]
+            for opt in options:
+                if isinstance(opt, dict):
+                    self._add(name, opt.get("station", ""), opt.get("ingredients"), "vehicles", opt.get("output_qty", 1))
+
+        for parts in (data.get("parts") or {}).values():
+            for part in parts or []:
+                if isinstance(part, dict):
+                    add_crafted(part.get("name"), part.get("crafted_at"))
+        for group in ("fuel", "tools"):
+            for key, entry in (data.get(group) or {}).items():
+                if isinstance(entry, dict) and entry.get("crafted_at"):
+                    add_crafted(entry.get("name") or key, entry["crafted_at"])
+        for key, entry in (data.get("stations") or {}).items():
+            if isinstance(entry, dict):
+                self._add(entry.get("name") or key, "Construction Tool", entry.get("build_cost"), "vehicles")
+
+    def _load_buildings(self, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+        for entry in data.get("placeables") or []:
+            if isinstance(entry, dict):
+                self._add(entry.get("name"), "Construction Tool", entry.get("build_cost"), "buildings")
+
+    def _load_research(self, data: Any) -> None:
+        if not isinstance(data, dict):
+            return
+        self.intel_tiers = {k: v for k, v in (data.get("intel_tiers") or {}).items() if isinstance(v, int)}
+        for entry in data.get("research_items") or []:
+            if not isinstance(entry, dict):
+                continue
+            for unlock in entry.get("unlocks") or []:
+                key = node_key(unlock)
+                self.names.setdefault(key, re.sub(r"\s*\([^)]*\)", "", unlock))
+                self.research_by_unlock.setdefault(key, []).append(entry)
+
+    def resolve(self, text: str) -> str | None:
+        """Map free text to a node key: exact match, else the longest name in it."""
+
+        key = node_key(text)
+        if key in self.names:
+            return key
+        padded = f" {key} "
+        best = None
+        for candidate in self.names:
+            if len(candidate) > 3 and f" {candidate} " in padded and (best is None or len(candidate) > len(best)):
+                best = candidate
+        return best
+
+    def recipe_key(self, key: str) -> str | None:
+        """``key`` if it has a recipe, else its lowest tiered variant that does.
+
+        Research unlocks such as "karpov 38" name the tier-less item, while the
+        recipes are per tier ("basic karpov 38", ...), the same fallback the
+        entity catalog's tier-less aliases use.
+        """
+
+        if key in self.recipes:
+            return key
+        return next((f"{tier} {key}" for tier in TIER_PREFIXES if f"{tier} {key}" in self.recipes), None)
+
+    def _unit_raw(self, key: str, stack: Tuple[str, ...] = ()) -> Dict[str, float]:
+        """Raw materials for one unit of ``key`` (memoized)."""
+
+        if key in self._raw_memo:
+            return self._raw_memo[key]
+        recipe = self.recipes.get(key)
+        if recipe is None or key in stack:
+            return {key: 1.0}
+        totals: Dict[str, float] = {}
+        for ing, qty in recipe.ingredients:
+            for raw, amount in self._unit_raw(node_key(ing), stack + (key,)).items():
+                totals[raw] = totals.get(raw, 0.0) + amount * qty / recipe.output_qty
+        self._raw_memo[key] = totals
+        return totals
+
+    def raw_materials(self, name: str, quantity: int = 1, deep_desert: bool = False) -> Dict[str, Any] | None:
+        """Direct ingredients and fully expanded raw materials for ``quantity`` units.
+
+        ``deep_desert`` halves the direct ingredient counts (rounded up), the
+        same way the Dune Logic building cards do.
+        """
+
+        key = self.resolve(name)
+        key = self.recipe_key(key) if key else None
+        recipe = self.recipes.get(key) if key else None
+        if recipe is None:
+            return None
+        crafts = math.ceil(quantity / recipe.output_qty)
+        direct: Dict[str, int] = {}
+        for ing, qty in recipe.ingredients:
+            total = qty * crafts
+            direct[ing] = math.ceil(total / 2) if deep_desert else total
+        raw: Dict[str, float] = {}
+        for ing, qty in direct.items():
+            for mat, amount in self._unit_raw(node_key(ing)).items():
+                raw[mat] = raw.get(mat, 0.0) + amount * qty
+        return {
+            "item": recipe.name,
+            "quantity": quantity,
+            "station": recipe.station,
+            "deep_desert": deep_desert,
+            "direct": direct,
+            "raw": {self.names.get(m, m): math.ceil(v) for m, v in sorted(raw.items())},
+        }
+
+    def intel_to_unlock(self, name: str) -> Dict[str, Any] | None:
+        key = self.resolve(name)
+        entries = self.research_by_unlock.get(key, []) if key else []
+        if not entries:
+            return None
+        options = []
+        for entry in entries:
+            tier = entry.get("tier")
+            tier_spent = self.intel_tiers.get(tier, 0) if tier else 0
+            cost = entry.get("intel_cost")
+            options.append({
+                "research": entry.get("name"),
+                "tier": tier,
+                "intel_cost": cost,
+                "tier_intel_spent_required": tier_spent,
+                "total_intel": (cost + tier_spent) if isinstance(cost, int) else None,
+                "requirements": entry.get("requirements", {}),
+            })
+        return {"item": self.names.get(key, name), "research": options}
+
+    def what_unlocks(self, name: str) -> Dict[str, Any] | None:
+        key = self.resolve(name)
+        if key is None:
+            return None
+        return {
+            "item": self.names.get(key, name),
+            "unlocked_by": [e.get("name") for e in self.research_by_unlock.get(key, [])],
+            "used_in": sorted({self.names.get(k, k) for k in self.used_in.get(key, [])}),
+        }
+
+    def describe(self, text: str, quantity: int = 1, deep_desert: bool = False) -> Dict[str, Any] | None:
+        """Everything the graph knows about the entity named in ``text``."""
+
+        key = self.resolve(text)
+        if key is None:
+            return None
+        if quantity == 1:
+            quantity = count_before(text, key) or 1
+        out: Dict[str, Any] = {}
+        materials = self.raw_materials(key, quantity, deep_desert)
+        if materials:
+            out["materials"] = materials
+        intel = self.intel_to_unlock(key)
+        if intel:
+            out["intel"] = intel
+        links = self.what_unlocks(key)
+        if links and (links["unlocked_by"] or links["used_in"]):
+            out["links"] = links
+        return out or None
+
+def count_before(text: str, key: str) -> int | None:
+    """A count written right before the entity name, as in "for 4 karpov 38"
+    or "4 standard karpov 38" (a tier word may sit in between)."""
+
+    tiers = "|".join(TIER_PREFIXES)
+    m = re.search(rf"\b(\d+)\s+(?:(?:{tiers})\s+)?{re.escape(key)}\b", node_key(text))
+    return int(m.group(1)) if m else None
+
+def parse_quantity_flags(text: str) -> Tuple[str, int, bool]:
+    """Split "x5", "5x" or a leading count (also right after a craft verb,
+    as in "craft 2 karpov 38") and a "dd" flag off a query."""
+
+    deep_desert = bool(re.search(r"\b(dd|deep desert)\b", text, re.IGNORECASE))
+    text = re.sub(r"\b(dd|deep desert)\b", " ", text, flags=re.IGNORECASE)
+    quantity = 1
+    m = re.search(r"(?:\b[x×]\s*(\d+)\b|\b(\d+)\s*[x×]\b|^\s*(\d+)\s+|\b(?:craft|crafting|build|make)\s+(\d+)\s+)",
+                  text, re.IGNORECASE)
+    if m:
+        group = next(i for i, g in enumerate(m.groups(), 1) if g)
+        quantity = int(m.group(group))
+        # After a craft verb only the count goes; the verb stays in the query.
+        start = m.start(group) if group == 4 else m.start()
+        text = text[:start] + " " + text[m.end():]
+    return text.strip(), max(quantity, 1), deep_desert
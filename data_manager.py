@@ -1,10 +1,37 @@
 import json
 import os
 import logging
+import sqlite3
+from contextlib import closing
 import aiofiles
+import aiosqlite
+from offload import offload
 
 logger = logging.getLogger(__name__)
 
+def _copy(value, depth):
+    """Copy nested dict/list containers ``depth`` levels deep.
+
+    Message dicts below that level are never mutated once stored, so the
+    copy is a consistent snapshot that a worker thread can serialize while
+    the loop keeps changing the live state.
+    """
+    if depth <= 0:
+        return value
+    if isinstance(value, dict):
+        return {k: _copy(v, depth - 1) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v, depth - 1) for v in value]
+    return value
+
+def _usable_summaries(summaries):
+    """A user's per-model summaries without API error strings that older
+    versions stored as if they were summaries."""
+    return {
+        model: entry for model, entry in summaries.items()
+        if isinstance(entry, dict) and not str(entry.get("summary", "")).startswith("Error:")
+    }
+
 class DataManager:
     def __init__(self, filename):
         self.filename = filename
@@ -30,26 +57,41 @@ class DataManager:
                     memory_manager.user_models[guild_id] = models
                 for guild_id, histories in self.data.get("user_histories", {}).items():
                     memory_manager.user_histories[guild_id] = histories
+                # Summaries only make sense next to the per-model histories they
+                # were folded from, so the two are saved and restored together.
+                for guild_id, histories in self.data.get("user_model_histories", {}).items():
+                    memory_manager.user_model_histories[guild_id] = histories
+                for guild_id, summaries in self.data.get("user_summaries", {}).items():
+                    memory_manager.user_summaries[guild_id] = {
+                        user_id: _usable_summaries(models) for user_id, models in summaries.items()
+                    }
                 logger.info("Data loaded successfully from chat_data.json")
             except Exception as e:
                 logger.error(f"Error loading data from {self.filename}: {e}")
                 self.data = {"channels": {}, "user_models": {}, "user_histories": {}}
 
-    async def save_data_async(self, memory_manager):
-        try:
-            data = {
-                "channels": {},
-                "user_models": memory_manager.user_models.copy(),
-                "user_histories": memory_manager.user_histories.copy()
+    def _snapshot(self, memory_manager):
+        data = {
+            "channels": {},
+            "user_models": _copy(memory_manager.user_models, 2),
+            "user_histories": _copy(memory_manager.user_histories, 3),
+            "user_model_histories": _copy(memory_manager.user_model_histories, 4),
+            "user_summaries": _copy(memory_manager.user_summaries, 3)
+        }
+        for channel_id, mems in memory_manager.channel_memories.items():
+            data["channels"][channel_id] = {
+                "memories": list(mems),
+                "history": list(memory_manager.channel_histories.get(channel_id, []))
             }
-            for channel_id, mems in memory_manager.channel_memories.items():
-                data["channels"][channel_id] = {
-                    "memories": mems,
-                    "history": memory_manager.channel_histories.get(channel_id, [])
-                }
+        return data
 
+    async def save_data_async(self, memory_manager):
+        try:
+            data = self._snapshot(memory_manager)
+            # Serialize off the loop; the snapshot is safe to read from another thread or process.
+            text = await offload.run(json.dumps, data, indent=4, stage="save_data", cpu=True)
             async with aiofiles.open(self.filename, "w") as f:
-                await f.write(json.dumps(data, indent=4))
+                await f.write(text)
             logger.debug("Data saved successfully to chat_data.json")
         except Exception as e:
             logger.error(f"Error saving data to {self.filename}: {e}")
@@ -59,7 +101,9 @@ class DataManager:
             data = {
                 "channels": {},
                 "user_models": memory_manager.user_models.copy(),
-                "user_histories": memory_manager.user_histories.copy()
+                "user_histories": memory_manager.user_histories.copy(),
+                "user_model_histories": memory_manager.user_model_histories.copy(),
+                "user_summaries": memory_manager.user_summaries.copy()
             }
             for channel_id, mems in memory_manager.channel_memories.items():
                 data["channels"][channel_id] = {
@@ -71,3 +115,126 @@ class DataManager:
             logger.debug("Data saved successfully to chat_data.json")
         except Exception as e:
             logger.error(f"Error saving data to {self.filename}: {e}")
+
+class SqliteDataManager:
+    """Conversation state in a SQLite file shared by several bot processes.
+
+    Each memory list, channel history, model choice and user history is its
+    own row, and only rows that changed since the last save are written, so
+    processes that own different guilds never overwrite each other. WAL
+    mode lets readers continue while one process writes.
+    """
+
+    def __init__(self, filename, owns_guild=None):
+        self.filename = filename
+        self.owns_guild = owns_guild or (lambda guild_id: True)
+        # (kind, scope, key) -> last JSON value written or loaded
+        self._written = {}
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS state ("
+                    "kind TEXT NOT NULL, scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                    "PRIMARY KEY (kind, scope, key))"
+                )
+            logger.info(f"Using shared SQLite store at {filename}")
+        except Exception as e:
+            logger.error(f"Failed to open data store {filename}: {e}")
+            raise
+
+    def _connect(self):
+        # Callers use ``with closing(...) as conn, conn:`` - the inner block
+        # commits, closing() releases the connection.
+        conn = sqlite3.connect(self.filename, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _rows(self, memory_manager):
+        for channel_id, mems in memory_manager.channel_memories.items():
+            yield ("memories", channel_id, ""), list(mems)
+            yield ("channel_history", channel_id, ""), list(memory_manager.channel_histories.get(channel_id, []))
+        # Values are copied (see _copy) so they can be encoded in a worker thread.
+        for kind, source, depth in (
+            ("user_model", memory_manager.user_models, 0),
+            ("user_history", memory_manager.user_histories, 1),
+            ("user_model_history", memory_manager.user_model_histories, 2),
+            ("user_summary", memory_manager.user_summaries, 1),
+        ):
+            for guild_id, users in source.items():
+                if not self.owns_guild(guild_id):
+                    continue
+                for user_id, value in users.items():
+                    yield (kind, guild_id, user_id), _copy(value, depth)
+
+    def _changed_rows(self, memory_manager):
+        return self._encode_changed(list(self._rows(memory_manager)))
+
+    def _encode_changed(self, rows):
+        changed = []
+        for row_key, value in rows:
+            encoded = json.dumps(value)
+            if self._written.get(row_key) != encoded:
+                changed.append((*row_key, encoded))
+        return changed
+
+    def load_data(self, memory_manager):
+        try:
+            with closing(self._connect()) as conn, conn:
+                rows = conn.execute("SELECT kind, scope, key, value FROM state").fetchall()
+            for kind, scope, key, value in rows:
+                if kind in {"user_model", "user_history", "user_model_history", "user_summary"} and not self.owns_guild(scope):
+                    continue
+                decoded = json.loads(value)
+                if kind == "memories":
+                    memory_manager.channel_memories[scope] = decoded
+                elif kind == "channel_history":
+                    memory_manager.channel_histories[scope] = decoded
+                elif kind == "user_model":
+                    memory_manager.user_models.setdefault(scope, {})[key] = decoded
+                elif kind == "user_history":
+                    memory_manager.user_histories.setdefault(scope, {})[key] = decoded
+                elif kind == "user_model_history":
+                    memory_manager.user_model_histories.setdefault(scope, {})[key] = decoded
+                elif kind == "user_summary":
+                    memory_manager.user_summaries.setdefault(scope, {})[key] = _usable_summaries(decoded)
+                else:
+                    continue
+                self._written[(kind, scope, key)] = value
+            logger.info(f"Data loaded successfully from {self.filename}")
+        except Exception as e:
+            logger.error(f"Error loading data from {self.filename}: {e}")
+
+    async def save_data_async(self, memory_manager):
+        try:
+            rows = list(self._rows(memory_manager))
+            changed = await offload.run(self._encode_changed, rows, stage="save_data")
+            if not changed:
+                return
+            async with aiosqlite.connect(self.filename, timeout=30) as db:
+                await db.execute("PRAGMA busy_timeout=30000")
+                await db.executemany(_UPSERT_SQL, changed)
+                await db.commit()
+            for kind, scope, key, value in changed:
+                self._written[(kind, scope, key)] = value
+            logger.debug(f"Saved {len(changed)} changed rows to {self.filename}")
+        except Exception as e:
+            logger.error(f"Error saving data to {self.filename}: {e}")
+
+    def save_data(self, memory_manager):
+        try:
+            changed = self._changed_rows(memory_manager)
+            if not changed:
+                return
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(_UPSERT_SQL, changed)
+            for kind, scope, key, value in changed:
+                self._written[(kind, scope, key)] = value
+            logger.debug(f"Saved {len(changed)} changed rows to {self.filename}")
+        except Exception as e:
+            logger.error(f"Error saving data to {self.filename}: {e}")
+
+_UPSERT_SQL = (
+    "INSERT INTO state (kind, scope, key, value) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(kind, scope, key) DO UPDATE SET value = excluded.value"
+)
@@ -4,4 +4,6 @@ from .items import get_item_card
 from .npcs import get_npc_card
 from .contracts import get_contract_card
 from .buildings import get_building_card
-from .deep_desert import get_weekly_uniques_message
+from .deep_desert import get_weekly_uniques_message, refresh_weekly_uniques
+from .prefetch import prefetcher
+from .autocomplete import autocomplete_index
@@ -1,14 +1,29 @@
-import os, random, re, asyncio
-from typing import Any, Dict, List, Optional, Sequence
+import os, random, asyncio, json, logging, time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import aiohttp
 from cachetools import TTLCache
 from .common import PROXY_URL
+from .search_index import JsonArrayStream, SearchIndex, peak_rss_kb, search_pair
+
+logger = logging.getLogger(__name__)
+
+# Read size for streamed downloads.
+STREAM_CHUNK = 64 * 1024
 
 class ApiClient:
-    def __init__(self, *, ttl_seconds: int = 900):
-        self._cache: TTLCache[str, Any] = TTLCache(maxsize=2048, ttl=ttl_seconds)
+    def __init__(self, *, ttl_seconds: int = 900, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("DUNE_LOGIC_CACHE_MB", "64")) * 1024 * 1024)
+        # Entries are (payload, body size in bytes) so the budget is byte-weighted.
+        self._cache: TTLCache[str, Tuple[Any, int]] = TTLCache(maxsize=max_bytes, ttl=ttl_seconds, getsizeof=lambda e: e[1])
         self._session: Optional[aiohttp.ClientSession] = None
         self._secret = os.getenv("SECRET_TOKEN","").strip()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.hits: Counter = Counter()
+        # Executor for decoding payloads off the event loop; None uses the
+        # loop's default thread pool. May be a process pool (json.loads only).
+        self.cpu_executor = None
 
     async def _ensure(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
@@ -18,9 +33,25 @@ class ApiClient:
     def _format(self, path: str) -> str:
         return f"{PROXY_URL}/{path}.json.gz?random={random.random()}"
 
+    def cached(self, path: str) -> bool:
+        return path in self._cache
+
+    def invalidate(self, path: str) -> None:
+        self._cache.pop(path, None)
+
     async def _fetch(self, path: str) -> Optional[Any]:
-        if path in self._cache:
-            return self._cache[path]
+        entry = self._cache.get(path)
+        if entry is not None:
+            return entry[0]
+        # Share a download already running for the same path (e.g. the warmer).
+        task = self._pending.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._download(path))
+            self._pending[path] = task
+            task.add_done_callback(lambda _t: self._pending.pop(path, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, path: str) -> Optional[Any]:
         url = self._format(path)
         headers = {"X-Secret-Token": self._secret} if self._secret else {}
         s = await self._ensure()
@@ -28,26 +59,68 @@ class ApiClient:
             async with s.get(url, headers=headers) as resp:
                 if resp.status != 200:
                     return None
-                data = await resp.json()
-                self._cache[path] = data
-                return data
+                if path.endswith("/search"):
+                    data = await self._stream_search_index(path, resp)
+                    size = data.nbytes()
+                else:
+                    body = await resp.read()
+                    data = await asyncio.get_running_loop().run_in_executor(self.cpu_executor, json.loads, body)
+                    size = len(body)
         except Exception:
             return None
+        try:
+            self._cache[path] = (data, size)
+        except ValueError:
+            # Larger than the whole budget; serve it without caching.
+            pass
+        return data
+
+    async def _stream_search_index(self, path: str, resp: aiohttp.ClientResponse) -> SearchIndex:
+        """Decode a search list chunk by chunk straight into a SearchIndex.
+
+        Only name and path of each entry are kept, so neither the whole body
+        nor the full list of dicts is ever in memory.
+        """
+        started = time.perf_counter()
+        rss_before = peak_rss_kb()
+        stream = JsonArrayStream()
+        pairs = []
+        loop = asyncio.get_running_loop()
+
+        def decode(chunk: bytes) -> None:
+            for entry in stream.feed(chunk):
+                pair = search_pair(entry)
+                if pair:
+                    pairs.append(pair)
+
+        # Decompression and decoding run in the default thread pool, one chunk at a time.
+        async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+            await loop.run_in_executor(None, decode, chunk)
+        index = await loop.run_in_executor(None, SearchIndex, pairs)
+        index.parse_seconds = time.perf_counter() - started
+        index.source_bytes = stream.raw_bytes
+        rss_after = peak_rss_kb()
+        rss_note = f", peak RSS +{rss_after - rss_before} KiB" if rss_before is not None else ""
+        logger.info(
+            f"Parsed {path}: {len(index)} entries from {stream.raw_bytes} bytes "
+            f"({stream.text_chars} chars) in {index.parse_seconds * 1000:.0f} ms, "
+            f"~{index.nbytes() // 1024} KiB indexed{rss_note}"
+        )
+        return index
+
+    async def search_index(self, locale: str) -> Optional[SearchIndex]:
+        return await self._fetch(f"{locale}/search")
 
     async def search(self, locale: str, query: Optional[str] = None, types: Optional[Sequence[str]] = None) -> List[Dict[str,Any]]:
-        data = await self._fetch(f"{locale}/search") or []
-        if types:
-            data = [e for e in data if (e.get("path","").split("/",1)[0] in types)]
-        if not query:
-            return data
-        try:
-            rx = re.compile(re.escape(query), re.I)
-        except Exception:
-            return data
-        return [e for e in data if e.get("name") and rx.search(e["name"])]
+        index = await self.search_index(locale)
+        if index is None:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(None, index.find, query, types)
 
     async def get(self, path: str, locale: str):
-        return await self._fetch(f"{locale}/{path}")
+        key = f"{locale}/{path}"
+        self.hits[key] += 1
+        return await self._fetch(key)
 
     async def close(self):
         if self._session and not self._session.closed:
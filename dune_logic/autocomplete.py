@@ -0,0 +1,61 @@
+import bisect, logging, time
+from typing import Any, Dict, List, Optional, Sequence, Union
+from .search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+class AutocompleteIndex:
+    """In-memory suggestion index for slash-command autocomplete.
+
+    Shares the prefetcher's per-locale SearchIndex (no copy); lookups never
+    touch the network. Prefix matches come from a bisect over sorted names,
+    then substring matches are scanned until the result limit or the time
+    budget is reached.
+    """
+
+    def __init__(self):
+        self._locales: Dict[str, SearchIndex] = {}
+
+    def build(self, locale: str, entries: Union[SearchIndex, Sequence[Dict[str, Any]]]) -> None:
+        if not isinstance(entries, SearchIndex):
+            entries = SearchIndex.from_entries(entries or [])
+        self._locales[locale] = entries
+        logger.info(f"Autocomplete index for {locale}: {len(self._locales[locale].names)} entries")
+
+    def ready(self, locale: str) -> bool:
+        return locale in self._locales
+
+    def index(self, locale: str) -> Optional[SearchIndex]:
+        return self._locales.get(locale)
+
+    def suggest(self, locale: str, current: str, types: Optional[Sequence[str]] = None,
+                limit: int = 25, budget_ms: float = 50.0) -> List[Dict[str, str]]:
+        idx = self._locales.get(locale)
+        if idx is None:
+            return []
+        deadline = time.perf_counter() + budget_ms / 1000
+        q = (current or "").strip().lower()
+        wanted = set(types) if types else None
+        out: List[int] = []
+        seen = set()
+
+        start = bisect.bisect_left(idx.lower, q)
+        for i in range(start, len(idx.lower)):
+            if not idx.lower[i].startswith(q) or len(out) >= limit:
+                break
+            if wanted is None or idx.types[i] in wanted:
+                out.append(i)
+                seen.add(i)
+
+        if q and len(out) < limit:
+            for i, name in enumerate(idx.lower):
+                if (i & 255) == 0 and time.perf_counter() > deadline:
+                    logger.debug(f"Autocomplete scan for {q!r} hit the {budget_ms} ms budget")
+                    break
+                if q in name and i not in seen and (wanted is None or idx.types[i] in wanted):
+                    out.append(i)
+                    if len(out) >= limit:
+                        break
+        return [{"name": idx.names[i], "path": idx.paths[i]} for i in out]
+
+autocomplete_index = AutocompleteIndex()
@@ -1,7 +1,17 @@
+import time
 from typing import Dict, Any, List, Optional
 from .api import api
 from .common import DATABASE_URL
 
+LIVE_DATA_PATH = "dd-live-data"
+
+# Last rendered message; valid until the Coriolis reset it announces.
+_rendered: Optional[Dict[str,Any]] = None
+# When the live data was last fetched; a stale render is served for
+# STALE_RETRY_SECONDS after that while the scheduler keeps retrying.
+_fetched_at = 0.0
+STALE_RETRY_SECONDS = 300
+
 def _dedupe_uniques(uniques_list: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
     seen = {}
     for u in uniques_list:
@@ -12,9 +22,8 @@ def _dedupe_uniques(uniques_list: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
                 seen[eid] = ent
     return sorted(seen.values(), key=lambda e: (e.get("name") or "").lower())
 
-async def get_weekly_uniques_message() -> Dict[str,Any]:
-    """Return a dict with keys: content (str) and next_coriolis_time (int|None)."""
-    data = await api.get("en/dd-live-data", "en")
+def render_weekly_uniques(data: Optional[Dict[str,Any]]) -> Dict[str,Any]:
+    """Build the weekly uniques message from an ``en/dd-live-data`` payload."""
     if not data:
         return {"content": "Deep Desert data is currently unavailable.", "next_coriolis_time": None}
     next_time = data.get("nextCoriolisTime")
@@ -32,3 +41,35 @@ async def get_weekly_uniques_message() -> Dict[str,Any]:
         lines += ["", "No unique items available this week."]
     lines += ["", "*The times are in your local timezone.*"]
     return {"content": "\n".join(lines), "next_coriolis_time": next_time}
+
+def _still_valid(msg: Optional[Dict[str,Any]]) -> bool:
+    return bool(msg and msg.get("next_coriolis_time") and time.time() < msg["next_coriolis_time"])
+
+async def _fetch_weekly_uniques(fresh: bool) -> Dict[str,Any]:
+    global _rendered, _fetched_at
+    if fresh:
+        api.invalidate(f"en/{LIVE_DATA_PATH}")
+    _fetched_at = time.time()
+    msg = render_weekly_uniques(await api.get(LIVE_DATA_PATH, "en"))
+    if msg.get("next_coriolis_time") or _rendered is None:
+        _rendered = msg
+    return msg
+
+async def refresh_weekly_uniques() -> Dict[str,Any]:
+    """Fetch fresh live data (bypassing the API cache) and re-render the message."""
+    return await _fetch_weekly_uniques(fresh=True)
+
+async def get_weekly_uniques_message() -> Dict[str,Any]:
+    """Return a dict with keys: content (str) and next_coriolis_time (int|None).
+
+    Served from the pre-rendered copy until the announced Coriolis reset.
+    Past it (the rollover gap, or an outage) the stale copy keeps being
+    served, refetched through the API cache at most every
+    STALE_RETRY_SECONDS; the scheduler does the forced refreshes.
+    """
+    if _still_valid(_rendered):
+        return _rendered
+    if _rendered is not None and time.time() - _fetched_at < STALE_RETRY_SECONDS:
+        return _rendered
+    await _fetch_weekly_uniques(fresh=False)
+    return _rendered
@@ -0,0 +1,134 @@
+import asyncio, json, logging, os
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set
+from .api import ApiClient, api
+from .autocomplete import AutocompleteIndex, autocomplete_index
+
+logger = logging.getLogger(__name__)
+
+# Fields on a card payload that reference other entities worth warming.
+# Values are lists of either {"entity": {...}} wrappers or bare entities.
+LINK_FIELDS = ("soldBy", "rewardFrom", "chainContracts", "requiredForContract", "sellsItems", "contracts")
+
+def linked_paths(data: Any) -> List[str]:
+    """Return ``<category>/<id>`` paths referenced by a card payload."""
+    out: List[str] = []
+    if not isinstance(data, dict):
+        return out
+    for field in LINK_FIELDS:
+        for ref in (data.get(field) or []):
+            if not isinstance(ref, dict):
+                continue
+            ent = ref.get("entity") if isinstance(ref.get("entity"), dict) else ref
+            cat, eid = ent.get("mainCategoryId"), ent.get("id")
+            if cat and eid and not ent.get("isHidden"):
+                out.append(f"{cat}/{eid}")
+    return out
+
+class Prefetcher:
+    """Warm the Dune Logic cache in the background.
+
+    Loads each locale's search index, then the most requested card paths
+    (from ``ApiClient.hits``, persisted across restarts) and one level of
+    entities they link to, with bounded concurrency.
+    """
+
+    def __init__(self, client: ApiClient = api, *, index: AutocompleteIndex = autocomplete_index,
+                 stats_path: str = "logs/dune_logic_hits.json",
+                 top_n: int = 200, concurrency: int = 4, interval: int = 600):
+        self.client = client
+        self.index = index
+        # locale -> id() of the search list the autocomplete index was built from
+        self._indexed: Dict[str, int] = {}
+        self.stats_path = stats_path
+        self.top_n = top_n
+        self.concurrency = concurrency
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # Awaited with (locale, SearchIndex) after each locale's index is (re)built.
+        self.on_index: List[Callable[[str, Any], Awaitable[None]]] = []
+
+    def load_stats(self) -> None:
+        if not os.path.exists(self.stats_path):
+            return
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            for key, count in saved.items():
+                # Keep whichever is higher so a reload never loses live counts.
+                self.client.hits[key] = max(self.client.hits.get(key, 0), int(count))
+        except Exception as e:
+            logger.warning(f"Failed to load Dune Logic hit stats: {e}")
+
+    def save_stats(self) -> None:
+        try:
+            top = dict(self.client.hits.most_common(self.top_n * 5))
+            with open(self.stats_path, "w", encoding="utf-8") as f:
+                json.dump(top, f)
+        except Exception as e:
+            logger.warning(f"Failed to save Dune Logic hit stats: {e}")
+
+    async def _fetch_all(self, keys: Iterable[str]) -> Dict[str, Any]:
+        sem = asyncio.Semaphore(self.concurrency)
+        results: Dict[str, Any] = {}
+
+        async def one(key: str):
+            async with sem:
+                results[key] = await self.client._fetch(key)
+
+        await asyncio.gather(*(one(k) for k in keys if not self.client.cached(k)))
+        return results
+
+    async def warm(self, locales: Sequence[str] = ("en",)) -> int:
+        """Fill the cache once; returns how many payloads were fetched."""
+        await self._fetch_all(f"{loc}/search" for loc in locales)
+        for loc in locales:
+            entries = await self.client._fetch(f"{loc}/search")
+            if entries and self._indexed.get(loc) != id(entries):
+                self.index.build(loc, entries)
+                self._indexed[loc] = id(entries)
+                for callback in self.on_index:
+                    try:
+                        await callback(loc, self.index.index(loc))
+                    except Exception as e:
+                        logger.warning(f"Search index callback failed for {loc}: {e}")
+        top = [key for key, _ in self.client.hits.most_common(self.top_n)
+               if key.split("/", 1)[0] in locales]
+        fetched = await self._fetch_all(top)
+
+        seen: Set[str] = set(top)
+        linked: List[str] = []
+        for key in top:
+            loc = key.split("/", 1)[0]
+            data = fetched.get(key)
+            if data is None and self.client.cached(key):
+                data = await self.client._fetch(key)
+            for path in linked_paths(data):
+                lkey = f"{loc}/{path}"
+                if lkey not in seen:
+                    seen.add(lkey)
+                    linked.append(lkey)
+        fetched_linked = await self._fetch_all(linked)
+        total = len(fetched) + len(fetched_linked)
+        logger.info(f"Dune Logic warm-up fetched {total} payloads ({len(top)} top paths, {len(linked)} linked)")
+        return total
+
+    async def run(self, locales: Sequence[str] = ("en",)) -> None:
+        self.load_stats()
+        while True:
+            try:
+                await self.warm(locales)
+                self.save_stats()
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                self.save_stats()
+                break
+            except Exception as e:
+                logger.error(f"Dune Logic warm-up failed: {e}")
+                await asyncio.sleep(self.interval)
+
+    def start(self, locales: Sequence[str] = ("en",)) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(locales))
+        return self._task
+
+prefetcher = Prefetcher()
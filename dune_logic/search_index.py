@@ -0,0 +1,132 @@
+import codecs, json, re, sys, zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_SKIP = re.compile(r"[\s,]*")
+
+def peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of this process in KiB, where the OS reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class JsonArrayStream:
+    """Incrementally decode the elements of a top-level JSON array.
+
+    Feed raw (optionally gzipped) byte chunks; each complete element is
+    yielded as soon as its closing brace arrives, so only the current chunk
+    and one partial element are ever held as text.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._gunzip: Optional[Any] = None
+        self._sniffed = False
+        # First bytes held back until there are enough to spot a gzip header.
+        self._head = b""
+        self._buf = ""
+        self._started = False
+        self.done = False
+        self.raw_bytes = 0
+        self.text_chars = 0
+
+    def feed(self, chunk: bytes) -> Iterator[Any]:
+        self.raw_bytes += len(chunk)
+        if not self._sniffed:
+            chunk = self._head + chunk
+            if len(chunk) < 2:
+                self._head = chunk
+                return iter(())
+            self._sniffed = True
+            self._head = b""
+            if chunk[:2] == b"\x1f\x8b":
+                # Served as a plain .gz file rather than with Content-Encoding.
+                self._gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._gunzip is not None:
+            chunk = self._gunzip.decompress(chunk)
+        return self._parse(self._text.decode(chunk))
+
+    def _parse(self, text: str) -> Iterator[Any]:
+        if self.done:
+            return
+        self.text_chars += len(text)
+        buf = self._buf + text
+        pos = 0
+        if not self._started:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= len(buf):
+                self._buf = ""
+                return
+            if buf[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            self._started = True
+            pos += 1
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                self.done = True
+                pos += 1
+                break
+            try:
+                obj, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # element continues in the next chunk
+            yield obj
+            pos = end
+        self._buf = buf[pos:]
+
+class SearchIndex:
+    """Compact per-locale search list: parallel arrays sorted by lowercase name.
+
+    Paths and type names are ``sys.intern``-ed, so the same path in several
+    locales is stored once; only display names differ per locale.
+    """
+
+    __slots__ = ("lower", "names", "paths", "types", "parse_seconds", "source_bytes")
+
+    def __init__(self, pairs: Iterable[Tuple[str, str]] = ()):
+        rows = [(name.lower(), name, sys.intern(path)) for name, path in pairs]
+        rows.sort(key=lambda r: r[0])
+        self.lower: List[str] = [r[0] for r in rows]
+        self.names: List[str] = [r[1] for r in rows]
+        self.paths: List[str] = [r[2] for r in rows]
+        self.types: List[str] = [sys.intern(r[2].split("/", 1)[0]) for r in rows]
+        self.parse_seconds = 0.0
+        self.source_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def entry(self, i: int) -> Dict[str, str]:
+        return {"name": self.names[i], "path": self.paths[i]}
+
+    def find(self, query: Optional[str] = None, types: Optional[Sequence[str]] = None) -> List[Dict[str, str]]:
+        """Entries whose name contains ``query`` (case-insensitive), in name order."""
+        q = (query or "").lower()
+        wanted = set(types) if types else None
+        return [self.entry(i) for i, name in enumerate(self.lower)
+                if (not q or q in name) and (wanted is None or self.types[i] in wanted)]
+
+    def nbytes(self) -> int:
+        """Rough in-memory size, used as the cache weight."""
+        size = sum(map(sys.getsizeof, self.lower)) + sum(map(sys.getsizeof, self.names))
+        size += sum(map(sys.getsizeof, set(self.paths)))
+        return size + 4 * sys.getsizeof(self.names)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Any]) -> "SearchIndex":
+        return cls(pair for pair in map(search_pair, entries) if pair)
+
+def search_pair(entry: Any) -> Optional[Tuple[str, str]]:
+    """(name, path) of a raw search entry, or None when it lacks either."""
+    if isinstance(entry, dict) and entry.get("name") and entry.get("path"):
+        return str(entry["name"]), str(entry["path"])
+    return None
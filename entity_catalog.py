@@ -0,0 +1,251 @@
+import re
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Top-level keys that describe a file rather than hold entities.
+META_KEYS = {"schema", "meta", "_meta", "game", "schema_version", "updated_at", "version", "game_summary"}
+
+# Guide-style files; their names lose alias clashes to concrete game entities.
+GUIDE_SOURCES = {"gameplay", "tips", "strategies", "volumes"}
+
+# Item quality tiers, lowest first; "Standard Karpov 38" is also known as
+# "karpov 38", which resolves to the lowest tier that exists.
+TIER_PREFIXES = ("basic", "standard", "artisan", "adept", "regis", "house")
+
+# Salts the knowledge snapshot: bump it whenever the aliases built here (or by
+# MessageHandler.normalize_text) change, so stale snapshots get rebuilt.
+ALIAS_VERSION = 1
+
+# Longest alias, in words, looked for inside a message.
+MAX_ALIAS_WORDS = 6
+
+def _default_normalize(text: str) -> str:
+    text = re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", str(text).lower()).strip("-")
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up (returning ``limit + 1``) once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+class Entity:
+    __slots__ = ("id", "name", "source", "category", "data", "aliases", "logic_path", "pointer")
+
+    def __init__(self, entity_id: str, name: str, source: str, category: str, data: Dict[str, Any],
+                 pointer: Tuple = ()):
+        self.id = entity_id
+        self.name = name
+        self.source = source
+        self.category = category
+        self.data = data
+        self.aliases: List[str] = []
+        self.logic_path: Optional[str] = None
+        # Keys/indices leading from the file's top level to ``data``.
+        self.pointer = pointer
+
+    def summary(self) -> Dict[str, Any]:
+        out = {"id": self.id, "name": self.name, "file": self.source}
+        if self.category:
+            out["category"] = self.category
+        if self.logic_path:
+            out["dune_logic_path"] = self.logic_path
+        return out
+
+class EntityCatalog:
+    """Every named entity across the information files, with stable ids.
+
+    Ids are ``<file>/<entry id or slug of name>``. Each entity is reachable
+    through normalized aliases (its name, name without "(...)" suffixes or a
+    tier prefix, and its id, passed through the handler's synonym
+    normalization) in one dict.
+    Misspellings fall back to a trigram index checked with a bounded edit
+    distance.
+    """
+
+    def __init__(self, game_data: Dict[str, Any], normalize: Callable[[str], str] | None = None):
+        self.normalize = normalize or _default_normalize
+        self.entities: Dict[str, Entity] = {}
+        self.by_source: Dict[str, List[Entity]] = {}
+        # normalized alias -> entity id (first entity wins on clashes)
+        self.aliases: Dict[str, str] = {}
+        self._trigrams: Dict[str, List[str]] = {}
+        self._logic_source: Optional[int] = None
+
+        for source in sorted(game_data, key=lambda s: (s in GUIDE_SOURCES, s)):
+            for category, entry, pointer in self._walk(game_data[source], "", ()):
+                self._add(source, category, entry, pointer)
+        if game_data:
+            self._index()
+
+    def _index(self) -> None:
+        # Base names without a tier prefix. Every exact alias is already in
+        # place, so an entity actually named "Karpov 38" would keep it. They
+        # only go in the lookup dict: entity.aliases (stored in snapshots)
+        # keeps the exact names, so the lowest tier wins either way.
+        tiered = []
+        for entity in self.entities.values():
+            for alias in entity.aliases:
+                tier, _, base = alias.partition(" ")
+                if base and tier in TIER_PREFIXES:
+                    tiered.append((TIER_PREFIXES.index(tier), base, entity))
+        for _, base, entity in sorted(tiered, key=lambda t: t[0]):
+            self.aliases.setdefault(base, entity.id)
+        for alias in self.aliases:
+            for gram in trigrams(alias):
+                self._trigrams.setdefault(gram, []).append(alias)
+        logger.info(f"Entity catalog: {len(self.entities)} entities, {len(self.aliases)} aliases")
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, str, str, str, Tuple, List[str]]],
+                     game_data: Dict[str, Any], normalize: Callable[[str], str] | None = None) -> "EntityCatalog":
+        """Rebuild a catalog from stored (id, name, source, category, pointer, aliases) records.
+
+        Skips walking the files and normalizing every alias again; ``data``
+        is looked up in ``game_data`` through each record's pointer.
+        """
+        catalog = cls({}, normalize)
+        for entity_id, name, source, category, pointer, aliases in records:
+            data: Any = game_data.get(source)
+            try:
+                for step in pointer:
+                    data = data[step]
+            except (KeyError, IndexError, TypeError):
+                continue
+            entity = Entity(entity_id, name, source, category, data, tuple(pointer))
+            catalog.entities[entity_id] = entity
+            catalog.by_source.setdefault(source, []).append(entity)
+            for alias in aliases:
+                entity.aliases.append(alias)
+                catalog.aliases.setdefault(alias, entity_id)
+        catalog._index()
+        return catalog
+
+    def _walk(self, node: Any, group: str, pointer: Tuple, depth: int = 0) -> Iterator[Tuple[str, Dict[str, Any], Tuple]]:
+        """Yield (group, entry, pointer) for dicts with a "name", without descending into them."""
+        if isinstance(node, dict):
+            if depth and isinstance(node.get("name"), str):
+                yield group, node, pointer
+                return
+            for key, value in node.items():
+                if depth == 0 and key in META_KEYS:
+                    continue
+                # Containers name the group their entries belong to ("Sidearms", "sandbike").
+                container = isinstance(value, list) or (isinstance(value, dict) and "name" not in value)
+                yield from self._walk(value, key if container else group, pointer + (key,), depth + 1)
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                yield from self._walk(value, group, pointer + (i,), depth + 1)
+
+    def _add(self, source: str, group: str, entry: Dict[str, Any], pointer: Tuple = ()) -> None:
+        name = entry["name"].strip()
+        if not name:
+            return
+        base = f"{source}/{slugify(entry.get('id') or name)}"
+        entity_id, n = base, 2
+        while entity_id in self.entities:
+            entity_id, n = f"{base}-{n}", n + 1
+        category = str(entry.get("category") or entry.get("slot") or group or "")
+        # "Weapons - Sidearms" -> "Sidearms"
+        category = category.split(" - ", 1)[-1]
+        entity = Entity(entity_id, name, source, category, entry, pointer)
+        self.entities[entity_id] = entity
+        self.by_source.setdefault(source, []).append(entity)
+
+        names = {name, re.sub(r"\s*\([^)]*\)", "", name)}
+        if isinstance(entry.get("id"), str):
+            names.add(entry["id"].replace("-", " ").replace("_", " "))
+        for alias in names:
+            key = self.normalize(alias)
+            if key and key not in entity.aliases:
+                entity.aliases.append(key)
+                self.aliases.setdefault(key, entity_id)
+
+    def get(self, entity_id: str) -> Optional[Entity]:
+        return self.entities.get(entity_id)
+
+    def lookup(self, text: str) -> Optional[Entity]:
+        """Exact (normalized) alias match."""
+        entity_id = self.aliases.get(self.normalize(text))
+        return self.entities[entity_id] if entity_id else None
+
+    def fuzzy(self, text: str, max_ratio: float = 0.25) -> Optional[Entity]:
+        """Closest alias by trigram overlap, accepted within an edit-distance budget."""
+        key = self.normalize(text)
+        if len(key) < 4:
+            return None
+        grams = trigrams(key)
+        counts: Dict[str, int] = {}
+        for gram in grams:
+            for alias in self._trigrams.get(gram, ()):
+                counts[alias] = counts.get(alias, 0) + 1
+        limit = max(1, int(len(key) * max_ratio))
+        # Each edit breaks at most three trigrams, so fewer shared ones can't match.
+        floor = len(grams) - 3 * limit
+        candidates = [(n, alias) for alias, n in counts.items() if n >= floor]
+        best: Tuple[int, str] | None = None
+        for _, alias in sorted(candidates, reverse=True)[:12]:
+            dist = edit_distance(key, alias, limit)
+            if dist <= limit and (best is None or dist < best[0]):
+                best = (dist, alias)
+        return self.entities[self.aliases[best[1]]] if best else None
+
+    def resolve(self, text: str, fuzzy: bool = True) -> Optional[Entity]:
+        """Map free text to one canonical entity: exact alias, then fuzzy."""
+        return self.lookup(text) or (self.fuzzy(text) if fuzzy else None)
+
+    def find_in(self, text: str, limit: int = 5) -> List[Entity]:
+        """Entities named inside a longer message, longest mention first."""
+        words = self.normalize(text).split()
+        found: List[Entity] = []
+        taken = [False] * len(words)
+        for size in range(min(MAX_ALIAS_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                if any(taken[start:start + size]):
+                    continue
+                entity_id = self.aliases.get(" ".join(words[start:start + size]))
+                if entity_id is None or (size == 1 and len(words[start]) < 4):
+                    continue
+                entity = self.entities[entity_id]
+                if entity not in found:
+                    found.append(entity)
+                for i in range(start, start + size):
+                    taken[i] = True
+                if len(found) >= limit:
+                    return found
+        return found
+
+    def link_logic(self, index: Any) -> int:
+        """Attach Dune Logic paths from a search index (``names``/``paths`` arrays).
+
+        Cheap to call repeatedly; it only relinks when given a new index.
+        """
+        if index is None or id(index) == self._logic_source:
+            return 0
+        self._logic_source = id(index)
+        by_name: Dict[str, str] = {}
+        for name, path in zip(index.names, index.paths):
+            by_name.setdefault(self.normalize(name), path)
+        linked = 0
+        for entity in self.entities.values():
+            entity.logic_path = next((by_name[a] for a in entity.aliases if a in by_name), None)
+            linked += entity.logic_path is not None
+        logger.info(f"Linked {linked} catalog entities to Dune Logic paths")
+        return linked
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import logging
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+import discord
+from cachetools import LRUCache
+from PIL import Image, ImageOps
+
+from offload import offload
+
+logger = logging.getLogger(__name__)
+
+# Quality steps tried, best first, until the encoded image fits the byte budget.
+QUALITY_STEPS = (85, 75, 65, 50, 35)
+
+def normalize_image(data: bytes, max_side: int, max_bytes: int, fmt: str = "webp") -> Tuple[bytes, str]:
+    """Downscale and re-encode an image without metadata; returns (bytes, extension).
+
+    Animated images are passed through unchanged, since re-encoding would
+    drop their frames. Transparent images are always written as WebP.
+    """
+    with Image.open(BytesIO(data)) as src:
+        if getattr(src, "is_animated", False):
+            return data, (src.format or "gif").lower()
+        # Apply the EXIF rotation before the EXIF block is dropped.
+        img = ImageOps.exif_transpose(src)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    fmt = "webp" if alpha or fmt != "jpeg" else "jpeg"
+    img = img.convert("RGBA" if alpha else "RGB")
+    out = b""
+    while True:
+        for quality in QUALITY_STEPS:
+            buf = BytesIO()
+            # No exif/icc_profile arguments: the re-encoded file carries no metadata.
+            if fmt == "jpeg":
+                img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+            else:
+                img.save(buf, "WEBP", quality=quality, method=4)
+            out = buf.getvalue()
+            if len(out) <= max_bytes:
+                return out, ("jpg" if fmt == "jpeg" else "webp")
+        if min(img.size) <= 64:
+            return out, ("jpg" if fmt == "jpeg" else "webp")
+        # Still too big at the lowest quality: shrink and try again.
+        img = img.resize((max(img.width * 3 // 4, 1), max(img.height * 3 // 4, 1)), Image.LANCZOS)
+
+class ImagePipeline:
+    """Download reply images and normalize them before upload.
+
+    Each URL is fetched once, downscaled to ``max_side`` pixels and
+    re-encoded under ``max_bytes`` in a worker thread; the result is kept
+    in an LRU cache keyed by the URL's hash, bounded to ``cache_bytes``.
+    """
+
+    def __init__(self, max_side: int = 1600, max_bytes: int = 1024 * 1024, fmt: str = "webp",
+                 cache_bytes: int = 32 * 1024 * 1024):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"fetched": 0, "cached": 0, "bytes_in": 0, "bytes_out": 0}
+        self.configure(max_side, max_bytes, fmt, cache_bytes)
+
+    def configure(self, max_side: int, max_bytes: int, fmt: str, cache_bytes: int) -> None:
+        self.max_side = max(int(max_side), 64)
+        self.max_bytes = max(int(max_bytes), 16 * 1024)
+        self.fmt = fmt if fmt in {"webp", "jpeg"} else "webp"
+        self.cache: LRUCache = LRUCache(maxsize=max(int(cache_bytes), 1), getsizeof=lambda v: len(v[0]))
+
+    async def _download(self, url: str) -> Optional[bytes]:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        async with self.session.get(url) as resp:
+            if resp.status != 200:
+                logger.warning(f"Image {url} returned status {resp.status}")
+                return None
+            return await resp.read()
+
+    async def _load(self, key: str, url: str) -> Optional[Tuple[bytes, str]]:
+        data = await self._download(url)
+        if data is None:
+            return None
+        try:
+            out, ext = await offload.run(normalize_image, data, self.max_side, self.max_bytes, self.fmt,
+                                         stage="normalize_image")
+        except Exception as e:
+            # Not something Pillow can read; upload it as served.
+            logger.warning(f"Could not normalize image {url}: {e}")
+            out, ext = data, "png"
+        self.stats["fetched"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(out)
+        logger.info(f"Normalized image {url[:80]}: {len(data) // 1024} KiB -> {len(out) // 1024} KiB {ext}")
+        if len(out) <= self.cache.maxsize:
+            self.cache[key] = (out, ext)
+        return out, ext
+
+    async def fetch(self, url: str) -> Optional[discord.File]:
+        """A normalized ``discord.File`` for ``url``, or None if it could not be fetched."""
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        hit = self.cache.get(key)
+        if hit is not None:
+            self.stats["cached"] += 1
+        else:
+            # Concurrent replies with the same image share one download.
+            task = self._inflight.get(key)
+            if task is None:
+                task = self._inflight[key] = asyncio.ensure_future(self._load(key, url))
+                task.add_done_callback(lambda _t, key=key: self._inflight.pop(key, None))
+            hit = await asyncio.shield(task)
+            if hit is None:
+                return None
+        return discord.File(BytesIO(hit[0]), filename=f"{key[:12]}.{hit[1]}")
+
+    async def fetch_all(self, urls) -> list:
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        files = []
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Failed to fetch image {url}: {result}")
+            elif result is not None:
+                files.append(result)
+        return files
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DKBSNAP1"
+VERSION = 1
+# magic, version, section count, sha256 fingerprint of the inputs
+HEADER = struct.Struct("<8sII32s")
+# name, offset, length
+SECTION = struct.Struct("<16sII")
+# name, compact JSON, canonical prompt JSON (all off/len into strings), prompt chars
+FILE_ROW = struct.Struct("<IIIIIII")
+# id, name, source, category, pointer JSON (off/len pairs), first alias row, alias count
+ENTITY_ROW = struct.Struct("<IIIIIIIIIIII")
+# alias (off/len), entity row
+ALIAS_ROW = struct.Struct("<III")
+
+def fingerprint(info_dir: Path, salt: str = "") -> bytes:
+    """Hash of every information file's name and contents, plus ``salt``."""
+    digest = hashlib.sha256(f"{VERSION}:{salt}".encode("utf-8"))
+    for path in sorted(info_dir.glob("*.json")):
+        digest.update(path.name.encode("utf-8") + b"\0")
+        digest.update(path.read_bytes())
+    return digest.digest()
+
+class _Strings:
+    """Deduplicated UTF-8 string table being written."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.seen: Dict[str, Tuple[int, int]] = {}
+
+    def add(self, text: str) -> Tuple[int, int]:
+        ref = self.seen.get(text)
+        if ref is None:
+            data = text.encode("utf-8")
+            ref = self.seen[text] = (len(self.buf), len(data))
+            self.buf += data
+        return ref
+
+def build_snapshot(path: str, game_data: Dict[str, Any], catalog: Any, digest: bytes) -> None:
+    """Write ``game_data`` and ``catalog`` as a flat binary snapshot at ``path``.
+
+    The file is written next to ``path`` and renamed into place, so readers
+    that already mapped an older snapshot keep a consistent view.
+    """
+    strings = _Strings()
+    files = bytearray()
+    for name in sorted(game_data):
+        data = game_data[name]
+        fragment = json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
+        files += FILE_ROW.pack(*strings.add(name), *strings.add(json.dumps(data, ensure_ascii=False, separators=(",", ":"))),
+                               *strings.add(fragment), len(fragment))
+    entities = bytearray()
+    entity_aliases = bytearray()
+    alias_rows = 0
+    for row, entity in enumerate(catalog.entities.values()):
+        entities += ENTITY_ROW.pack(
+            *strings.add(entity.id), *strings.add(entity.name), *strings.add(entity.source),
+            *strings.add(entity.category), *strings.add(json.dumps(list(entity.pointer))),
+            alias_rows, len(entity.aliases),
+        )
+        for alias in entity.aliases:
+            entity_aliases += ALIAS_ROW.pack(*strings.add(alias), row)
+            alias_rows += 1
+
+    sections = [(b"files", files), (b"entities", entities), (b"entity_aliases", entity_aliases),
+                (b"strings", strings.buf)]
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = bytearray()
+    for name, blob in sections:
+        table += SECTION.pack(name, offset, len(blob))
+        offset += len(blob)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections), digest))
+        f.write(table)
+        for _, blob in sections:
+            f.write(blob)
+    os.replace(tmp, path)
+    logger.info(f"Wrote knowledge snapshot {path} ({offset // 1024} KiB, {len(game_data)} files, {len(catalog.entities)} entities)")
+
+class KnowledgeSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by :func:`build_snapshot`.
+
+    Every process maps the same file, so the pages holding the information
+    files, their canonical prompt JSON and the entity tables are
+    shared through the OS page cache instead of copied per process.
+    Strings are decoded from the mapping only when asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        magic, version, count, self.digest = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} knowledge snapshot")
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        for i in range(count):
+            name, offset, length = SECTION.unpack_from(self._mm, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+        self._strings = self._sections["strings"][0]
+        # File name -> FILE_ROW fields; a handful of rows, read once.
+        self.files: Dict[str, Tuple[int, ...]] = {}
+        for row in self._rows("files", FILE_ROW):
+            self.files[self._str(row[0], row[1])] = row[2:]
+
+    def _rows(self, section: str, layout: struct.Struct) -> Iterator[Tuple[int, ...]]:
+        offset, length = self._sections[section]
+        return layout.iter_unpack(self._view[offset:offset + length])
+
+    def _bytes(self, off: int, length: int) -> memoryview:
+        start = self._strings + off
+        return self._view[start:start + length]
+
+    def _str(self, off: int, length: int) -> str:
+        return str(self._bytes(off, length), "utf-8")
+
+    def load(self, name: str) -> Any:
+        """Parse one information file from its compact JSON in the mapping."""
+        row = self.files[name]
+        return json.loads(self._str(row[0], row[1]))
+
+    def fragment(self, name: str) -> str:
+        """Canonical (sorted-key, indented) JSON of a file, as used in prompts."""
+        row = self.files[name]
+        return self._str(row[2], row[3])
+
+    def fragment_chars(self, name: str) -> int:
+        return self.files[name][4]
+
+    def entity_records(self) -> Iterator[Tuple[str, str, str, str, Tuple, List[str]]]:
+        """(id, name, source, category, pointer, aliases) for every stored entity."""
+        alias_offset = self._sections["entity_aliases"][0]
+        for row in self._rows("entities", ENTITY_ROW):
+            first, count = row[10], row[11]
+            aliases = [
+                self._str(*ALIAS_ROW.unpack_from(self._view, alias_offset + (first + i) * ALIAS_ROW.size)[:2])
+                for i in range(count)
+            ]
+            yield (self._str(row[0], row[1]), self._str(row[2], row[3]), self._str(row[4], row[5]),
+                   self._str(row[6], row[7]), tuple(json.loads(self._str(row[8], row[9]))), aliases)
+
+    def nbytes(self) -> int:
+        return len(self._mm)
+
+    def close(self) -> None:
+        self._view.release()
+        self._mm.close()
+
+def open_snapshot(path: str, info_dir: Path, salt: str,
+                  compile_catalog: Callable[[Dict[str, Any]], Any]) -> Optional[KnowledgeSnapshot]:
+    """Map the snapshot at ``path``, (re)building it first when the inputs changed.
+
+    ``compile_catalog`` turns parsed game data into an entity catalog; it is
+    only called when a build is needed. Concurrent processes serialize on a
+    lock file so only the first one builds.
+    """
+    started = time.perf_counter()
+    digest = fingerprint(info_dir, salt)
+    lock = open(f"{path}.lock", "a+") if fcntl is not None else None
+    try:
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshot = None
+        if os.path.exists(path):
+            try:
+                snapshot = KnowledgeSnapshot(path)
+            except (ValueError, OSError, struct.error) as e:
+                logger.warning(f"Ignoring unreadable knowledge snapshot {path}: {e}")
+            if snapshot is not None and snapshot.digest != digest:
+                snapshot.close()
+                snapshot = None
+        if snapshot is None:
+            game_data = {}
+            for json_file in sorted(info_dir.glob("*.json")):
+                with open(json_file, "r", encoding="utf-8") as f:
+                    game_data[json_file.stem] = json.load(f)
+            build_snapshot(path, game_data, compile_catalog(game_data), digest)
+            snapshot = KnowledgeSnapshot(path)
+    except Exception as e:
+        logger.error(f"Knowledge snapshot unavailable, parsing information files directly: {e}")
+        return None
+    finally:
+        if lock is not None:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+    logger.info(f"Mapped knowledge snapshot {path} ({snapshot.nbytes() // 1024} KiB) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return snapshot
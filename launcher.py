@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import time
+import logging
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("launcher")
+
+def split_shards(shard_count: int, processes: int) -> list:
+    """Spread shard ids over processes as evenly as possible."""
+    return [list(range(i, shard_count, processes)) for i in range(processes) if i < shard_count]
+
+def main():
+    # Same .env as bot.py, so SHARD_COUNT/SHARD_PROCESSES can live there.
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    shard_count = int(os.getenv("SHARD_COUNT", "0") or 0)
+    processes = int(os.getenv("SHARD_PROCESSES", str(os.cpu_count() or 1)))
+    if shard_count < 1:
+        print("Set SHARD_COUNT (and optionally SHARD_PROCESSES) to run sharded, or run bot.py directly.")
+        sys.exit(1)
+
+    groups = split_shards(shard_count, max(processes, 1))
+    children = {}
+
+    def spawn(shard_ids):
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, shard_ids)))
+        proc = subprocess.Popen([sys.executable, "bot.py"], env=env)
+        logger.info(f"Started shards {shard_ids} as PID {proc.pid}")
+        return proc
+
+    for ids in groups:
+        children[tuple(ids)] = spawn(ids)
+
+    try:
+        while True:
+            time.sleep(5)
+            for ids, proc in list(children.items()):
+                code = proc.poll()
+                if code is not None:
+                    logger.warning(f"Shards {list(ids)} exited with code {code}, restarting")
+                    children[ids] = spawn(list(ids))
+    except KeyboardInterrupt:
+        logger.info("Stopping shard processes")
+        for proc in children.values():
+            proc.terminate()
+        for proc in children.values():
+            proc.wait()
+
+if __name__ == "__main__":
+    main()
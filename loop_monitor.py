@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class LoopMonitor:
+    """Measure event-loop lag and attribute stalls to a stage.
+
+    A heartbeat task sleeps ``interval`` seconds and records how late it
+    wakes up. A watchdog thread notices when the heartbeat has been silent
+    longer than ``threshold`` and logs a stack sample of the loop thread
+    while it is still stuck. Synchronous sections can name themselves with
+    :meth:`stage`; otherwise the innermost frame from this repo is used.
+    """
+
+    def __init__(self, threshold_ms: float = 250, interval_ms: float = 100, history: int = 200):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        # Recent stalls: {"at", "ms", "stage"}
+        self.stalls: deque = deque(maxlen=history)
+        self.lag_ms: deque = deque(maxlen=history)
+        self.max_lag_ms = 0.0
+        self._stage: Optional[str] = None
+        self._sampled_stage: Optional[str] = None
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Label a synchronous block so stalls inside it are attributed to ``name``."""
+        previous, self._stage = self._stage, name
+        try:
+            yield
+        finally:
+            self._stage = previous
+
+    def _frame_stage(self, frame) -> str:
+        while frame is not None:
+            path = frame.f_code.co_filename
+            if path.startswith(_REPO_DIR) and not path.endswith("loop_monitor.py"):
+                return f"{frame.f_code.co_name} ({os.path.basename(path)}:{frame.f_lineno})"
+            frame = frame.f_back
+        return "unknown"
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._last_beat = started
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            lag_ms = lag * 1000
+            self.lag_ms.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag >= self.threshold:
+                stage = self._sampled_stage or self._stage or "unknown"
+                self.stalls.append({"at": time.time(), "ms": round(lag_ms), "stage": stage})
+                logger.warning(f"Event loop stalled {lag_ms:.0f} ms (stage: {stage})")
+            self._sampled_stage = None
+
+    def _watch(self) -> None:
+        sampled_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._last_beat
+            if time.monotonic() - beat - self.interval < self.threshold or beat == sampled_beat:
+                continue
+            sampled_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stage = self._stage or self._frame_stage(frame)
+            self._sampled_stage = stage
+            stack = "".join(traceback.format_stack(frame, limit=15))
+            logger.warning(f"Event loop blocked over {self.threshold * 1000:.0f} ms in {stage}; loop thread stack:\n{stack}")
+
+    def start(self) -> None:
+        """Start the heartbeat on the running loop and the watchdog thread (once)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def summary(self) -> Dict[str, Any]:
+        samples = sorted(self.lag_ms)
+        by_stage: Dict[str, List[int]] = {}
+        for stall in self.stalls:
+            by_stage.setdefault(stall["stage"], []).append(stall["ms"])
+        return {
+            "p50_ms": round(samples[len(samples) // 2]) if samples else None,
+            "p99_ms": round(samples[min(int(len(samples) * 0.99), len(samples) - 1)]) if samples else None,
+            "max_ms": round(self.max_lag_ms),
+            "stalls": len(self.stalls),
+            "stages": sorted(
+                ((stage, len(ms), max(ms)) for stage, ms in by_stage.items()),
+                key=lambda s: -s[1],
+            ),
+        }
+
+loop_monitor = LoopMonitor()
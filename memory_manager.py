@@ -1,8 +1,15 @@
+import asyncio
 import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and an assistant for the assistant's own later use. "
+    "Merge it with the earlier summary if one is given. Keep names, facts, preferences, decisions and "
+    "open questions; drop greetings and filler. Answer with the summary only, under 150 words."
+)
+
 class MemoryManager:
     def __init__(self):
         self.channel_memories = {}
@@ -10,8 +17,14 @@ class MemoryManager:
         self.user_histories = {}
         self.user_models = {}
         self.user_model_histories = {}
+        # guild -> user -> model -> {"summary", "turns", "updated"}
+        self.user_summaries = {}
         self.models = []
         self.api_client = None
+        # (guild, user, model) keys with a compaction in flight
+        self._compacting = set()
+        # Bumped by clear_user_summaries so in-flight compactions are discarded
+        self._summary_generation = {}
 
     def set_models(self, models):
         self.models = models
@@ -50,6 +63,78 @@ class MemoryManager:
         self.user_model_histories.setdefault(guild_id, {}).setdefault(user_id, {}).setdefault(model_name, [])
         return self.user_model_histories[guild_id][user_id][model_name]
 
+    def get_user_summary(self, guild_id, user_id, model_name):
+        return self.user_summaries.get(str(guild_id), {}).get(str(user_id), {}).get(str(model_name))
+
+    def get_user_model_context(self, guild_id, user_id, model_name):
+        """History to replay into a prompt: the stored summary (if any) plus the recent raw turns."""
+        history = self.get_user_model_history(guild_id, user_id, model_name)
+        record = self.get_user_summary(guild_id, user_id, model_name)
+        if not record or not record.get("summary"):
+            return list(history)
+        return [{"role": "system", "content": f"Summary of the earlier conversation: {record['summary']}"}] + list(history)
+
+    def clear_user_summaries(self, guild_id, user_id):
+        guild_id = str(guild_id)
+        user_id = str(user_id)
+        key = (guild_id, user_id)
+        self._summary_generation[key] = self._summary_generation.get(key, 0) + 1
+        if user_id in self.user_summaries.get(guild_id, {}):
+            self.user_summaries[guild_id][user_id] = {}
+
+    def schedule_compaction(self, guild_id, user_id, model_name):
+        """Fold older turns into the summary in the background once the history is long."""
+        config = self.api_client.config if self.api_client else None
+        if config is None or config.summary_threshold <= 0:
+            return None
+        key = (str(guild_id), str(user_id), str(model_name))
+        history = self.get_user_model_history(*key)
+        if len(history) < config.summary_threshold or key in self._compacting:
+            return None
+        self._compacting.add(key)
+        generation = self._summary_generation.get(key[:2], 0)
+        task = asyncio.get_running_loop().create_task(self._compact(*key, generation))
+        task.add_done_callback(lambda _t: self._compacting.discard(key))
+        return task
+
+    async def _compact(self, guild_id, user_id, model_name, generation):
+        config = self.api_client.config
+        history = self.get_user_model_history(guild_id, user_id, model_name)
+        fold = history[:max(len(history) - config.summary_keep_turns, 0)]
+        if not fold:
+            return
+        previous = self.get_user_summary(guild_id, user_id, model_name) or {}
+        transcript = "\n".join(
+            f"{'Assistant' if msg['role'] == 'ai' else 'User'}: {msg['content']}"
+            for msg in fold if msg.get("content", "").strip()
+        )
+        parts = [f"Earlier summary:\n{previous['summary']}"] if previous.get("summary") else []
+        parts.append(f"Conversation:\n{transcript}")
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n\n".join(parts)},
+        ]
+        try:
+            summary = await self.api_client.send_message(messages, None, guild_id, user_id, route="summary")
+        except Exception as e:
+            logger.warning(f"History summary failed for user {user_id} in guild {guild_id}: {e}")
+            return
+        summary = (summary or "").strip()
+        if not summary or summary.startswith("Error:"):
+            logger.warning(f"History summary failed for user {user_id} in guild {guild_id}: {summary[:200]}")
+            return
+        if self._summary_generation.get((guild_id, user_id), 0) != generation:
+            return
+        # Drop exactly the folded turns; new ones may have arrived meanwhile.
+        folded = {id(msg) for msg in fold}
+        history[:] = [msg for msg in history if id(msg) not in folded]
+        self.user_summaries.setdefault(guild_id, {}).setdefault(user_id, {})[model_name] = {
+            "summary": summary,
+            "turns": previous.get("turns", 0) + len(fold),
+            "updated": str(datetime.datetime.now()),
+        }
+        logger.info(f"Folded {len(fold)} turns into the summary for user {user_id} in guild {guild_id} ({model_name})")
+
     def add_user_message(self, channel_id, guild_id, user_id, message_content):
         channel_id = str(channel_id)
         guild_id = str(guild_id)
@@ -118,6 +203,24 @@ class MemoryManager:
         if len(self.user_histories[guild_id][user_id]) > 20:
             self.user_histories[guild_id][user_id] = self.user_histories[guild_id][user_id][-20:]
 
+    def remove_last_user_message(self, channel_id, guild_id, user_id, message_content):
+        """Take back the most recent user message with this content (a turn that was superseded)."""
+        channel_id = str(channel_id)
+        guild_id = str(guild_id)
+        user_id = str(user_id)
+        model = self.get_user_model(guild_id, user_id)
+        lists = [
+            self.user_model_histories.get(guild_id, {}).get(user_id, {}).get(model, []),
+            self.channel_histories.get(channel_id, []),
+            self.user_histories.get(guild_id, {}).get(user_id, []),
+        ]
+        for history in lists:
+            for i in range(len(history) - 1, -1, -1):
+                entry = history[i]
+                if entry["role"] == "user" and entry["content"] == message_content and entry.get("user_id", user_id) == user_id:
+                    del history[i]
+                    break
+
     def get_user_history(self, guild_id, user_id):
         guild_id = str(guild_id)
         user_id = str(user_id)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class _Turn:
+    __slots__ = ("messages", "task", "committed")
+
+    def __init__(self, message: Any):
+        self.messages: List[Any] = [message]
+        self.task: Optional[asyncio.Task] = None
+        # Set by the handler right before it replies; after that the turn is final.
+        self.committed = asyncio.Event()
+
+class MessageDebouncer:
+    """Merge rapid messages from one user in one channel into a single turn.
+
+    Each message (re)starts a ``window_ms`` timer for its (channel, user).
+    When the timer runs out, every message collected so far is handed to
+    ``process`` as one newline-joined text, replying to the latest message.
+    A message that arrives while an earlier turn is still planning or
+    retrieving cancels that work and joins the turn; once the turn has
+    started replying, new messages start a fresh turn instead.
+    """
+
+    def __init__(self, process: Callable[[Any, str, asyncio.Event], Awaitable[None]], window_ms: float):
+        self.process = process
+        self.window = window_ms / 1000
+        self.turns: Dict[Tuple[int, int], _Turn] = {}
+        self.stats = {"turns": 0, "merged": 0, "cancelled": 0}
+
+    def submit(self, message: Any) -> None:
+        key = (message.channel.id, message.author.id)
+        turn = self.turns.get(key)
+        if turn is not None and not turn.committed.is_set():
+            turn.messages.append(message)
+            self.stats["merged"] += 1
+            if turn.task is not None and not turn.task.done():
+                turn.task.cancel()
+                self.stats["cancelled"] += 1
+        else:
+            turn = self.turns[key] = _Turn(message)
+        turn.task = asyncio.create_task(self._run(key, turn))
+
+    async def _run(self, key: Tuple[int, int], turn: _Turn) -> None:
+        try:
+            await asyncio.sleep(self.window)
+            if len(turn.messages) > 1:
+                logger.info(f"Merged {len(turn.messages)} messages from {key[1]} in {key[0]} into one turn")
+            content = "\n".join(m.content for m in turn.messages if m.content)
+            await self.process(turn.messages[-1], content, turn.committed)
+            self.stats["turns"] += 1
+        finally:
+            # A newer task owns the turn when this one was superseded.
+            if self.turns.get(key) is turn and turn.task is asyncio.current_task():
+                del self.turns[key]
@@ -0,0 +1,63 @@
+import re
+import logging
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class MessageGate:
+    """Decide cheaply whether an incoming message is for the bot.
+
+    Runs before anything touches memory or disk. Returns the trigger that
+    matched ("command", "dm", "channel", "mention", "reply", "keyword" or
+    "all") or None to drop the message. Channel checks are set lookups and
+    the keywords are one compiled regex.
+    """
+
+    def __init__(self, config, command_prefix: str = "!"):
+        self.config = config
+        self.command_prefix = command_prefix
+        self.triggers = config.response_triggers
+        keywords = sorted(config.trigger_keywords, key=len, reverse=True)
+        self.keyword_re = (
+            re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")\b", re.IGNORECASE)
+            if keywords else None
+        )
+        # trigger (or "dropped") -> messages seen
+        self.stats: Counter = Counter()
+
+    def _reply_to(self, message, bot_id: int) -> bool:
+        ref = message.reference
+        if ref is None:
+            return False
+        # Only use what discord.py already has; never fetch the referenced message here.
+        resolved = ref.resolved or getattr(ref, "cached_message", None)
+        author = getattr(resolved, "author", None)
+        return author is not None and author.id == bot_id
+
+    def check(self, message, bot_user) -> Optional[str]:
+        trigger = self._check(message, bot_user)
+        self.stats[trigger or "dropped"] += 1
+        return trigger
+
+    def _check(self, message, bot_user) -> Optional[str]:
+        channel_id = str(message.channel.id)
+        if message.guild and self.config.allowed_channels and channel_id not in self.config.allowed_channels:
+            return None
+        content = message.content or ""
+        if content.startswith(self.command_prefix):
+            return "command"
+        triggers = self.triggers
+        if "all" in triggers:
+            return "all"
+        if message.guild is None:
+            return "dm" if "dm" in triggers else None
+        if "channel" in triggers and channel_id in self.config.bot_channels:
+            return "channel"
+        if "mention" in triggers and bot_user is not None and any(u.id == bot_user.id for u in message.mentions):
+            return "mention"
+        if "reply" in triggers and bot_user is not None and self._reply_to(message, bot_user.id):
+            return "reply"
+        if "keyword" in triggers and self.keyword_re is not None and self.keyword_re.search(content):
+            return "keyword"
+        return None
@@ -1,15 +1,34 @@
-import discord
 import re
 import logging
 import asyncio
-import aiohttp
-from io import BytesIO
 import json
 from pathlib import Path
 from typing import Dict, Any, Tuple, List
+from stats_engine import StatsEngine
+from crafting_graph import CraftingGraph, CRAFT_TERMS, parse_quantity_flags
+import entity_catalog
+from entity_catalog import META_KEYS, Entity, EntityCatalog
+from knowledge_snapshot import open_snapshot
+from dune_logic import prefetcher
+from loop_monitor import loop_monitor
+from offload import offload
+from send_queue import send_queue
+from image_pipeline import image_pipeline
+from planner_batcher import BATCH_INSTRUCTIONS, PlannerBatcher
 
 logger = logging.getLogger(__name__)
 
+GUARDRAILS = (
+    "When the question concerns items, gear, or stats, use ONLY the following GameData JSON "
+    "for concrete names or numbers. If an asked-for item is missing, say so briefly and ask a short follow-up. "
+    "Do not comment about GameData if the user wasn't asking about items. DuneLogic search results are provided as additional context."
+)
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    """Mark a speculative task's failure as seen; the plan may never await it."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Speculative retrieval failed: {task.exception()}")
+
 class MessageHandler:
     def __init__(self, api_client=None, memory_manager=None, config=None, data_manager=None, bot=None):
         self.api_client = api_client
@@ -28,25 +47,52 @@ class MessageHandler:
         # (without extension) so the bot can look up specific domains on demand.
         self.game_data: Dict[str, Dict[str, Any]] = {}
         info_dir = Path("information")
-        for json_file in info_dir.glob("*.json"):
-            name = json_file.stem
-            self.game_data[name] = self.load_game_data(json_file)
+        # Compiled, memory-mapped copy of the information files shared by every
+        # bot process on the host; rebuilt when the files (or aliasing) change.
+        # Aliases depend on the synonyms and on ALIAS_VERSION, which covers the
+        # aliasing code in entity_catalog.py and normalize_text.
+        self.snapshot = None
+        if config.knowledge_snapshot:
+            salt = f"{json.dumps(self.synonyms, sort_keys=True)}\n{entity_catalog.ALIAS_VERSION}"
+            self.snapshot = open_snapshot(config.knowledge_snapshot, info_dir, salt,
+                                          lambda data: EntityCatalog(data, self.normalize_text))
+        if self.snapshot is not None:
+            for name in self.snapshot.files:
+                self.game_data[name] = self.snapshot.load(name)
+            self.catalog = EntityCatalog.from_records(self.snapshot.entity_records(), self.game_data, self.normalize_text)
+        else:
+            for json_file in info_dir.glob("*.json"):
+                name = json_file.stem
+                self.game_data[name] = self.load_game_data(json_file)
+
+            # Every named entity across the information files, with stable ids and
+            # aliases, for mapping user text to canonical names.
+            self.catalog = EntityCatalog(self.game_data, self.normalize_text)
 
         # Build a short summary of each information file so the LLM knows
         # what domains are available when planning which files to request.
         self.file_summaries: Dict[str, str] = {}
         for name, data in self.game_data.items():
-            self.file_summaries[name] = self._summarize_game_data(data)
-
-        # Merge item dictionaries across all loaded domains for quick lookup
-        # (used when mapping user text to a canonical item name).
-        self.items: Dict[str, Dict[str, Any]] = {}
-        for data in self.game_data.values():
-            self.items.update(self._extract_items(data))
-
-        self.item_lookup: Dict[str, Tuple[str, Dict[str, Any]]] = {
-            self.normalize_text(name): (name, details) for name, details in self.items.items()
-        }
+            self.file_summaries[name] = self._summarize_game_data(name, data)
+
+        # Typed numeric columns for weapons/armor/vehicles so ranking
+        # questions get exact top-k rows instead of the whole file.
+        self.stats_engine = StatsEngine(self.game_data)
+        # Recipe/research graph for material totals and unlock questions.
+        self.crafting_graph = CraftingGraph(self.game_data)
+        # Dune Logic paths are attached whenever the prefetcher rebuilds its index.
+        prefetcher.on_index.append(self._link_logic)
+
+        # Canonical (sorted-key) JSON per information file for the stable
+        # prompt layout, filled on first use (read from the snapshot instead
+        # when there is one).
+        self._static_json: Dict[str, str] = {}
+
+        # Under load, planner calls arriving within PLANNER_BATCH_MS share one
+        # upstream request; off (None) when the window is 0.
+        self.planner_batcher = None
+        if config.planner_batch_ms > 0:
+            self.planner_batcher = PlannerBatcher(self._ai_query_plan_batch, config.planner_batch_ms, config.planner_batch_max)
 
         # Grab a game summary if any file provides one
         self.game_summary = ""
@@ -104,23 +150,12 @@ class MessageHandler:
             logger.error(f"Failed to load game data from {path}: {e}")
             return {}
 
-    def _extract_items(self, data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
-        if isinstance(data, dict):
-            if "items" in data and isinstance(data["items"], dict):
-                return data["items"]
-            if "item_dictionary" in data and isinstance(data["item_dictionary"], dict):
-                return data["item_dictionary"]
-            meta_keys = {"game_summary", "version", "_meta"}
-            items = {k: v for k, v in data.items() if k not in meta_keys and isinstance(v, dict)}
-            if items:
-                return items
-        return {}
-
-    def _summarize_game_data(self, data: Dict[str, Any]) -> str:
+    def _summarize_game_data(self, name: str, data: Dict[str, Any]) -> str:
         """Generate a brief, human-readable summary of a game data file.
 
-        The summary lists a handful of top-level item names or keys so the LLM
-        has an idea of what the file contains before requesting it.
+        The summary lists a handful of categories or entity names from the
+        catalog (or top-level keys) so the LLM has an idea of what the file
+        contains before requesting it.
         """
 
         if not isinstance(data, dict):
@@ -131,18 +166,35 @@ class MessageHandler:
         if isinstance(summary, str) and summary.strip():
             return summary.strip()
 
-        # Otherwise build a summary from item names or keys
-        items = self._extract_items(data)
-        if items:
-            if len(items) == 1 and isinstance(next(iter(items.values())), dict):
-                inner = next(iter(items.values()))
-                keys = list(inner.keys())[:5]
-            else:
-                keys = list(items.keys())[:5]
+        # Otherwise build a summary from entity categories, names or keys
+        entities = self.catalog.by_source.get(name, [])
+        categories = list(dict.fromkeys(e.category for e in entities if e.category))
+        if len(categories) > 1:
+            keys = categories[:5]
+        elif entities:
+            keys = [e.name for e in entities[:5]]
         else:
-            keys = list(data.keys())[:5]
+            keys = [k for k, v in data.items() if k not in META_KEYS and isinstance(v, (dict, list))]
+            if len(keys) == 1 and isinstance(data[keys[0]], list):
+                # A single list of guide entries: show their titles.
+                keys = [e["title"] for e in data[keys[0]] if isinstance(e, dict) and e.get("title")] or keys
+            keys = keys[:5]
         return ", ".join(map(str, keys))
 
+    def find_entities(self, text: str, limit: int = 5) -> List[Entity]:
+        """Catalog entities named in ``text``, linked to Dune Logic once its index is loaded."""
+
+        return self.catalog.find_in(text, limit)
+
+    def resolve_entity(self, text: str) -> Entity | None:
+        return self.catalog.resolve(text)
+
+    async def _link_logic(self, locale: str, index: Any) -> None:
+        """Relink catalog entities to a rebuilt search index, off the event loop."""
+        if locale == "en":
+            await offload.run(self.catalog.link_logic, index, stage="link_logic")
+
+    # Changes to the aliases this produces need entity_catalog.ALIAS_VERSION bumped.
     def normalize_text(self, text: str) -> str:
         text = (text or "").lower()
         synonyms = getattr(self, "synonyms", {})
@@ -166,7 +218,7 @@ class MessageHandler:
     def is_item_query(self, user_message: str) -> bool:
         norm = self.normalize_text(user_message)
         tokens = set(norm.split())
-        return bool(tokens & self.domain_terms)
+        return bool(tokens & self.domain_terms) or bool(self.catalog.find_in(norm, 1))
 
     def _heuristic_files(self, user_message: str) -> List[str]:
         """Fallback selection of JSON files based on keywords in the message."""
@@ -178,6 +230,8 @@ class MessageHandler:
             fname = self.domain_to_file.get(tok)
             if fname:
                 files.append(fname)
+        # Files holding entities the message names directly.
+        files += [e.source for e in self.catalog.find_in(norm)]
         if not files and self.game_data:
             # If nothing matches, include the first available file to satisfy
             # the requirement of always providing at least one JSON dataset.
@@ -185,8 +239,12 @@ class MessageHandler:
         # Preserve order while removing duplicates
         return list(dict.fromkeys(files))
 
-    def _heuristic_logic(self, user_message: str) -> List[Dict[str, Any]]:
-        """Fallback logic search using a keyword from the user's message."""
+    def _heuristic_logic(self, user_message: str, named_only: bool = False) -> List[Dict[str, Any]]:
+        """Fallback logic search using a keyword from the user's message.
+
+        With ``named_only`` nothing is returned unless the message names a
+        known entity (no first-word fallback).
+        """
 
         norm = self.normalize_text(user_message)
         tokens = norm.split()
@@ -209,11 +267,15 @@ class MessageHandler:
             if tok in type_map:
                 ltype = type_map[tok]
                 break
-        keyword = tokens[0]
+        # Prefer a named entity over the first word of the message.
+        named = self.catalog.find_in(norm, 1)
+        if not named and named_only:
+            return []
+        keyword = self.normalize_text(named[0].name) if named else tokens[0]
         return [{"type": ltype, "terms": [keyword]}]
 
 
-    async def _ai_query_plan(self, model: str, user_message: str) -> Dict[str, Any]:
+    async def _ai_query_plan(self, model: str, user_message: str, guild_id: str = "global", user_id: str = "") -> Dict[str, Any]:
         """Ask the LLM which information files and keywords are relevant.
 
         The model is prompted to return JSON with three arrays:
@@ -224,9 +286,16 @@ class MessageHandler:
           ``terms`` keywords.
         """
 
+        if self.planner_batcher is not None:
+            batched = await self.planner_batcher.plan(model, user_message)
+            if batched is not None:
+                try:
+                    return self._normalize_plan(batched, user_message)
+                except Exception as e:
+                    logger.warning(f"Batched query plan was malformed, planning alone: {e}")
+
         sys = self.config.info_request_instructions
-        overview_lines = [f"{name}: {summary}" for name, summary in self.file_summaries.items()]
-        overview = "\n".join(overview_lines)
+        overview = self._planner_overview()
         usr = (
             f"Available files and summaries:\n{overview}\n\n"
             f"User question: {user_message}\nReturn only JSON."
@@ -235,32 +304,13 @@ class MessageHandler:
             out = await self.api_client.send_message(
                 [{"role": "system", "content": sys}, {"role": "user", "content": usr}],
                 model,
+                guild_id,
+                user_id,
+                coalesce=True,
+                route="planner",
             )
             m = re.search(r"\{[\s\S]*\}", out or "")
-            plan = json.loads(m.group(0)) if m else {}
-            plan["files"] = [
-                self.normalize_text(f) for f in plan.get("files", []) if isinstance(f, str)
-            ]
-            plan["keywords"] = [
-                self.normalize_text(k) for k in plan.get("keywords", []) if isinstance(k, str)
-            ]
-            logic_queries: List[Dict[str, Any]] = []
-            for entry in plan.get("logic", []):
-                if isinstance(entry, dict):
-                    tp = self.normalize_text(entry.get("type", ""))
-                    terms = [
-                        self.normalize_text(t)
-                        for t in entry.get("terms", [])
-                        if isinstance(t, str)
-                    ]
-                    if terms:
-                        logic_queries.append({"type": tp, "terms": terms})
-            plan["logic"] = logic_queries
-            if not plan["files"]:
-                plan["files"] = self._heuristic_files(user_message)
-            if not plan["logic"]:
-                plan["logic"] = self._heuristic_logic(user_message)
-            return plan
+            return self._normalize_plan(json.loads(m.group(0)) if m else {}, user_message)
         except Exception as e:
             logger.warning(f"Query-plan parse failed, falling back to heuristic: {e}")
             return {
@@ -269,75 +319,297 @@ class MessageHandler:
                 "logic": self._heuristic_logic(user_message),
             }
 
-    def _retrieve_data(self, plan: Dict[str, Any]) -> Dict[str, Any]:
-        """Return the raw contents of each requested information file."""
+    def _planner_overview(self) -> str:
+        return "\n".join(f"{name}: {summary}" for name, summary in self.file_summaries.items())
+
+    async def _ai_query_plan_batch(self, model: str, questions: List[Tuple[str, str]]) -> str:
+        """One planner call over several ``(id, question)`` pairs; returns the raw reply.
 
+        The reply serves several users, so it is rate-limited and accounted
+        under the shared "global" key rather than any one of them.
+        """
+        sys = f"{self.config.info_request_instructions}\n\n{BATCH_INSTRUCTIONS}"
+        listed = "\n".join(json.dumps({"id": qid, "question": q}, ensure_ascii=False) for qid, q in questions)
+        usr = (
+            f"Available files and summaries:\n{self._planner_overview()}\n\n"
+            f"Questions:\n{listed}\nReturn only a JSON array."
+        )
+        return await self.api_client.send_message(
+            [{"role": "system", "content": sys}, {"role": "user", "content": usr}],
+            model,
+            route="planner",
+            max_tokens=self.config.route_max_tokens.get("planner", 300) * len(questions),
+            # The reply grows with the batch; a failed batch already falls back per question.
+            timeout_s=self.config.route_timeout_s * max(1.0, len(questions) / 2),
+            fallback=False,
+        )
+
+    def _normalize_plan(self, plan: Dict[str, Any], user_message: str) -> Dict[str, Any]:
+        """Normalize a raw plan, filling empty files/logic from the heuristics."""
+        plan["files"] = [
+            self.normalize_text(f) for f in plan.get("files", []) if isinstance(f, str)
+        ]
+        plan["keywords"] = [
+            self.normalize_text(k) for k in plan.get("keywords", []) if isinstance(k, str)
+        ]
+        logic_queries: List[Dict[str, Any]] = []
+        for entry in plan.get("logic", []):
+            if isinstance(entry, dict):
+                tp = self.normalize_text(entry.get("type", ""))
+                terms = [
+                    self.normalize_text(t)
+                    for t in entry.get("terms", [])
+                    if isinstance(t, str)
+                ]
+                if terms:
+                    logic_queries.append({"type": tp, "terms": terms})
+        plan["logic"] = logic_queries
+        if not plan["files"]:
+            plan["files"] = self._heuristic_files(user_message)
+        if not plan["logic"]:
+            plan["logic"] = self._heuristic_logic(user_message)
+        return plan
+
+    def _retrieve_data(self, plan: Dict[str, Any], user_message: str | None = None) -> Dict[str, Any]:
+        """Return the contents of each requested information file.
+
+        When ``user_message`` asks for a ranking over a file with a stats
+        table (e.g. "highest dps sidearm"), only the computed top rows are
+        returned for that file instead of its raw contents.
+        """
+
+        norm = self.normalize_text(user_message) if user_message else ""
         results: Dict[str, Any] = {}
+        entities = self.find_entities(norm) if norm else []
+        if entities:
+            # Canonical names (and database paths) for what the user mentioned.
+            results["entities"] = [e.summary() for e in entities]
         for file in plan.get("files", []):
             data = self.game_data.get(file)
-            if data is not None:
+            if data is None:
+                continue
+            ranking = self.stats_engine.rank(file, norm) if norm else None
+            if ranking is not None:
+                results[file] = {
+                    "ranking": ranking,
+                    "note": f"Top rows computed from {file}.json stats; numbers are exact.",
+                }
+            else:
                 results[file] = data
         return results
 
+    def _crafting_context(self, user_message: str) -> Dict[str, Any] | None:
+        """Precomputed material/intel totals when the message asks about crafting."""
+
+        if not (set(self.normalize_text(user_message).split()) & CRAFT_TERMS):
+            return None
+        text, quantity, deep_desert = parse_quantity_flags(user_message)
+        return self.crafting_graph.describe(text, quantity, deep_desert)
+
     def _game_context_json(self, matches: Dict[str, Any]) -> str:
         """Serialize matched game data to JSON for LLM consumption."""
 
         return json.dumps(matches, ensure_ascii=False, indent=2)
 
-    async def _dune_logic_lookup(self, plan: Dict[str, Any]) -> Dict[str, Any]:
-        """Perform searches against the Dune Logic database based on plan."""
+    def _static_context(self, matches: Dict[str, Any]) -> List[str]:
+        """Byte-stable text blocks for the unmodified information files in ``matches``.
+
+        One block per file, sorted by name and serialized with sorted keys
+        once, so requests naming overlapping files share leading messages.
+        """
+
+        blocks = []
+        for name in sorted(f for f, data in matches.items() if data is self.game_data.get(f)):
+            text = self.snapshot.fragment(name) if self.snapshot is not None else self._static_json.get(name)
+            if text is None:
+                text = self._static_json[name] = json.dumps(self.game_data[name], ensure_ascii=False, sort_keys=True, indent=2)
+            blocks.append(f"GameData {name}.json:\n{text}")
+        return blocks
+
+    def _context_sources(self, matches: Dict[str, Any], game_json: str, history: List[Dict[str, str]]) -> Dict[str, int]:
+        """Characters each information file and the history add to the answer prompt.
+
+        The classic layout serializes all files as one block, so they are
+        reported together under their joined names.
+        """
+
+        sources = {"history": sum(len(m["content"]) for m in history)} if history else {}
+        if game_json:
+            sources["+".join(f"{name}.json" for name in matches)] = len(game_json)
+            return sources
+        for name, data in matches.items():
+            static = data is self.game_data.get(name)
+            if static and self.snapshot is not None:
+                sources[f"{name}.json"] = self.snapshot.fragment_chars(name)
+                continue
+            text = self._static_json.get(name) if static else None
+            # Computed subsets (rankings, filtered entries) are small; measure them directly.
+            sources[f"{name}.json"] = len(text) if text is not None else len(json.dumps(data, ensure_ascii=False, indent=2))
+        return sources
+
+    def _layout_messages(self, system_prompt: str, history: List[Dict[str, str]], matches: Dict[str, Any],
+                         game_json: str, extra_parts: List[str], user_message: str) -> List[Dict[str, str]]:
+        """Assemble the answer prompt in the configured layout.
+
+        ``classic``: instructions, history, then all retrieved context.
+        ``stable``: instructions and the static information files first, then
+        history, then per-question context (rankings, entities, crafting and
+        Dune Logic results) right before the user message.
+        """
+
+        if self.config.prompt_layout != "stable":
+            messages = [{"role": "system", "content": system_prompt}] + history
+            context_parts = ([f"GameData:\n{game_json}"] if matches else []) + extra_parts
+            if context_parts:
+                messages.append({"role": "system", "content": GUARDRAILS + "\n\n" + "\n\n".join(context_parts)})
+            messages.append({"role": "user", "content": user_message})
+            return messages
+
+        static = self._static_context(matches)
+        dynamic = {k: v for k, v in matches.items() if v is not self.game_data.get(k)}
+        context_parts = ["GameData (computed for this question):\n" + json.dumps(dynamic, ensure_ascii=False, sort_keys=True, indent=2)] if dynamic else []
+        context_parts += extra_parts
+        has_context = bool(static or context_parts)
+        messages = [{"role": "system", "content": system_prompt + ("\n\n" + GUARDRAILS if has_context else "")}]
+        messages += [{"role": "system", "content": block} for block in static]
+        messages += history
+        if context_parts:
+            messages.append({"role": "system", "content": "\n\n".join(context_parts)})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def _logic_key(self, query: Dict[str, Any]) -> Tuple[Tuple[str, ...], str]:
+        """Return the (types, keyword) pair a logic query actually searches for.
+
+        Queries with the same key produce the same results, which lets
+        speculative lookups be matched against the planner's choices.
+        """
+
+        type_map = {
+            "item": "items",
+            "weapon": "items",
+            "vehicle": "items",
+            "npc": "npcs",
+            "contract": "contracts",
+            "building": "buildables",
+            "skill": "skills",
+        }
+        qtype = query.get("type", "")
+        types = (type_map[qtype],) if qtype in type_map else ()
+        keyword = " ".join(query.get("terms", [])).strip()
+        return types, keyword
+
+    async def _logic_cards(self, types: Tuple[str, ...], keyword: str) -> List[Dict[str, Any]] | None:
+        """Search Dune Logic and fetch cards for the top suggestions.
+
+        Returns ``None`` when the search itself fails.
+        """
 
         from dune_logic.search import search_autocomplete, route_path
 
-        results: List[Dict[str, Any]] = []
+        try:
+            suggestions = await search_autocomplete("en", keyword, list(types) or None)
+        except Exception as e:
+            logger.warning(f"Logic search failed for {keyword}: {e}")
+            return None
+        cards: List[Dict[str, Any]] = []
+        for s in suggestions[:3]:
+            path = s.get("path")
+            if not path:
+                continue
+            try:
+                kind, card = await route_path("en", path)
+                card["kind"] = kind
+                card["path"] = path
+                cards.append(card)
+            except Exception as e:
+                logger.warning(f"Logic fetch failed for {path}: {e}")
+        return cards
+
+    async def _dune_logic_lookup(self, plan: Dict[str, Any], speculative: Dict[tuple, asyncio.Task] | None = None) -> Dict[str, Any]:
+        """Perform searches against the Dune Logic database based on plan.
+
+        ``speculative`` maps :meth:`_logic_key` results to lookups that were
+        started before the plan was known. Matching ones are reused, the rest
+        are cancelled.
+        """
+
+        speculative = dict(speculative or {})
+        pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
         for query in plan.get("logic", []):
             if not isinstance(query, dict):
                 continue
-            terms = query.get("terms", [])
-            qtype = query.get("type", "")
-            keyword = " ".join(terms).strip()
-            if not keyword:
+            key = self._logic_key(query)
+            if not key[1]:
                 continue
-            type_map = {
-                "item": "items",
-                "weapon": "items",
-                "vehicle": "items",
-                "npc": "npcs",
-                "contract": "contracts",
-                "building": "buildables",
-                "skill": "skills",
-            }
-            types = [type_map[qtype]] if qtype in type_map else None
-            try:
-                suggestions = await search_autocomplete("en", keyword, types)
-            except Exception as e:
-                logger.warning(f"Logic search failed for {keyword}: {e}")
+            task = speculative.pop(key, None)
+            if task is None:
+                task = asyncio.ensure_future(self._logic_cards(*key))
+            else:
+                logger.debug(f"Reusing speculative logic lookup for {key[1]}")
+            pending.append((query, task))
+        for task in speculative.values():
+            task.cancel()
+
+        results: List[Dict[str, Any]] = []
+        all_cards = await asyncio.gather(*(task for _, task in pending))
+        for (query, _), cards in zip(pending, all_cards):
+            if cards is None:
                 continue
-            cards: List[Dict[str, Any]] = []
-            for s in suggestions[:3]:
-                path = s.get("path")
-                if not path:
-                    continue
-                try:
-                    kind, card = await route_path("en", path)
-                    card["kind"] = kind
-                    card["path"] = path
-                    cards.append(card)
-                except Exception as e:
-                    logger.warning(f"Logic fetch failed for {path}: {e}")
-            results.append({"type": qtype, "terms": terms, "results": cards})
+            results.append({"type": query.get("type", ""), "terms": query.get("terms", []), "results": cards})
         return {"logic": results}
 
-    async def handle_message(self, message):
+    def _start_speculative_retrieval(self, user_message: str) -> Tuple[Dict[str, Any], asyncio.Task, Dict[tuple, asyncio.Task]]:
+        """Kick off heuristic retrieval while the planner call is in flight.
+
+        Returns the heuristically matched files, a task serializing them to
+        JSON in a worker thread, and the started logic lookups keyed by
+        :meth:`_logic_key`.
+        """
+
+        spec_matches = self._retrieve_data({"files": self._heuristic_files(user_message)}, user_message)
+        # The stable layout only needs the per-file canonical JSON warmed.
+        serialize = self._static_context if self.config.prompt_layout == "stable" else self._game_context_json
+        spec_context = asyncio.ensure_future(offload.run(serialize, spec_matches, stage="game_context_json"))
+        spec_context.add_done_callback(_retrieve_exception)
+        spec_logic: Dict[tuple, asyncio.Task] = {}
+        # Only speculate on names the catalog knows; a first-word guess
+        # ("whats", "can") would almost always be thrown away by the plan.
+        for query in self._heuristic_logic(user_message, named_only=True):
+            key = self._logic_key(query)
+            if key[1] and key not in spec_logic:
+                spec_logic[key] = asyncio.ensure_future(self._logic_cards(*key))
+                spec_logic[key].add_done_callback(_retrieve_exception)
+        return spec_matches, spec_context, spec_logic
+
+    async def handle_message(self, message, content: str | None = None, committed: asyncio.Event | None = None):
+        """Answer ``message`` (or ``content``, several merged messages, replying to ``message``).
+
+        ``committed`` is set right before the reply is sent. If the turn is
+        cancelled before that, its user message is taken back out of memory.
+        """
+
         channel_id = str(message.channel.id)
         guild_id = str(message.guild.id) if message.guild else "DM"
         user_id = str(message.author.id)
-        user_message = message.content
+        user_message = message.content if content is None else content
 
         if user_message.lower().startswith("!"):
             return
+        if self.bot is not None and self.bot.user is not None:
+            # A mention is how the message reached us, not part of the question.
+            user_message = re.sub(rf"<@!?{self.bot.user.id}>", "", user_message).strip() or user_message
 
         self.memory_manager.add_user_message(channel_id, guild_id, user_id, user_message)
+        try:
+            await self._answer(message, channel_id, guild_id, user_id, user_message, committed)
+        except asyncio.CancelledError:
+            if committed is None or not committed.is_set():
+                self.memory_manager.remove_last_user_message(channel_id, guild_id, user_id, user_message)
+            raise
+
+    async def _answer(self, message, channel_id: str, guild_id: str, user_id: str, user_message: str,
+                      committed: asyncio.Event | None):
         user_model = self.memory_manager.get_user_model(guild_id, user_id)
 
         if self.is_small_talk(user_message):
@@ -347,58 +619,83 @@ class MessageHandler:
                 {"role": "user", "content": user_message},
             ]
             try:
-                ai_response = await self.api_client.send_message(messages, user_model)
+                ai_response = await self.api_client.send_message(messages, user_model, guild_id, user_id, coalesce=True, route="small_talk")
             except Exception as e:
-                await message.channel.send(f"<@{user_id}> Error: Failed to fetch response - {e}")
+                await send_queue.send(message.channel, f"<@{user_id}> Error: Failed to fetch response - {e}")
                 return
             ai_response_clean = self.clean_response(ai_response) or "Hey!"
             final_message = self.build_message(ai_response_clean)
+            if committed is not None:
+                committed.set()
             await self._send_message(message, user_id, final_message, user_message.lower())
             return
 
-        messages = []
         system_prompt = f"{self.config.system_instructions}\nYou are {user_model}."
-        messages.append({"role": "system", "content": system_prompt})
+        history: List[Dict[str, str]] = []
 
         channel_memories = self.memory_manager.channel_memories.get(channel_id, [])
         if channel_memories:
-            messages.append({"role": "user", "content": "\n".join(channel_memories)})
+            history.append({"role": "user", "content": "\n".join(channel_memories)})
 
-        model_history = self.memory_manager.get_user_model_history(guild_id, user_id, user_model)
+        model_history = self.memory_manager.get_user_model_context(guild_id, user_id, user_model)
         for msg in model_history:
             if msg["content"].strip():
                 role = "assistant" if msg["role"] == "ai" else msg["role"]
-                messages.append({"role": role, "content": msg["content"]})
-
-        plan = await self._ai_query_plan(user_model, user_message)
-        matches = self._retrieve_data(plan)
-        logic_matches = await self._dune_logic_lookup(plan)
-        context_parts: List[str] = []
-        if matches:
-            context_parts.append(f"GameData:\n{self._game_context_json(matches)}")
-        if logic_matches.get("logic"):
-            context_parts.append("LogicData:\n" + json.dumps(logic_matches, ensure_ascii=False, indent=2))
-        if context_parts:
-            guardrails = (
-                "When the question concerns items, gear, or stats, use ONLY the following GameData JSON "
-                "for concrete names or numbers. If an asked-for item is missing, say so briefly and ask a short follow-up. "
-                "Do not comment about GameData if the user wasn't asking about items. DuneLogic search results are provided as additional context."
-            )
-            messages.append({"role": "system", "content": guardrails + "\n\n" + "\n\n".join(context_parts)})
+                history.append({"role": role, "content": msg["content"]})
 
-        messages.append({"role": "user", "content": user_message})
+        spec_matches: Dict[str, Any] = {}
+        spec_context: asyncio.Task | None = None
+        spec_logic: Dict[tuple, asyncio.Task] = {}
+        if self.config.pipeline_retrieval:
+            spec_matches, spec_context, spec_logic = self._start_speculative_retrieval(user_message)
+        try:
+            plan = await self._ai_query_plan(user_model, user_message, guild_id, user_id)
+            with loop_monitor.stage("retrieve_data"):
+                matches = self._retrieve_data(plan, user_message)
+            logic_matches = await self._dune_logic_lookup(plan, spec_logic)
+            game_json = ""
+            if self.config.prompt_layout == "stable":
+                if spec_context is not None and set(matches) & set(spec_matches):
+                    # Let the worker thread finish warming the shared file JSON.
+                    await spec_context
+                # Serialize any files not warmed yet off the loop.
+                await offload.run(self._static_context, matches, stage="static_context")
+            elif matches:
+                if spec_context is not None and list(matches) == list(spec_matches):
+                    game_json = await spec_context
+                else:
+                    game_json = await offload.run(self._game_context_json, matches, stage="game_context_json")
+        finally:
+            if spec_context is not None and not spec_context.done():
+                spec_context.cancel()
+            for task in spec_logic.values():
+                task.cancel()
+        extra_parts: List[str] = []
+        sources: Dict[str, int] = {}
+        with loop_monitor.stage("build_prompt"):
+            crafting = self._crafting_context(user_message)
+            if crafting:
+                extra_parts.append("CraftingData (computed totals, use these numbers):\n" + json.dumps(crafting, ensure_ascii=False, indent=2))
+                sources["crafting"] = len(extra_parts[-1])
+            if logic_matches.get("logic"):
+                extra_parts.append("LogicData:\n" + json.dumps(logic_matches, ensure_ascii=False, indent=2))
+                sources["dune_logic"] = len(extra_parts[-1])
+            messages = self._layout_messages(system_prompt, history, matches, game_json, extra_parts, user_message)
+            sources.update(self._context_sources(matches, game_json, history))
 
         try:
-            ai_response = await self.api_client.send_message(messages, user_model)
+            ai_response = await self.api_client.send_message(messages, user_model, guild_id, user_id, sources=sources)
             if not ai_response or not ai_response.strip():
-                await message.channel.send(f"<@{user_id}> Error: Empty response from API")
+                await send_queue.send(message.channel, f"<@{user_id}> Error: Empty response from API")
                 return
         except Exception as e:
-            await message.channel.send(f"<@{user_id}> Error: Failed to fetch response - {e}")
+            await send_queue.send(message.channel, f"<@{user_id}> Error: Failed to fetch response - {e}")
             return
 
         ai_response_clean = self.clean_response(ai_response) or "Got it."
         final_message = self.build_message(ai_response_clean)
+        if committed is not None:
+            committed.set()
         await self._send_message(message, user_id, final_message, user_message.lower())
 
     def clean_response(self, text: str) -> str:
@@ -427,37 +724,18 @@ class MessageHandler:
         return {"content": "\n".join(text_lines).strip(), "images": image_urls}
 
     async def _send_message(self, message, user_id: str, final_message: Dict[str, Any], user_message_lower: str):
-        files = []
-        for url in final_message.get("images", []):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as resp:
-                        if resp.status == 200:
-                            data = await resp.read()
-                            filename = url.split("/")[-1].split("?")[0] or "image.png"
-                            if not re.search(r"\.(png|jpg|jpeg|gif|webp)$", filename, re.IGNORECASE):
-                                filename += ".png"
-                            files.append(discord.File(BytesIO(data), filename=filename))
-            except Exception as e:
-                logger.warning(f"Failed to fetch image {url}: {e}")
+        # Downscaled, re-encoded and cached per URL before upload.
+        files = await image_pipeline.fetch_all(final_message.get("images", []))
 
         content = final_message.get("content", "")
         if not content and not files:
-            await message.channel.send(f"<@{user_id}> (No content)")
+            await send_queue.send(message.channel, f"<@{user_id}> (No content)")
             return
 
-        if content and len(content) <= 2000:
-            await message.channel.send(content, files=files if files else None)
-        elif content and len(content) <= 4096:
-            embed = discord.Embed(description=content[:4096])
-            await message.channel.send(embed=embed, files=files if files else None)
-        else:
-            if content:
-                buffer = BytesIO(content.encode("utf-8"))
-                text_file = discord.File(buffer, filename="response.txt")
-                files = files + [text_file]
-            await message.channel.send(f"<@{user_id}> Response too long, attached as file and images:", files=files)
+        # Long answers go out as several messages, split on markdown and code-block boundaries.
+        await send_queue.send_text(message.channel, content, files=files or None)
 
         if content.strip():
             guild_id = str(message.guild.id) if message.guild else "DM"
             self.memory_manager.add_ai_message(str(message.channel.id), guild_id, user_id, content)
+            self.memory_manager.schedule_compaction(guild_id, user_id, self.memory_manager.get_user_model(guild_id, user_id))
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from loop_monitor import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+class Offload:
+    """Run CPU-heavy steps off the event loop.
+
+    ``mode`` is ``thread`` (a thread pool, also installed as the loop's
+    default executor so ``asyncio.to_thread`` shares it), ``process`` (the
+    same, plus a process pool for picklable pure functions passed with
+    ``cpu=True``) or ``inline`` (run on the loop, for debugging).
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 4):
+        self.threads: Optional[ThreadPoolExecutor] = None
+        self.processes: Optional[ProcessPoolExecutor] = None
+        self.configure(mode, workers)
+
+    def configure(self, mode: str, workers: int) -> None:
+        """Set mode and pool size; takes effect at :meth:`install`."""
+        self.mode = mode if mode in {"thread", "process", "inline"} else "thread"
+        self.workers = max(int(workers), 1)
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.mode == "inline" or self.threads is not None:
+            return
+        self.threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offload")
+        loop.set_default_executor(self.threads)
+        if self.mode == "process":
+            self.processes = ProcessPoolExecutor(max_workers=self.workers)
+        logger.info(f"Offloading CPU work to {self.mode} pool ({self.workers} workers)")
+
+    @property
+    def cpu_executor(self) -> Optional[Executor]:
+        """Executor for picklable pure functions (None means the default thread pool)."""
+        return self.processes
+
+    async def run(self, func: Callable[..., Any], *args: Any, stage: str = "", cpu: bool = False, **kwargs: Any) -> Any:
+        call = partial(func, *args, **kwargs)
+        if self.mode == "inline":
+            with loop_monitor.stage(stage or getattr(func, "__name__", "offload")):
+                return call()
+        executor = self.processes if cpu else None
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def shutdown(self) -> None:
+        for pool in (self.threads, self.processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+offload = Offload()
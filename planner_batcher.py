@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Appended to the planner instructions for a batched call.
+BATCH_INSTRUCTIONS = (
+    "BATCH MODE: instead of one \"User question\" you receive a \"Questions\" list of JSON objects, "
+    "each with an \"id\" and a \"question\". Plan every question independently by the rules above and "
+    "return ONLY a JSON array with one object per question: "
+    "{\"id\": \"<the question's id>\", \"files\": [...], \"keywords\": [...], \"logic\": [...]}."
+)
+
+def parse_batch(text: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Plans by question id from a batched planner reply.
+
+    Entries that are not objects, carry an unknown id or have none of the
+    plan keys are left out, so their callers can fall back on their own.
+    """
+    m = re.search(r"\[[\s\S]*\]", text or "")
+    if not m:
+        return {}
+    try:
+        entries = json.loads(m.group(0))
+    except ValueError:
+        return {}
+    wanted = set(ids)
+    plans: Dict[str, Dict[str, Any]] = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        qid = str(entry.get("id", ""))
+        if qid in wanted and qid not in plans and any(isinstance(entry.get(k), list) for k in ("files", "keywords", "logic")):
+            plans[qid] = {k: entry[k] for k in ("files", "keywords", "logic") if isinstance(entry.get(k), list)}
+    return plans
+
+class _Batch:
+    __slots__ = ("items", "task", "full")
+
+    def __init__(self):
+        # (question id, question, future resolving to the raw plan or None)
+        self.items: List[Tuple[str, str, asyncio.Future]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.full = asyncio.Event()
+
+class PlannerBatcher:
+    """Collect planner requests for a short window and plan them in one call.
+
+    The first request for a model opens a ``window_ms`` window; requests for
+    the same model that arrive before it closes (up to ``max_batch``) join
+    it. ``run(model, questions)`` then makes a single upstream call over
+    ``[(id, question), ...]`` and returns its raw text. Each waiter gets its
+    own plan back, or None when the reply was invalid or left it out, in
+    which case the caller plans that question on its own.
+    """
+
+    def __init__(self, run: Callable[[str, List[Tuple[str, str]]], Awaitable[str]], window_ms: float, max_batch: int = 8):
+        self.run = run
+        self.window = window_ms / 1000
+        self.max_batch = max(int(max_batch), 2)
+        self.open: Dict[str, _Batch] = {}
+        self._ids = 0
+        # failed: batch calls that errored or timed out (all their questions fall
+        # back); omitted: questions a valid reply left out or garbled.
+        self.stats = {"batches": 0, "batched": 0, "singles": 0, "failed": 0, "omitted": 0}
+
+    async def plan(self, model: str, question: str) -> Optional[Dict[str, Any]]:
+        batch = self.open.get(model)
+        if batch is None:
+            batch = self.open[model] = _Batch()
+            batch.task = asyncio.create_task(self._flush(model, batch))
+        self._ids += 1
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append((f"q{self._ids}", question, future))
+        if len(batch.items) >= self.max_batch:
+            batch.full.set()
+        try:
+            # A cancelled waiter must not cancel the call the others share.
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Drop the question from the batch if it has not been sent yet.
+            future.cancel()
+            raise
+
+    async def _flush(self, model: str, batch: _Batch) -> None:
+        try:
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            if self.open.get(model) is batch:
+                del self.open[model]
+            items = [item for item in batch.items if not item[2].done()]
+            if len(items) < 2:
+                # Nothing to share the call with: the caller's own planner call is cheaper than a batch prompt.
+                self.stats["singles"] += len(items)
+                for _, _, future in items:
+                    future.set_result(None)
+                return
+            self.stats["batches"] += 1
+            self.stats["batched"] += len(items)
+            plans: Dict[str, Dict[str, Any]] = {}
+            try:
+                out = await self.run(model, [(qid, question) for qid, question, _ in items])
+            except Exception as e:
+                out = f"Error: {e}"
+            if isinstance(out, str) and not out.startswith("Error:"):
+                plans = parse_batch(out, [qid for qid, _, _ in items])
+                missing = len(items) - len(plans)
+                self.stats["omitted"] += missing
+                logger.info(f"Planned {len(items)} questions in one call ({missing} falling back to single calls)")
+            else:
+                self.stats["failed"] += 1
+                logger.warning(f"Batched planner call for {len(items)} questions failed, planning each alone: {str(out)[:120]}")
+            for qid, _, future in items:
+                if not future.done():
+                    future.set_result(plans.get(qid))
+        finally:
+            if self.open.get(model) is batch:
+                del self.open[model]
+            for _, _, future in batch.items:
+                if not future.done():
+                    future.set_result(None)
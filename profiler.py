@@ -0,0 +1,138 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from offload import offload
+
+logger = logging.getLogger(__name__)
+
+def _frame_name(code) -> str:
+    # No spaces or semicolons, so the collapsed format stays unambiguous.
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}".replace(";", ",").replace(" ", "_")
+
+class SamplingProfiler:
+    """Low-overhead stack sampler for the running bot.
+
+    A background thread samples every thread's stack each ``interval_ms``
+    (the event loop and the executor workers alike). Samples on the loop
+    thread are rooted under the asyncio task that was running. Results are
+    written to ``logs/`` as flamegraph-compatible collapsed stacks plus a
+    top-functions table. :meth:`trace` gives a deterministic cProfile of a
+    single call instead.
+    """
+
+    def __init__(self, out_dir: str = "logs", interval_ms: float = 5):
+        self.out_dir = out_dir
+        self.interval = interval_ms / 1000
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self.running = False
+        # Set by !profile next: the next handled message gets a deterministic profile.
+        self.trace_next = False
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+
+    def _sample(self, seconds: float) -> Tuple[Counter, int]:
+        stacks: Counter = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                root = [names.get(ident, f"thread-{ident}").replace(" ", "_")]
+                if ident == self._loop_thread and self.loop is not None:
+                    task = asyncio.current_task(self.loop)
+                    root.append(f"task:{task.get_name() if task else 'loop'}".replace(" ", "_"))
+                stacks[";".join(root + stack[::-1])] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    def _write(self, stacks: Counter, samples: int, seconds: float) -> Dict[str, Any]:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        collapsed = os.path.join(self.out_dir, f"profile-{stamp}.collapsed")
+        with open(collapsed, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        table = os.path.join(self.out_dir, f"profile-{stamp}-top.txt")
+        all_samples = sum(stacks.values()) or 1
+        with open(table, "w", encoding="utf-8") as f:
+            f.write(f"{samples} sampling rounds over {seconds:.0f}s, {all_samples} thread stacks\n\n")
+            f.write(f"{'self%':>7} {'total%':>7}  function\n")
+            for name, count in own.most_common(50):
+                f.write(f"{100 * count / all_samples:7.2f} {100 * total[name] / all_samples:7.2f}  {name}\n")
+        return {"collapsed": collapsed, "top": table, "top_lines": [name for name, _ in own.most_common(5)]}
+
+    async def run(self, seconds: float) -> Dict[str, Any]:
+        """Sample for ``seconds`` and write the reports; returns their paths."""
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        if self.loop is None:
+            self.attach(asyncio.get_running_loop())
+        self.running = True
+        try:
+            logger.info(f"Sampling profiler started for {seconds:.0f}s")
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+
+            def work():
+                try:
+                    result = self._sample(seconds)
+                    loop.call_soon_threadsafe(lambda: done.done() or done.set_result(result))
+                except Exception as e:
+                    loop.call_soon_threadsafe(lambda: done.done() or done.set_exception(e))
+
+            # A dedicated thread, so the sampler never occupies an offload worker.
+            threading.Thread(target=work, name="profiler", daemon=True).start()
+            stacks, samples = await done
+            result = await offload.run(self._write, stacks, samples, seconds, stage="profile_write")
+            logger.info(f"Sampling profile written to {result['collapsed']} and {result['top']}")
+            return result
+        finally:
+            self.running = False
+
+    @contextmanager
+    def trace(self, label: str):
+        """Deterministically profile the enclosed block (other tasks that run
+        on the loop while it awaits are included too)."""
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            base = os.path.join(self.out_dir, f"profile-{stamp}-{label}")
+            prof.dump_stats(f"{base}.prof")
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(40)
+            with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                f.write(out.getvalue())
+            logger.info(f"Deterministic profile of {label} written to {base}.txt")
+
+profiler = SamplingProfiler()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, Deque
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Client-side token bucket shared by every upstream LLM call.
+
+    Requests that cannot be served immediately are queued per guild and per
+    user and released round-robin (first across guilds, then across users in
+    a guild) so one busy user or server cannot starve the others. The refill
+    rate halves whenever the upstream answers 429 and creeps back up after
+    successful calls, and ``X-RateLimit-*`` / ``Retry-After`` headers are used
+    to pause the bucket instead of burning retries.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float | None = None):
+        self.max_rate = max(rate, 0.01)
+        self.rate = self.max_rate
+        self.min_rate = min_rate if min_rate else self.max_rate / 8
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # guild -> user -> queue of waiting futures; dict order is the
+        # round-robin order of users inside a guild.
+        self.waiters: Dict[str, Dict[str, Deque[asyncio.Future]]] = {}
+        self.guild_order: Deque[str] = deque()
+        self._pump_task: asyncio.Task | None = None
+        self.stats = {"granted": 0, "queued": 0, "throttled": 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pending(self) -> int:
+        return sum(len(q) for users in self.waiters.values() for q in users.values())
+
+    async def acquire(self, guild_id: str = "global", user_id: str = "") -> None:
+        guild_id = str(guild_id)
+        user_id = str(user_id)
+        self._refill()
+        if not self.guild_order and self.tokens >= 1 and time.monotonic() >= self.blocked_until:
+            self.tokens -= 1
+            self.stats["granted"] += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        users = self.waiters.get(guild_id)
+        if users is None:
+            users = self.waiters[guild_id] = {}
+            self.guild_order.append(guild_id)
+        users.setdefault(user_id, deque()).append(fut)
+        self.stats["queued"] += 1
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted by _pump just before the cancel landed: hand the token back.
+                self.tokens += 1
+            else:
+                self._discard(guild_id, user_id, fut)
+            raise
+
+    def _discard(self, guild_id: str, user_id: str, fut: asyncio.Future) -> None:
+        users = self.waiters.get(guild_id)
+        if not users or user_id not in users:
+            return
+        try:
+            users[user_id].remove(fut)
+        except ValueError:
+            pass
+        if not users[user_id]:
+            del users[user_id]
+        if not users:
+            del self.waiters[guild_id]
+            try:
+                self.guild_order.remove(guild_id)
+            except ValueError:
+                pass
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        guild_id = self.guild_order.popleft()
+        users = self.waiters[guild_id]
+        user_id = next(iter(users))
+        queue = users.pop(user_id)
+        fut = queue.popleft()
+        if queue:
+            # Re-insert at the end so the next user in this guild goes first.
+            users[user_id] = queue
+        if users:
+            self.guild_order.append(guild_id)
+        else:
+            del self.waiters[guild_id]
+        return fut
+
+    async def _pump(self) -> None:
+        while self.guild_order:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            fut = self._next_waiter()
+            if fut is None or fut.done():
+                continue
+            self.tokens -= 1
+            self.stats["granted"] += 1
+            fut.set_result(None)
+
+    def on_success(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttled(self, retry_after: float | None = None) -> None:
+        self.stats["throttled"] += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        delay = retry_after if retry_after and retry_after > 0 else 1 / self.rate
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        logger.warning(f"Upstream throttled, rate now {self.rate:.2f}/s, pausing {delay:.2f}s")
+
+    def update_from_headers(self, headers: Any) -> None:
+        """Adjust the bucket from rate-limit headers on any upstream response."""
+
+        if not headers:
+            return
+        remaining = _parse_number(headers.get("X-RateLimit-Remaining"))
+        reset = _parse_number(headers.get("X-RateLimit-Reset"))
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+            if remaining <= 0 and reset:
+                # Some providers send an epoch timestamp, others seconds.
+                delay = reset - time.time() if reset > 1e9 else reset
+                if delay > 0:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+def _parse_number(value: Any) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_retry_after(headers: Any) -> float | None:
+    if not headers:
+        return None
+    return _parse_number(headers.get("Retry-After"))
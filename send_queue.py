@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Discord's per-message content limit.
+MESSAGE_LIMIT = 2000
+
+_FENCE = re.compile(r"^\s*(```|~~~)")
+
+def _wrap(line: str, width: int) -> List[str]:
+    """Break a single over-long line at spaces (or hard, when there are none)."""
+    out = []
+    while len(line) > width:
+        cut = line.rfind(" ", width // 2, width)
+        cut = cut if cut > 0 else width
+        out.append(line[:cut])
+        line = line[cut:].lstrip(" ")
+    out.append(line)
+    return out
+
+def _render(body: List[Tuple[str, str]], head: str) -> str:
+    lines = ([head] if head else []) + [line for line, _ in body]
+    text = "\n".join(lines).strip("\n")
+    fence = body[-1][1] if body else head
+    if fence:
+        text += "\n" + fence.lstrip()[:3]
+    return text
+
+def _length(body: List[Tuple[str, str]], head: str) -> int:
+    n = sum(len(line) + 1 for line, _ in body) - 1 + (len(head) + 1 if head else 0)
+    return n + (4 if body and body[-1][1] else 0)
+
+def _break_point(body: List[Tuple[str, str]], head: str, limit: int) -> int:
+    """How many lines of ``body`` to emit: the latest paragraph, heading or
+    code-block boundary in the second half that fits, else as many as fit."""
+    fits = [n for n in range(len(body) - 1, 0, -1) if _length(body[:n], head) <= limit]
+    if not fits:
+        return 1
+    for n in fits:
+        if n < fits[0] // 2:
+            break
+        line, fence = body[n - 1]
+        closes_code = not fence and _FENCE.match(line) and (n < 2 or body[n - 2][1])
+        if (not fence and not line.strip()) or closes_code or body[n][0].startswith("#"):
+            return n
+    return fits[0]
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split ``text`` into Discord-sized messages along markdown boundaries.
+
+    Prefers paragraph breaks, headings and the ends of code blocks. A code
+    block that has to be cut is closed at the end of one message and
+    reopened with the same fence (and language) at the top of the next.
+    """
+    if len(text) <= limit:
+        return [text] if text.strip() else []
+    lines: List[str] = []
+    for line in text.split("\n"):
+        # Leave room for a reopened fence line and a closing fence.
+        lines.extend(_wrap(line, limit - 32))
+    chunks: List[str] = []
+    body: List[Tuple[str, str]] = []  # (line, fence still open after it)
+    head = ""  # fence reopened at the top of the current chunk
+    fence = ""
+    for line in lines:
+        if _FENCE.match(line):
+            fence = "" if fence else line.strip()
+        body.append((line, fence))
+        while len(body) > 1 and _length(body, head) > limit:
+            n = _break_point(body, head, limit)
+            chunks.append(_render(body[:n], head))
+            head = body[n - 1][1]
+            body = body[n:]
+    if body:
+        chunks.append(_render(body, head))
+    return [c for c in chunks if c.strip()]
+
+class _Bucket:
+    """Token bucket allowing ``capacity`` requests per ``per`` seconds."""
+
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class _Job:
+    __slots__ = ("kind", "target", "kwargs", "future")
+
+    def __init__(self, kind: str, target: Any, kwargs: Dict[str, Any]):
+        self.kind = kind
+        self.target = target
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+
+class _Lane:
+    __slots__ = ("jobs", "edits", "bucket", "task")
+
+    def __init__(self, bucket: _Bucket):
+        self.jobs: Deque[_Job] = deque()
+        # message id -> queued edit job, so later edits replace it
+        self.edits: Dict[int, _Job] = {}
+        self.bucket = bucket
+        self.task: Optional[asyncio.Task] = None
+
+class SendQueue:
+    """Ordered, paced outbound messages and edits, one lane per channel.
+
+    Each channel's sends and edits go out in order from a single worker.
+    Before each request, per-channel and global token buckets (sized to
+    Discord's documented limits) are consulted, so bursts are spread out
+    instead of tripping 429s. An edit queued while an earlier edit of the
+    same message is still waiting replaces that edit's content.
+    """
+
+    def __init__(self, channel_rate: Tuple[int, float] = (5, 5.0), global_rate: Tuple[int, float] = (50, 1.0)):
+        self.channel_rate = channel_rate
+        self.global_bucket = _Bucket(*global_rate)
+        self.lanes: Dict[Any, _Lane] = {}
+        self.stats = {"sent": 0, "edits": 0, "merged_edits": 0, "split": 0, "paced_ms": 0}
+
+    def _lane(self, channel: Any) -> _Lane:
+        key = getattr(channel, "id", None) or id(channel)
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = _Lane(_Bucket(*self.channel_rate))
+        return lane
+
+    def _push(self, lane: _Lane, job: _Job) -> asyncio.Future:
+        lane.jobs.append(job)
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._drain(lane))
+        return job.future
+
+    async def _drain(self, lane: _Lane) -> None:
+        while lane.jobs:
+            job = lane.jobs.popleft()
+            wait = max(self.global_bucket.reserve(), lane.bucket.reserve())
+            if wait:
+                self.stats["paced_ms"] += int(wait * 1000)
+                await asyncio.sleep(wait)
+            if job.kind == "edit":
+                # Later edits were merged into this job while it waited.
+                lane.edits.pop(job.target.id, None)
+            try:
+                if job.kind == "send":
+                    result = await job.target.send(**job.kwargs)
+                    self.stats["sent"] += 1
+                else:
+                    result = await job.target.edit(**job.kwargs)
+                    self.stats["edits"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            except Exception as e:
+                logger.warning(f"Failed to {job.kind} message: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    def enqueue(self, channel: Any, **kwargs) -> asyncio.Future:
+        """Queue ``channel.send(**kwargs)``; the future resolves to the sent message."""
+        return self._push(self._lane(getattr(channel, "channel", channel)), _Job("send", channel, kwargs))
+
+    async def send(self, channel: Any, content: Optional[str] = None, **kwargs) -> Any:
+        return await self.enqueue(channel, content=content, **kwargs)
+
+    async def send_text(self, channel: Any, text: str, files: Optional[list] = None, **kwargs) -> List[Any]:
+        """Send ``text`` split into Discord-sized messages, in order.
+
+        Files are attached to the last message so they follow the text.
+        """
+        chunks = split_message(text) or [None]
+        if len(chunks) > 1:
+            self.stats["split"] += 1
+        futures = [
+            self.enqueue(channel, content=chunk, files=files if (files and i == len(chunks) - 1) else None, **kwargs)
+            for i, chunk in enumerate(chunks)
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def edit(self, message: Any, **kwargs) -> asyncio.Future:
+        """Queue ``message.edit(**kwargs)``, merging with a still-queued edit of it."""
+        lane = self._lane(message.channel)
+        pending = lane.edits.get(message.id)
+        if pending is not None:
+            pending.kwargs.update(kwargs)
+            self.stats["merged_edits"] += 1
+            return pending.future
+        job = lane.edits[message.id] = _Job("edit", message, kwargs)
+        return self._push(lane, job)
+
+send_queue = SendQueue()
@@ -0,0 +1,294 @@
+import re
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_QUANTITY_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*([a-zA-Z%]*)\s*$")
+
+# Unit suffix -> multiplier into the column's canonical unit
+# (rounds per minute, seconds, meters).
+UNIT_SCALE = {
+    "": 1.0, "%": 1.0,
+    "rpm": 1.0,
+    "s": 1.0, "sec": 1.0, "second": 1.0, "seconds": 1.0,
+    "m": 1.0, "meter": 1.0, "meters": 1.0,
+}
+
+RANKING_TERMS = {
+    "best", "highest", "most", "top", "fastest", "strongest", "lowest", "least",
+    "worst", "rank", "ranking", "compare", "max", "maximum", "min", "minimum", "biggest",
+}
+# Raw-value directions: "lowest reload" means the smallest number whatever
+# the column. Only "best"/"worst" depend on LOWER_IS_BETTER.
+ASCENDING_TERMS = {"lowest", "least", "min", "minimum"}
+DESCENDING_TERMS = {"highest", "most", "max", "maximum", "biggest"}
+
+# Columns where a smaller number is the better one.
+LOWER_IS_BETTER = {"reload_s", "volume", "volume_v", "dash_stamina_cost_pct", "power_consumption_per_sec"}
+
+# (phrase in the question, column) per table, checked in order so more
+# specific phrases win over generic ones such as "damage".
+METRIC_PHRASES = {
+    "weapons": [
+        ("shield dps", "shield_dps"), ("shield damage", "shield_damage"),
+        ("damage per second", "dps"), ("dps", "dps"),
+        ("damage per clip", "damage_per_clip"), ("clip damage", "damage_per_clip"),
+        ("magazine", "clip_size"), ("clip", "clip_size"),
+        ("fire rate", "rate_of_fire_rpm"), ("rate of fire", "rate_of_fire_rpm"), ("rpm", "rate_of_fire_rpm"),
+        ("range", "range_m"), ("reload", "reload_s"),
+        ("precision", "precision"), ("accuracy", "precision"), ("stability", "stability"),
+        ("damage", "damage_per_shot"),
+    ],
+    "armor": [
+        ("heat", "heat_protection"), ("stamina", "dash_stamina_cost_pct"),
+        ("light dart", "light_dart_mitigation_pct"), ("heavy dart", "heavy_dart_mitigation_pct"),
+        ("blade", "blade_mitigation_pct"), ("concussive", "concussive_mitigation_pct"),
+        ("fire", "fire_mitigation_pct"), ("poison", "poison_mitigation_pct"),
+        ("radiation", "radiation_mitigation_pct"), ("energy", "energy_mitigation_pct"),
+        ("chemical", "chemical_mitigation_pct"), ("catchpocket", "catchpocket_size"),
+        ("hydration", "hydration_capture_pct"), ("armor", "armor_value"),
+    ],
+    "vehicles": [
+        ("glide", "glide_speed_kmh"), ("speed", "speed_kmh"), ("fastest", "speed_kmh"),
+        ("fuel efficiency", "fuel_efficiency"), ("fuel", "fuel_capacity"),
+        ("durability", "durability"), ("armor", "armor"), ("storage", "max_volume"),
+        ("thrust", "thrust_rating"), ("seats", "seats"), ("agility", "agility"),
+        ("power", "power_consumption_per_sec"),
+    ],
+}
+
+def parse_quantity(value: Any) -> float:
+    """Parse numbers like ``"313 RPM"`` or ``"1.54754 seconds"`` into floats.
+
+    Qualitative values ("high", "melee", "large") and unknown units become NaN.
+    """
+
+    if isinstance(value, bool):
+        return float("nan")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        m = _QUANTITY_RE.match(value.replace(",", ""))
+        if m:
+            unit = m.group(2).lower()
+            if unit in UNIT_SCALE:
+                return float(m.group(1)) * UNIT_SCALE[unit]
+    return float("nan")
+
+class StatsTable:
+    """Column-oriented view of one stats domain.
+
+    ``columns`` hold float64 arrays (NaN where a value is missing or not
+    numeric) and ``labels`` hold string arrays used for filtering.
+    """
+
+    def __init__(self, name: str, records: List[Dict[str, Any]], label_fields: Sequence[str],
+                 numeric_fields: Dict[str, str] | None = None, aliases: Dict[str, Sequence[str]] | None = None):
+        self.name = name
+        self.names = np.array([str(r.get("name", "")) for r in records], dtype=str)
+        self.labels: Dict[str, np.ndarray] = {
+            f: np.array([str(r.get(f, "") or "") for r in records], dtype=str) for f in label_fields
+        }
+        self._labels_lower = {f: np.char.lower(v) for f, v in self.labels.items()}
+        if numeric_fields is None:
+            # Every field that is numeric in at least one record.
+            numeric_fields = {}
+            for r in records:
+                for k, v in r.items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        numeric_fields.setdefault(k, k)
+        self.columns: Dict[str, np.ndarray] = {
+            col: np.array([parse_quantity(r.get(src)) for r in records], dtype=np.float64)
+            for col, src in numeric_fields.items()
+        }
+        # Regex per distinct label value (plus aliases such as "shotgun" for
+        # "scatterguns"), used to spot filters in free text. Values that just
+        # repeat the table name would match every question, so skip them.
+        generic = {"", "unknown", "n/a", name, name.rstrip("s")}
+        aliases = aliases or {}
+        self._label_patterns: List[Tuple[str, str, re.Pattern]] = []
+        for field, values in self._labels_lower.items():
+            for value in sorted(set(values.tolist())):
+                if value in generic:
+                    continue
+                phrases = [value[:-1] if value.endswith("s") and len(value) > 3 else value]
+                phrases += list(aliases.get(value, []))
+                pattern = re.compile(r"\b(" + "|".join(map(re.escape, phrases)) + r")s?\b")
+                self._label_patterns.append((field, value, pattern))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def detect_filters(self, text: str) -> Dict[str, List[str]]:
+        filters: Dict[str, List[str]] = {}
+        for field, value, pattern in self._label_patterns:
+            if pattern.search(text):
+                filters.setdefault(field, []).append(value)
+        return filters
+
+    def mask(self, filters: Dict[str, Sequence[str]] | None = None) -> np.ndarray:
+        mask = np.ones(len(self.names), dtype=bool)
+        for field, values in (filters or {}).items():
+            if field in self._labels_lower:
+                mask &= np.isin(self._labels_lower[field], [v.lower() for v in values])
+        return mask
+
+    def row(self, i: int) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"name": str(self.names[i])}
+        for field, values in self.labels.items():
+            if values[i]:
+                out[field] = str(values[i])
+        for col, values in self.columns.items():
+            if not np.isnan(values[i]):
+                out[col] = round(float(values[i]), 3)
+        return out
+
+    def top(self, metric: str, k: int = 5, filters: Dict[str, Sequence[str]] | None = None,
+            ascending: bool | None = None) -> List[Dict[str, Any]]:
+        if metric not in self.columns:
+            raise KeyError(f"Unknown metric {metric} for {self.name}")
+        if ascending is None:
+            ascending = metric in LOWER_IS_BETTER
+        values = self.columns[metric]
+        idx = np.nonzero(self.mask(filters) & ~np.isnan(values))[0]
+        order = np.argsort(values[idx], kind="stable")
+        if not ascending:
+            order = order[::-1]
+        return [self.row(int(i)) for i in idx[order[:k]]]
+
+def _weapon_table(data: Dict[str, Any]) -> StatsTable:
+    records = []
+    for group, entries in (data.get("weapons") or {}).items():
+        if not isinstance(entries, dict):
+            continue
+        for key, entry in entries.items():
+            if not isinstance(entry, dict):
+                continue
+            rec = dict(entry)
+            rec.setdefault("name", key)
+            category = str(entry.get("category") or group)
+            rec["class"] = category.split(" - ", 1)[1] if " - " in category else category
+            # Melee "APS" rates are not comparable to firearm RPM, keep them apart.
+            rof = str(entry.get("rate_of_fire", ""))
+            if rof.lower().endswith("aps"):
+                rec["attack_rate_aps"] = rof[:-3]
+                rec["rate_of_fire"] = None
+            records.append(rec)
+    table = StatsTable(
+        "weapons", records,
+        label_fields=["class", "tier", "damage_type", "fire_mode", "ammo_type"],
+        numeric_fields={
+            "damage_per_shot": "damage_per_shot",
+            "shield_damage": "shield_damage",
+            "rate_of_fire_rpm": "rate_of_fire",
+            "attack_rate_aps": "attack_rate_aps",
+            "clip_size": "clip_size",
+            "reload_s": "reload_speed",
+            "range_m": "effective_range",
+            "precision": "precision",
+            "stability": "stability",
+        },
+        aliases={"scatterguns": ["shotgun"], "sidearms": ["pistol"]},
+    )
+    c = table.columns
+    c["dps"] = c["damage_per_shot"] * c["rate_of_fire_rpm"] / 60.0
+    c["shield_dps"] = c["shield_damage"] * c["rate_of_fire_rpm"] / 60.0
+    c["damage_per_clip"] = c["damage_per_shot"] * c["clip_size"]
+    return table
+
+def _armor_table(data: Dict[str, Any]) -> StatsTable:
+    records = []
+    for entry in data.get("armor_items") or []:
+        if not isinstance(entry, dict):
+            continue
+        rec = {k: v for k, v in entry.items() if not isinstance(v, (dict, list))}
+        rec.update(entry.get("stats") or {})
+        records.append(rec)
+    return StatsTable("armor", records, label_fields=["set", "slot", "type"])
+
+def _vehicle_table(data: Dict[str, Any]) -> StatsTable:
+    records = []
+    for vehicle, parts in (data.get("parts") or {}).items():
+        for part in parts or []:
+            if not isinstance(part, dict):
+                continue
+            rec = {k: v for k, v in part.items() if not isinstance(v, (dict, list))}
+            rec["vehicle"] = vehicle.replace("_", " ")
+            records.append(rec)
+    return StatsTable("vehicles", records, label_fields=["vehicle", "category"])
+
+class StatsEngine:
+    """Typed stats tables built from the weapons, armor and vehicles files.
+
+    Used to answer ranking questions ("highest DPS sidearm") with exact
+    numbers instead of handing the whole file to the LLM.
+    """
+
+    BUILDERS = {"weapons": _weapon_table, "armor": _armor_table, "vehicles": _vehicle_table}
+
+    def __init__(self, game_data: Dict[str, Any]):
+        self.tables: Dict[str, StatsTable] = {}
+        for domain, builder in self.BUILDERS.items():
+            data = game_data.get(domain)
+            if not isinstance(data, dict):
+                continue
+            try:
+                self.tables[domain] = builder(data)
+            except Exception as e:
+                logger.error(f"Failed to build stats table for {domain}: {e}")
+        logger.info(
+            "Stats tables: " + ", ".join(f"{d}={len(t)} rows" for d, t in self.tables.items())
+        )
+
+    def detect_metric(self, domain: str, text: str) -> str | None:
+        table = self.tables.get(domain)
+        if table is None:
+            return None
+        for phrase, column in METRIC_PHRASES.get(domain, []):
+            if column in table.columns and re.search(r"\b" + re.escape(phrase) + r"\b", text):
+                return column
+        return None
+
+    def rank(self, domain: str, text: str, k: int = 5, require_ranking_term: bool = True) -> Dict[str, Any] | None:
+        """Rank rows of ``domain`` for a normalized question, or ``None``.
+
+        Returns ``None`` when the text does not ask for a ranking or names
+        no metric this table has.
+        """
+
+        table = self.tables.get(domain)
+        if table is None:
+            return None
+        tokens = set(text.split())
+        if require_ranking_term and not (tokens & RANKING_TERMS):
+            return None
+        metric = self.detect_metric(domain, text)
+        if metric is None:
+            return None
+        if tokens & ASCENDING_TERMS:
+            ascending = True
+        elif tokens & DESCENDING_TERMS:
+            ascending = False
+        else:
+            ascending = (metric in LOWER_IS_BETTER) != ("worst" in tokens)
+        filters = table.detect_filters(text)
+        rows = table.top(metric, k, filters, ascending)
+        return {
+            "metric": metric,
+            "order": "ascending" if ascending else "descending",
+            "filters": filters,
+            "rows": rows,
+        }
+
+    def rank_any(self, text: str, k: int = 5) -> Tuple[str, Dict[str, Any]] | None:
+        """Rank in the first domain with a matching metric (for ``!top``)."""
+
+        domains = sorted(self.tables, key=lambda d: d not in text.split())
+        for domain in domains:
+            result = self.rank(domain, text, k, require_ranking_term=False)
+            if result is not None:
+                return domain, result
+        return None
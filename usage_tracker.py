@@ -0,0 +1,163 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("stage", "model", "guild", "user", "source")
+
+# Rough characters per token, used when the upstream omits ``usage``.
+CHARS_PER_TOKEN = 4
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse ``model=prompt/completion,...`` (USD per million tokens)."""
+    prices: Dict[str, Tuple[float, float]] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, _, rates = item.partition("=")
+        prompt, _, completion = rates.partition("/")
+        try:
+            prices[model.strip().lower()] = (float(prompt), float(completion or prompt))
+        except ValueError:
+            logger.warning(f"Ignoring bad token price {item.strip()!r}")
+    return prices
+
+class UsageTracker:
+    """Token usage and estimated cost, aggregated in memory.
+
+    Each completed call is added under its stage (route), model, guild,
+    ``guild/user`` and every context source the prompt included. The
+    provider only reports prompt tokens in total, so they are split across
+    sources in proportion to the characters each source added. Totals are
+    saved to ``path`` every ``interval`` seconds when they changed.
+
+    Sharded processes each save their own file; ``peers`` is a glob of the
+    files whose totals are added in when reporting.
+    """
+
+    def __init__(self, path: str = "logs/usage_stats.json", prices: Optional[Dict[str, Tuple[float, float]]] = None,
+                 interval: int = 300, peers: str = ""):
+        self.path = path
+        self.peers = peers
+        self.prices = prices or {}
+        self.interval = interval
+        # dimension -> key -> {"calls", "prompt", "completion", "cost", "estimated"}
+        self.totals: Dict[str, Dict[str, Dict[str, float]]] = {d: {} for d in DIMENSIONS}
+        self.since = time.time()
+        self.dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    def cost(self, model: str, prompt: float, completion: float) -> float:
+        rates = self.prices.get(model.lower())
+        if not rates:
+            return 0.0
+        return (prompt * rates[0] + completion * rates[1]) / 1_000_000
+
+    def _add(self, dimension: str, key: str, prompt: float, completion: float, cost: float, estimated: bool) -> None:
+        row = self.totals[dimension].setdefault(key, {"calls": 0, "prompt": 0, "completion": 0, "cost": 0.0, "estimated": 0})
+        row["calls"] += 1
+        row["prompt"] += prompt
+        row["completion"] += completion
+        row["cost"] += cost
+        row["estimated"] += estimated
+
+    def record(self, stage: str, model: str, guild_id: str, user_id: str, usage: Any,
+               prompt_chars: int, completion_chars: int, sources: Optional[Dict[str, int]] = None) -> None:
+        """Add one completed call. ``usage`` is the response's ``usage`` block, if any."""
+        estimated = not isinstance(usage, dict) or "prompt_tokens" not in usage
+        if estimated:
+            prompt = prompt_chars // CHARS_PER_TOKEN
+            completion = completion_chars // CHARS_PER_TOKEN
+        else:
+            prompt = int(usage.get("prompt_tokens") or 0)
+            completion = int(usage.get("completion_tokens") or 0)
+        cost = self.cost(model, prompt, completion)
+        self._add("stage", stage, prompt, completion, cost, estimated)
+        self._add("model", model, prompt, completion, cost, estimated)
+        self._add("guild", guild_id, prompt, completion, cost, estimated)
+        if user_id:
+            self._add("user", f"{guild_id}/{user_id}", prompt, completion, cost, estimated)
+        if sources and prompt_chars:
+            for source, chars in sources.items():
+                share = prompt * min(chars, prompt_chars) / prompt_chars
+                self._add("source", source, round(share), 0, self.cost(model, share, 0), estimated)
+        self.dirty = True
+
+    def combined(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """This process's totals plus the last saved totals of its peers."""
+        if not self.peers:
+            return self.totals
+        out = {d: {k: dict(v) for k, v in self.totals[d].items()} for d in DIMENSIONS}
+        own = os.path.abspath(self.path)
+        for path in glob.glob(self.peers):
+            if os.path.abspath(path) == own:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to read usage stats {path}: {e}")
+                continue
+            for dimension in DIMENSIONS:
+                for key, row in saved.get(dimension, {}).items():
+                    target = out[dimension].setdefault(key, {"calls": 0, "prompt": 0, "completion": 0, "cost": 0.0, "estimated": 0})
+                    for field, value in row.items():
+                        target[field] = target.get(field, 0) + value
+        return out
+
+    def report(self, dimension: str, limit: int = 8, prefix: str = "",
+               totals: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None) -> List[Tuple[str, Dict[str, float]]]:
+        """Top keys of ``dimension`` by prompt plus completion tokens."""
+        totals = totals if totals is not None else self.combined()
+        rows = [(k, v) for k, v in totals.get(dimension, {}).items() if k.startswith(prefix)]
+        rows.sort(key=lambda kv: -(kv[1]["prompt"] + kv[1]["completion"]))
+        return rows[:limit]
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.since = saved.get("since", self.since)
+            for dimension in DIMENSIONS:
+                self.totals[dimension].update(saved.get(dimension, {}))
+        except Exception as e:
+            logger.warning(f"Failed to load usage stats: {e}")
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        try:
+            # Written aside and renamed, so peers never read a half-written file.
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"since": self.since, **self.totals}, f)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except Exception as e:
+            logger.warning(f"Failed to save usage stats: {e}")
+
+    def reset(self) -> None:
+        self.totals = {d: {} for d in DIMENSIONS}
+        self.since = time.time()
+        self.dirty = True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                self.save()
+            except asyncio.CancelledError:
+                self.save()
+                break
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task